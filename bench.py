@@ -0,0 +1,441 @@
+"""
+Microbenchmarks for the memory storage layer.
+
+Usage:
+    python bench.py
+    python bench.py --items 10,1000,100000 --concurrency 1,16 --output after.json
+    python bench.py --output after.json --compare before.json
+    python bench.py --backend fake --compression zlib
+
+Each configuration fills a fresh user's categories to a given size, then
+times backend operations on them: appending a new value, appending a value
+that is already stored, reading a whole category and reading one page. For
+every operation the p50/p99 latency, the payload bytes sent or received and
+the peak memory allocated (traced in a separate single-threaded pass) are
+reported. Payload bytes are the encoded, and possibly compressed, JSON the
+backend writes or fetches: every document and sub-document value crossing a
+Couchbase collection, or every value stored or read by SQLite.
+
+Runs offline against the SQLite backend by default. ``--backend fake`` runs
+the Couchbase backend against an in-process ``FakeCollection``, which shows
+its call and payload costs without a cluster; ``--backend couchbase`` targets
+the configured cluster. Results are written as JSON so runs from different
+commits can be compared.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+from compression import ALGORITHMS, Codec
+from fake_collection import FakeClusterRegistry
+from storage import CouchbaseBackend, create_backend
+
+PAGE_SIZE = 20
+FILL_BATCH = 1000
+
+
+def value_of(size: int, seed: int) -> str:
+    """Build a distinct value of roughly ``size`` characters."""
+    prefix = f"bench value {seed} "
+    return prefix + "x" * max(size - len(prefix), 0)
+
+
+def percentile(samples: list, fraction: float) -> float:
+    """Nearest-rank percentile of sorted samples."""
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+class PayloadMeter:
+    """Encoded payload bytes moved by the current thread's backend calls."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def add(self, value) -> None:
+        """Count a value as the JSON that is stored or sent."""
+        self._local.bytes = getattr(self._local, "bytes", 0) + len(json.dumps(value))
+
+    def take(self) -> int:
+        """Return and reset the bytes counted on this thread."""
+        counted, self._local.bytes = getattr(self._local, "bytes", 0), 0
+        return counted
+
+
+def _stored(value):
+    """Return a sub-document value unconverted."""
+    return value
+
+
+class MeteredCollection:
+    """Couchbase collection proxy counting the documents and paths it sends and fetches."""
+
+    def __init__(self, collection, meter: PayloadMeter):
+        self.collection = collection
+        self.meter = meter
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def get(self, key, *args, **kwargs):
+        result = self.collection.get(key, *args, **kwargs)
+        self.meter.add(result.value)
+        return result
+
+    def get_multi(self, keys, *args, **kwargs):
+        result = self.collection.get_multi(keys, *args, **kwargs)
+        for found in result.results.values():
+            self.meter.add(found.value)
+        return result
+
+    def lookup_in(self, key, specs, *args, **kwargs):
+        result = self.collection.lookup_in(key, specs, *args, **kwargs)
+        for index in range(len(specs)):
+            if result.exists(index):
+                self.meter.add(result.content_as[_stored](index))
+        return result
+
+    def insert(self, key, value, *args, **kwargs):
+        self.meter.add(value)
+        return self.collection.insert(key, value, *args, **kwargs)
+
+    def upsert(self, key, value, *args, **kwargs):
+        self.meter.add(value)
+        return self.collection.upsert(key, value, *args, **kwargs)
+
+    def replace(self, key, value, *args, **kwargs):
+        self.meter.add(value)
+        return self.collection.replace(key, value, *args, **kwargs)
+
+    def upsert_multi(self, documents, *args, **kwargs):
+        for value in documents.values():
+            self.meter.add(value)
+        return self.collection.upsert_multi(documents, *args, **kwargs)
+
+    def mutate_in(self, key, specs, *args, **kwargs):
+        for spec in specs:
+            if len(spec) > 5:
+                self.meter.add(spec[5])
+        return self.collection.mutate_in(key, specs, *args, **kwargs)
+
+
+class MeteredCodec:
+    """
+    Codec proxy counting the encoded values it produces and reads back.
+
+    The SQLite backend stores each value as the JSON of its encoded form, so
+    this is exactly what it writes and fetches. Couchbase decodes sealed
+    chunks and then their items, so it is metered at the collection instead.
+    """
+
+    def __init__(self, codec: Codec, meter: PayloadMeter):
+        self.codec = codec
+        self.meter = meter
+
+    def __getattr__(self, name):
+        return getattr(self.codec, name)
+
+    def encode(self, value):
+        encoded = self.codec.encode(value)
+        self.meter.add(encoded)
+        return encoded
+
+    def decode(self, stored):
+        self.meter.add(stored)
+        return self.codec.decode(stored)
+
+
+class Workload:
+    """The benchmarked operations on one prefilled user."""
+
+    def __init__(
+        self, backend, meter: PayloadMeter, user_id: str, items: int, categories: int, value_size: int
+    ):
+        """
+        Args:
+            backend (MemoryBackend): Backend under test
+            meter (PayloadMeter): Counts the backend's payload bytes
+            user_id (str): Fresh user the categories are created for
+            items (int): Items stored per category before timing starts
+            categories (int): Number of categories
+            value_size (int): Characters per stored value
+        """
+        self.backend = backend
+        self.meter = meter
+        self.user_id = user_id
+        self.items = items
+        self.categories = [f"category_{index}" for index in range(categories)]
+        self.value_size = value_size
+        self._next = items
+        self._lock = threading.Lock()
+
+    def fill(self) -> None:
+        """Store ``items`` values in every category."""
+        for category in self.categories:
+            for start in range(0, self.items, FILL_BATCH):
+                stop = min(start + FILL_BATCH, self.items)
+                values = [value_of(self.value_size, seed) for seed in range(start, stop)]
+                self.backend.append_many(self.user_id, category, values)
+
+    def _seed(self) -> int:
+        with self._lock:
+            self._next += 1
+            return self._next
+
+    def _measured(self, call, *args) -> int:
+        """Run a backend call and return the payload bytes it moved."""
+        self.meter.take()
+        call(*args)
+        return self.meter.take()
+
+    def append(self) -> int:
+        value = value_of(self.value_size, self._seed())
+        return self._measured(self.backend.append, self.user_id, random.choice(self.categories), value)
+
+    def append_duplicate(self) -> int:
+        value = value_of(self.value_size, random.randrange(self.items or 1))
+        return self._measured(self.backend.append, self.user_id, random.choice(self.categories), value)
+
+    def read(self) -> int:
+        return self._measured(self.backend.read, self.user_id, random.choice(self.categories))
+
+    def read_many(self) -> int:
+        keys = [(self.user_id, category) for category in self.categories]
+        return self._measured(self.backend.read_many, keys)
+
+    def read_page(self) -> int:
+        offset = random.randrange(max(self.items - PAGE_SIZE, 0) + 1)
+        return self._measured(
+            self.backend.read_page, self.user_id, random.choice(self.categories), offset, PAGE_SIZE
+        )
+
+
+OPERATIONS = ("append", "append_duplicate", "read", "read_many", "read_page")
+
+
+def time_operation(operation, ops: int, concurrency: int, time_limit: float) -> tuple:
+    """
+    Run an operation repeatedly from several threads.
+
+    Args:
+        operation (callable): Performs one operation, returns its payload bytes
+        ops (int): Operations to run
+        concurrency (int): Threads issuing operations
+        time_limit (float): Seconds after which no new operations are started
+
+    Returns:
+        tuple: (sorted latencies in seconds, total payload bytes, wall seconds)
+    """
+    latencies, payload = [], [0]
+    remaining = [ops]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + time_limit
+
+    def worker():
+        while True:
+            with lock:
+                if remaining[0] <= 0 or (time.perf_counter() > deadline and len(latencies) >= 5):
+                    return
+                remaining[0] -= 1
+            started = time.perf_counter()
+            size = operation()
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                payload[0] += size
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    return sorted(latencies), payload[0], time.perf_counter() - started
+
+
+def trace_allocations(operation, ops: int) -> float:
+    """Mean peak bytes allocated by one operation, traced single-threaded."""
+    tracemalloc.start()
+    try:
+        peaks = []
+        for _ in range(ops):
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            operation()
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    finally:
+        tracemalloc.stop()
+    return sum(peaks) / len(peaks)
+
+
+def run_benchmarks(
+    backend, meter: PayloadMeter, sweep: dict, ops: int, alloc_ops: int, time_limit: float
+) -> list:
+    """
+    Benchmark every combination of the sweep.
+
+    Args:
+        backend (MemoryBackend): Backend under test
+        meter (PayloadMeter): Counts the backend's payload bytes
+        sweep (dict): Lists of ``items``, ``categories``, ``value_size`` and ``concurrency``
+        ops (int): Timed operations per measurement
+        alloc_ops (int): Operations traced for allocations per measurement
+        time_limit (float): Seconds after which a measurement stops early
+
+    Returns:
+        list: One result dict per configuration and operation
+    """
+    results = []
+    run = f"{os.getpid()}-{int(time.time())}"
+    configs = [
+        (items, categories, value_size, concurrency)
+        for items in sweep["items"]
+        for categories in sweep["categories"]
+        for value_size in sweep["value_size"]
+        for concurrency in sweep["concurrency"]
+    ]
+    for index, (items, categories, value_size, concurrency) in enumerate(configs):
+        workload = Workload(backend, meter, f"bench::{run}::{index}", items, categories, value_size)
+        workload.fill()
+        for name in OPERATIONS:
+            operation = getattr(workload, name)
+            latencies, payload, wall = time_operation(operation, ops, concurrency, time_limit)
+            count = len(latencies)
+            result = {
+                "operation": name,
+                "items": items,
+                "categories": categories,
+                "value_size": value_size,
+                "concurrency": concurrency,
+                "ops": count,
+                "p50_ms": percentile(latencies, 0.50) * 1000,
+                "p99_ms": percentile(latencies, 0.99) * 1000,
+                "mean_ms": sum(latencies) / count * 1000,
+                "ops_per_second": count / wall,
+                "bytes_per_op": payload / count,
+                "alloc_peak_bytes_per_op": trace_allocations(operation, min(alloc_ops, count)),
+            }
+            results.append(result)
+            print(
+                f"{name:>16} items={items:<7} categories={categories:<3} value={value_size:<5} "
+                f"threads={concurrency:<3} p50={result['p50_ms']:.3f}ms p99={result['p99_ms']:.3f}ms "
+                f"bytes/op={result['bytes_per_op']:.0f} alloc/op={result['alloc_peak_bytes_per_op']:.0f}"
+            )
+    return results
+
+
+def compare(results: list, baseline: list) -> None:
+    """Print the latency change of every measurement also present in a baseline."""
+    fields = ("operation", "items", "categories", "value_size", "concurrency")
+    previous = {tuple(result[field] for field in fields): result for result in baseline}
+    print("\nChange against baseline (negative is faster):")
+    for result in results:
+        before = previous.get(tuple(result[field] for field in fields))
+        if before is None:
+            continue
+        changes = [
+            f"{metric}={(result[metric] / before[metric] - 1) * 100:+.1f}%"
+            for metric in ("p50_ms", "p99_ms", "alloc_peak_bytes_per_op")
+            if before[metric]
+        ]
+        print(
+            f"{result['operation']:>16} items={result['items']:<7} categories={result['categories']:<3} "
+            f"value={result['value_size']:<5} threads={result['concurrency']:<3} {' '.join(changes)}"
+        )
+
+
+def git_commit() -> str:
+    """Commit of the working tree, or None outside a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def int_list(text: str) -> list:
+    return [int(part) for part in text.split(",") if part]
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--backend", choices=["sqlite", "couchbase", "fake"], default="sqlite",
+                        help="Backend to benchmark (couchbase uses the COUCHBASE_* variables, "
+                             "fake runs it against an in-process collection)")
+    parser.add_argument("--sqlite-path", help="SQLite file to use (a temporary file by default)")
+    parser.add_argument("--scope", default="bench", help="Couchbase scope for benchmark data")
+    parser.add_argument("--collection", default="memory", help="Couchbase collection for benchmark data")
+    parser.add_argument("--compression", choices=("off",) + ALGORITHMS, default="off",
+                        help="Compress stored values")
+    parser.add_argument("--items", type=int_list, default=[10, 100, 1000, 10000], help="Items per category")
+    parser.add_argument("--categories", type=int_list, default=[1, 8], help="Categories per user")
+    parser.add_argument("--value-size", type=int_list, default=[64, 1024], help="Characters per value")
+    parser.add_argument("--concurrency", type=int_list, default=[1, 4], help="Threads issuing operations")
+    parser.add_argument("--ops", type=int, default=200, help="Timed operations per measurement")
+    parser.add_argument("--alloc-ops", type=int, default=50, help="Operations traced for allocations")
+    parser.add_argument("--time-limit", type=float, default=2.0, help="Seconds per measurement before stopping early")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--output", default="bench-results.json", help="JSON results file")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    meter = PayloadMeter()
+    codec = Codec(None if args.compression == "off" else args.compression)
+    options = {"registry": FakeClusterRegistry()} if args.backend == "fake" else {}
+    with tempfile.TemporaryDirectory() as workdir:
+        backend = create_backend(
+            "couchbase" if args.backend == "fake" else args.backend,
+            conn_str=os.getenv("COUCHBASE_CONN_STR"),
+            username=os.getenv("COUCHBASE_USERNAME"),
+            password=os.getenv("COUCHBASE_PASSWORD"),
+            bucket_name=os.getenv("COUCHBASE_BUCKET"),
+            scope_name=args.scope,
+            collection_name=args.collection,
+            sqlite_path=args.sqlite_path or os.path.join(workdir, "bench.db"),
+            codec=MeteredCodec(codec, meter) if args.backend == "sqlite" else codec,
+            **options,
+        )
+        if isinstance(backend, CouchbaseBackend):
+            backend._collection = MeteredCollection(backend.collection, meter)
+        sweep = {
+            "items": args.items,
+            "categories": args.categories,
+            "value_size": args.value_size,
+            "concurrency": args.concurrency,
+        }
+        results = run_benchmarks(backend, meter, sweep, args.ops, args.alloc_ops, args.time_limit)
+
+    report = {
+        "commit": git_commit(),
+        "created": datetime.now(timezone.utc).isoformat(),
+        "backend": args.backend,
+        "compression": args.compression,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {"ops": args.ops, "alloc_ops": args.alloc_ops, "time_limit": args.time_limit, "seed": args.seed},
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as output:
+        json.dump(report, output, indent=2)
+    print(f"\nWrote {len(results)} measurements to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline:
+            compare(results, json.load(baseline)["results"])
+
+
+if __name__ == "__main__":
+    main()
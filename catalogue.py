@@ -0,0 +1,450 @@
+"""
+Indexed property catalogue searched by the real-estate advisor.
+
+Usage:
+    python catalogue.py listings.csv --location Lisbon --budget 400000
+    python catalogue.py listings.parquet --location Porto --budget 350000 --preference "T2 with a balcony"
+
+Listings are loaded from a CSV or Parquet file (Parquet needs the optional
+``pyarrow`` package) with one property per row. ``location`` and ``price``
+are required; ``id``, ``title``, ``url``, ``type``, ``area``, ``rooms``,
+``bathrooms``, ``rental_yield``, ``monthly_rent`` and ``features`` (a list
+separated by ``;``, ``|`` or ``,``) are used when present.
+
+Columns are held as numpy arrays. A price-sorted permutation answers budget
+ranges with a binary search, locations and features have packed bitmaps
+that filter the candidates, and candidates are scored in one vectorised
+pass against the features extracted from a user's saved preferences, which
+are cached per user. Configured with ``PROPERTY_CATALOGUE``.
+"""
+import argparse
+import csv
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from dotenv import load_dotenv
+
+try:
+    import pyarrow.parquet as parquet
+except ImportError:
+    parquet = None
+
+NUMERIC_COLUMNS = ("price", "area", "rooms", "bathrooms", "rental_yield", "monthly_rent")
+TEXT_COLUMNS = ("id", "title", "url")
+FEATURE_SEPARATOR = re.compile(r"[;|,]")
+DEFAULT_FEATURES = ("pool", "garden", "garage")
+TYPE_SYNONYMS = {
+    "apartment": ("apartment", "flat", "studio", "penthouse"),
+    "house": ("house", "villa", "townhouse", "cottage"),
+}
+NUMBER_WORDS = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6}
+# "2 bedrooms", "two-bedroom", "3 bed" or the Portuguese "T2"
+ROOMS_PATTERN = re.compile(r"\b(?:(\d|one|two|three|four|five|six)[\s-]*(?:bed|bedroom|bedrooms|br)\b|t(\d)\b)")
+
+# Weights of the scoring terms; each term is at most 1 per listing.
+FEATURE_WEIGHT = 1.0
+TYPE_WEIGHT = 2.0
+ROOMS_WEIGHT = 1.5
+YIELD_WEIGHT = 1.0
+
+
+def _normalize(text) -> str:
+    """Lowercase a label and collapse separators, e.g. ' Sea_View ' -> 'sea view'."""
+    return " ".join(re.sub(r"[_\-]+", " ", str(text or "")).lower().split())
+
+
+def _term_pattern(term: str) -> re.Pattern:
+    """Match a term as whole words, allowing a plural 's'."""
+    return re.compile(rf"\b{re.escape(term)}s?\b")
+
+
+def extract_profile(preferences: list, features=DEFAULT_FEATURES, types=tuple(TYPE_SYNONYMS)) -> dict:
+    """
+    Extract the searchable features of a user's saved preferences.
+
+    Later preferences override earlier ones for the property type, the
+    number of bedrooms and the investment type.
+
+    Args:
+        preferences (list): Saved preference texts, oldest first
+        features (tuple): Feature names to look for
+        types (tuple): Property type names to look for, with their synonyms
+
+    Returns:
+        dict: ``type``, ``rooms``, ``investment_type`` and the ``features`` mentioned
+    """
+    feature_patterns = [(name, _term_pattern(name)) for name in features]
+    type_patterns = [
+        (name, [_term_pattern(term) for term in (name,) + TYPE_SYNONYMS.get(name, ())]) for name in types
+    ]
+    profile = {"type": None, "rooms": None, "investment_type": "residential", "features": []}
+    for preference in preferences:
+        text = _normalize(preference)
+        if "investment" in text:
+            profile["investment_type"] = "investment"
+        elif "rental" in text:
+            profile["investment_type"] = "rental"
+        for name, patterns in type_patterns:
+            if any(pattern.search(text) for pattern in patterns):
+                profile["type"] = name
+        match = ROOMS_PATTERN.search(text)
+        if match:
+            count = match.group(1) or match.group(2)
+            profile["rooms"] = int(NUMBER_WORDS.get(count, count))
+        for name, pattern in feature_patterns:
+            if pattern.search(text) and name not in profile["features"]:
+                profile["features"].append(name)
+    return profile
+
+
+def parse_budget(budget) -> float:
+    """
+    Read a budget such as '400000', '400,000 EUR', '€400k' or '1.2M'.
+
+    Raises:
+        ValueError: If the budget has no amount
+    """
+    text = str(budget).lower().replace(",", "").replace("eur", "").replace("€", "").strip()
+    match = re.search(r"(\d+(?:\.\d+)?)\s*([km]?)", text)
+    if not match:
+        raise ValueError(f"Budget {budget!r} has no amount")
+    return float(match.group(1)) * {"": 1, "k": 1e3, "m": 1e6}[match.group(2)]
+
+
+def _read_rows(path: str) -> dict:
+    """Read a CSV or Parquet file into lists keyed by normalised column name."""
+    if path.lower().endswith((".parquet", ".pq")):
+        if parquet is None:
+            raise ValueError("Reading Parquet catalogues needs the 'pyarrow' package")
+        table = parquet.read_table(path).to_pydict()
+        return {_normalize(name).replace(" ", "_"): values for name, values in table.items()}
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = [_normalize(name).replace(" ", "_") for name in next(reader, [])]
+        columns = {name: [] for name in header}
+        for row in reader:
+            for name, value in zip(header, row):
+                columns[name].append(value)
+    return columns
+
+
+def _to_float(values: list) -> np.ndarray:
+    """Convert a column to float64, with NaN where a value is missing or invalid."""
+    out = np.full(len(values), np.nan)
+    for index, value in enumerate(values):
+        try:
+            out[index] = float(value)
+        except (TypeError, ValueError):
+            pass
+    return out
+
+
+class PropertyCatalogue:
+    """Columnar, indexed listing store with per-user preference profiles."""
+
+    def __init__(self, columns: dict, profile_cache_size: int = 1024):
+        """
+        Args:
+            columns (dict): Listing columns as equal-length lists, keyed by column name
+            profile_cache_size (int): Users whose extracted preference profile is kept
+
+        Raises:
+            ValueError: If the location or price column is missing
+        """
+        missing = [name for name in ("location", "price") if name not in columns]
+        if missing:
+            raise ValueError(f"Catalogue is missing the {', '.join(missing)} column(s)")
+        prices = _to_float(columns["price"])
+        keep = np.flatnonzero(~np.isnan(prices))
+        rows = len(prices)
+
+        def column(name):
+            values = columns.get(name)
+            return [values[index] for index in keep] if values is not None else [None] * len(keep)
+
+        self.size = len(keep)
+        self.numeric = {name: _to_float(column(name)) for name in NUMERIC_COLUMNS}
+        self.text = {name: np.array([str(v or "") for v in column(name)], dtype=object) for name in TEXT_COLUMNS}
+        self.locations = np.array([str(v or "").strip() for v in column("location")], dtype=object)
+
+        # Budget ranges are a binary search over the price-sorted permutation.
+        self._price_order = np.argsort(self.numeric["price"], kind="stable")
+        self._sorted_prices = self.numeric["price"][self._price_order]
+
+        type_labels = [_normalize(v) for v in column("type")]
+        self.types = sorted({label for label in type_labels if label})
+        type_index = {name: code for code, name in enumerate(self.types)}
+        self._type_codes = np.array([type_index.get(label, -1) for label in type_labels], dtype=np.int16)
+
+        location_rows = {}
+        for index, location in enumerate(self.locations):
+            location_rows.setdefault(_normalize(location), []).append(index)
+        self._location_bitmaps = {name: self._bitmap(indexes) for name, indexes in location_rows.items()}
+
+        feature_rows = {}
+        for index, value in enumerate(column("features")):
+            if isinstance(value, (list, tuple)):
+                names = value
+            else:
+                names = FEATURE_SEPARATOR.split(str(value or ""))
+            for name in {_normalize(name) for name in names} - {""}:
+                feature_rows.setdefault(name, []).append(index)
+        self.features = sorted(feature_rows)
+        self._feature_bitmaps = {name: self._bitmap(feature_rows[name]) for name in self.features}
+        # Dense (features x listings) matrix for scoring; the bitmaps are used to filter.
+        self._feature_matrix = np.vstack(
+            [self._mask(self._feature_bitmaps[name]) for name in self.features]
+        ).astype(np.float32) if self.features else np.zeros((0, self.size), dtype=np.float32)
+
+        yields = self.numeric["rental_yield"]
+        self._yield_scale = np.nan_to_num(yields / np.nanmax(yields)) if np.isfinite(yields).any() else np.zeros(self.size)
+        self.skipped = rows - self.size
+        self.profile_cache_size = profile_cache_size
+        self._profiles = OrderedDict()
+        # Generation of the latest invalidation of each recently invalidated
+        # user. Older ones are forgotten; ``_forgotten`` is the newest of those.
+        self._invalidated = OrderedDict()
+        self._forgotten = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _bitmap(self, indexes: list) -> np.ndarray:
+        """Pack listing row numbers into a bitmap."""
+        mask = np.zeros(self.size, dtype=bool)
+        mask[indexes] = True
+        return np.packbits(mask)
+
+    def _mask(self, bitmap: np.ndarray) -> np.ndarray:
+        """Unpack a bitmap into a boolean mask over the listings."""
+        return np.unpackbits(bitmap, count=self.size).view(bool)
+
+    def location_bitmap(self, location: str):
+        """
+        Combine the bitmaps of every location matching a query.
+
+        A query matches a location whose name contains it as whole words, so
+        'Lisbon' matches both 'Lisbon' and 'Lisbon, Alfama'.
+
+        Args:
+            location (str): Location to search
+
+        Returns:
+            np.ndarray: Packed bitmap, or None if no location matches
+        """
+        pattern = re.compile(rf"\b{re.escape(_normalize(location))}\b")
+        matched = [bitmap for name, bitmap in self._location_bitmaps.items() if pattern.search(name)]
+        return np.bitwise_or.reduce(matched) if matched else None
+
+    def generation(self) -> int:
+        """Return the current invalidation generation; take it before reading preferences to profile."""
+        with self._lock:
+            return self._generation
+
+    def cached_profile(self, user_id: str):
+        """Return a user's cached preference profile, or None if it must be built."""
+        with self._lock:
+            profile = self._profiles.get(user_id)
+            if profile is not None:
+                self._profiles.move_to_end(user_id)
+            return profile
+
+    def build_profile(self, user_id: str, preferences: list, generation: int = None) -> dict:
+        """
+        Extract a user's preference profile against this catalogue and cache it.
+
+        Args:
+            user_id (str): User the preferences belong to
+            preferences (list): Saved preference texts, oldest first
+            generation (int): ``generation()`` taken before the preferences were
+                read; the profile is not cached if the user was invalidated since
+
+        Returns:
+            dict: The profile, with a ``weights`` vector over the catalogue's features
+        """
+        profile = extract_profile(preferences, self.features, tuple(self.types) or tuple(TYPE_SYNONYMS))
+        weights = np.zeros(len(self.features), dtype=np.float32)
+        for name in profile["features"]:
+            weights[self.features.index(name)] = FEATURE_WEIGHT
+        profile["weights"] = weights
+        profile["type_code"] = self.types.index(profile["type"]) if profile["type"] in self.types else -1
+        with self._lock:
+            if generation is None or self._invalidated.get(user_id, self._forgotten) <= generation:
+                self._profiles[user_id] = profile
+                while len(self._profiles) > self.profile_cache_size:
+                    self._profiles.popitem(last=False)
+        return profile
+
+    def invalidate(self, user_id: str) -> None:
+        """Drop a user's profile after their preferences change."""
+        with self._lock:
+            self._generation += 1
+            self._invalidated[user_id] = self._generation
+            self._invalidated.move_to_end(user_id)
+            while len(self._invalidated) > max(self.profile_cache_size, 256):
+                _, self._forgotten = self._invalidated.popitem(last=False)
+            self._profiles.pop(user_id, None)
+
+    def search(
+        self,
+        location: str = None,
+        max_price: float = None,
+        min_price: float = None,
+        profile: dict = None,
+        required: list = (),
+        limit: int = 10,
+    ) -> list:
+        """
+        Find the listings best matching a budget, location and preference profile.
+
+        Args:
+            location (str): Only listings in a location matching this, None for anywhere
+            max_price (float): Highest price, None for no limit
+            min_price (float): Lowest price, None for no limit
+            profile (dict): Profile from ``build_profile`` the listings are scored against
+            required (list): Features every listing must have
+            limit (int): Maximum number of listings returned
+
+        Returns:
+            list: Row numbers of the best listings, highest score first and
+                cheapest first among equal scores
+        """
+        low = 0 if min_price is None else np.searchsorted(self._sorted_prices, min_price, side="left")
+        high = self.size if max_price is None else np.searchsorted(self._sorted_prices, max_price, side="right")
+        candidates = self._price_order[low:high]
+
+        bitmaps = []
+        if location:
+            bitmap = self.location_bitmap(location)
+            if bitmap is None:
+                return []
+            bitmaps.append(bitmap)
+        for name in required:
+            bitmap = self._feature_bitmaps.get(_normalize(name))
+            if bitmap is None:
+                return []
+            bitmaps.append(bitmap)
+        if bitmaps:
+            candidates = candidates[self._mask(np.bitwise_and.reduce(bitmaps))[candidates]]
+        if not len(candidates):
+            return []
+
+        scores = self.score(candidates, profile) if profile else np.zeros(len(candidates))
+        if len(candidates) > limit:
+            # Candidates are in price order, so a stable sort keeps the cheapest of equal scores first.
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            threshold = scores[top].min()
+            keep = np.flatnonzero(scores >= threshold)
+            candidates, scores = candidates[keep], scores[keep]
+        order = np.argsort(-scores, kind="stable")[:limit]
+        return candidates[order].tolist()
+
+    def score(self, rows: np.ndarray, profile: dict) -> np.ndarray:
+        """
+        Score listings against a preference profile in one vectorised pass.
+
+        Args:
+            rows (np.ndarray): Row numbers of the listings
+            profile (dict): Profile from ``build_profile``
+
+        Returns:
+            np.ndarray: Score of each listing
+        """
+        scores = profile["weights"] @ self._feature_matrix[:, rows] if self.features else np.zeros(len(rows))
+        if profile["type_code"] >= 0:
+            scores = scores + TYPE_WEIGHT * (self._type_codes[rows] == profile["type_code"])
+        if profile["rooms"] is not None:
+            difference = np.abs(np.nan_to_num(self.numeric["rooms"][rows], nan=-10.0) - profile["rooms"])
+            scores = scores + ROOMS_WEIGHT / (1.0 + difference)
+        if profile["investment_type"] == "investment":
+            scores = scores + YIELD_WEIGHT * self._yield_scale[rows]
+        return scores
+
+    def listing(self, row: int) -> dict:
+        """
+        Return a listing as a dictionary, leaving out the fields it has no value for.
+
+        Args:
+            row (int): Row number of the listing
+
+        Returns:
+            dict: The listing's fields
+        """
+        record = {name: self.text[name][row] for name in TEXT_COLUMNS if self.text[name][row]}
+        code = self._type_codes[row]
+        record["type"] = self.types[code] if code >= 0 else None
+        record["location"] = self.locations[row]
+        for name in NUMERIC_COLUMNS:
+            value = self.numeric[name][row]
+            if not np.isnan(value):
+                record[name] = int(value) if float(value).is_integer() else round(float(value), 2)
+        mask = self._feature_matrix[:, row] if self.features else ()
+        record["features"] = [name for name, present in zip(self.features, mask) if present]
+        return record
+
+
+def load_catalogue(path: str, profile_cache_size: int = 1024) -> PropertyCatalogue:
+    """
+    Load a property catalogue from a CSV or Parquet file.
+
+    Args:
+        path (str): Path of the listing file
+        profile_cache_size (int): Users whose extracted preference profile is kept
+
+    Returns:
+        PropertyCatalogue: The indexed catalogue
+    """
+    return PropertyCatalogue(_read_rows(path), profile_cache_size=profile_cache_size)
+
+
+def catalogue_from_env():
+    """
+    Load the catalogue named by ``PROPERTY_CATALOGUE``.
+
+    Returns:
+        PropertyCatalogue: The catalogue, or None when the variable is unset or
+            the file does not exist
+    """
+    path = os.getenv("PROPERTY_CATALOGUE")
+    if not path or not os.path.exists(path):
+        return None
+    return load_catalogue(path)
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("path", help="CSV or Parquet listing file")
+    parser.add_argument("--location", help="Location to search")
+    parser.add_argument("--budget", help="Highest price, e.g. 400000 or 400k")
+    parser.add_argument("--preference", action="append", default=[], help="Saved preference text")
+    parser.add_argument("--require", action="append", default=[], help="Feature every listing must have")
+    parser.add_argument("--limit", type=int, default=5, help="Listings to show")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    catalogue = load_catalogue(args.path)
+    loaded = time.perf_counter()
+    profile = catalogue.build_profile("cli", args.preference)
+    rows = catalogue.search(
+        args.location,
+        max_price=parse_budget(args.budget) if args.budget else None,
+        profile=profile,
+        required=args.require,
+        limit=args.limit,
+    )
+    searched = time.perf_counter()
+    print(f"Loaded {len(catalogue)} listings in {loaded - started:.2f}s ({catalogue.skipped} without a price skipped).")
+    print(f"Search took {(searched - loaded) * 1000:.2f}ms.")
+    for row in rows:
+        print(catalogue.listing(row))
+
+
+if __name__ == "__main__":
+    main()
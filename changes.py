@@ -0,0 +1,267 @@
+"""
+Keep derived data in step with memory by tailing the backend's change log.
+
+Usage:
+    python changes.py --scope agent
+    python changes.py --scope real_estate --after 1200 --follow
+
+With ``MEMORY_CHANGE_LOG=on`` every append and trim, by any process, is
+recorded with a monotonically increasing sequence number. The log is split
+into the backend's ``change_partitions``, each numbered on its own, and all
+of a user's changes go to the same partition, so they are delivered in order.
+A ``ChangeFeed`` reads the changes after each consumer's position in every
+partition and hands them to the consumer. Caches, indexes and digests are
+then updated at constant cost per change instead of being rebuilt from a
+rescan of every user's documents.
+
+Durable consumers save a checkpoint in the backend after every batch and
+resume from it after a restart. In-process consumers, whose state starts
+empty anyway, begin at the newest change. A crash between applying a batch
+and saving its checkpoint replays the batch, so ``apply`` must be idempotent.
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from dotenv import load_dotenv
+
+from instrumentation import get_instrumentation
+
+
+class ChangeConsumer:
+    """
+    Derived data updated from the change log.
+
+    Subclasses set ``name`` (unique per consumer, it keys the checkpoint)
+    and implement ``apply``. ``categories`` limits the changes delivered.
+    """
+
+    name = None
+    durable = True
+    categories = None
+
+    def wants(self, change: dict) -> bool:
+        """Whether a change concerns this consumer."""
+        return self.categories is None or change["category"] in self.categories
+
+    def reset(self) -> None:
+        """
+        Called when a non-durable consumer starts at the newest change: drop
+        anything built before then, since the changes leading up to it are skipped.
+        """
+
+    def apply(self, change: dict) -> None:
+        """
+        Update the derived data for one change.
+
+        Args:
+            change (dict): Change as returned by ``MemoryBackend.read_changes``
+        """
+        raise NotImplementedError
+
+
+class CallbackConsumer(ChangeConsumer):
+    """Consumer that passes each change to a function."""
+
+    def __init__(self, name: str, callback, categories: tuple = None, durable: bool = False):
+        """
+        Args:
+            name (str): Consumer name, used for its checkpoint when durable
+            callback (callable): Called with each change
+            categories (tuple): Only changes to these categories, None for all
+            durable (bool): Resume from a saved checkpoint instead of the newest change
+        """
+        self.name = name
+        self.callback = callback
+        self.categories = set(categories) if categories is not None else None
+        self.durable = durable
+
+    def apply(self, change: dict) -> None:
+        self.callback(change)
+
+
+class CacheInvalidator(ChangeConsumer):
+    """
+    Drops categories written by other processes from a memory's read cache.
+
+    Changes made through the memory's own backend are skipped: the memory
+    already wrote them through to its cache.
+    """
+
+    durable = False
+
+    def __init__(self, memory):
+        """
+        Args:
+            memory (CouchbaseMemory): Memory whose cache is kept fresh
+        """
+        self.memory = memory
+        self.name = "read-cache"
+
+    def reset(self) -> None:
+        self.memory.cache.clear()
+
+    def wants(self, change: dict) -> bool:
+        return change.get("writer") != self.memory.backend.writer_id
+
+    def apply(self, change: dict) -> None:
+        self.memory.cache.invalidate((change["user_id"], change["category"]))
+
+
+class ChangeFeed:
+    """Reads the change log and applies it to a set of consumers."""
+
+    def __init__(self, memory, consumers: list, batch_size: int = 500):
+        """
+        Args:
+            memory (CouchbaseMemory): Memory whose backend records the changes
+            consumers (list): ChangeConsumer instances with distinct names
+            batch_size (int): Changes read per poll
+        """
+        self.backend = memory.backend
+        self.consumers = list(consumers)
+        self.batch_size = batch_size
+        self.positions = None
+        self.behind = False
+
+    def _load_positions(self) -> dict:
+        """Find where each consumer starts, on first poll so creating a feed needs no connection."""
+        newest = [self.backend.last_change(partition) for partition in range(self.backend.change_partitions)]
+        positions = {}
+        for consumer in self.consumers:
+            if consumer.durable:
+                positions[consumer.name] = self.backend.load_checkpoint(consumer.name)
+            else:
+                consumer.reset()
+                positions[consumer.name] = list(newest)
+        return positions
+
+    def poll(self) -> int:
+        """
+        Apply the next batch of changes in each partition to every consumer that is behind.
+
+        A consumer whose ``apply`` raises stays at its last applied change in
+        that partition and is retried from there on the next poll; the others
+        carry on. Changes whose write stored or removed nothing are skipped.
+
+        Returns:
+            int: Number of changes read
+        """
+        if not self.consumers:
+            return 0
+        if self.positions is None:
+            self.positions = self._load_positions()
+        metrics = get_instrumentation()
+        read, newest, moved, self.behind = 0, None, set(), False
+        with metrics.span("changes.poll") as span:
+            for partition in range(self.backend.change_partitions):
+                after = min(positions[partition] for positions in self.positions.values())
+                changes = self.backend.read_changes(after, self.batch_size, partition)
+                read += len(changes)
+                # A read that reached the end of its window may have left changes behind it.
+                self.behind = self.behind or bool(changes) and changes[-1]["seq"] >= after + self.batch_size
+                if changes:
+                    newest = max(newest or 0, changes[-1]["at"])
+                for consumer in self.consumers:
+                    positions = self.positions[consumer.name]
+                    start = position = positions[partition]
+                    for change in changes:
+                        if change["seq"] <= position:
+                            continue
+                        if change["values"] and consumer.wants(change):
+                            try:
+                                consumer.apply(change)
+                            except Exception as e:
+                                metrics.log(
+                                    "ERROR", "changes.apply_failed", consumer=consumer.name,
+                                    partition=partition, seq=change["seq"], error=f"{type(e).__name__}: {e}",
+                                )
+                                break
+                        position = change["seq"]
+                    if position != start:
+                        positions[partition] = position
+                        moved.add(consumer.name)
+                        metrics.count("changes_applied_total", position - start, consumer=consumer.name)
+            for consumer in self.consumers:
+                if consumer.durable and consumer.name in moved:
+                    self.backend.save_checkpoint(consumer.name, self.positions[consumer.name])
+            if read:
+                span.set(changes=read, lag_seconds=time.time() - newest)
+        return read
+
+    def catch_up(self) -> int:
+        """
+        Poll until every consumer has applied every recorded change, or the
+        consumers stop making progress.
+
+        Returns:
+            int: Number of changes read
+        """
+        total = 0
+        while True:
+            before = {name: list(positions) for name, positions in (self.positions or {}).items()}
+            total += self.poll()
+            if not self.behind or self.positions == before:
+                return total
+
+    async def run(self, async_memory, interval: float = 1.0) -> None:
+        """
+        Follow the change log in the background until cancelled.
+
+        Args:
+            async_memory (AsyncCouchbaseMemory): Facade whose thread pool reads the log
+            interval (float): Seconds between polls once caught up
+        """
+        while True:
+            try:
+                await async_memory.run(self.catch_up)
+            except Exception as e:
+                get_instrumentation().log("ERROR", "changes.poll_failed", error=f"{type(e).__name__}: {e}")
+            await asyncio.sleep(interval)
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scope", default="agent", help="Scope holding the memory collection")
+    parser.add_argument("--collection", default="memory", help="Memory collection name")
+    parser.add_argument(
+        "--after", type=int, default=0, help="Print changes after this sequence number in every partition"
+    )
+    parser.add_argument("--follow", action="store_true", help="Keep printing new changes")
+    parser.add_argument("--interval", type=float, default=1.0, help="Seconds between polls with --follow")
+    args = parser.parse_args()
+
+    from memory import CouchbaseMemory
+
+    memory = CouchbaseMemory(
+        conn_str=os.getenv("COUCHBASE_CONN_STR"),
+        username=os.getenv("COUCHBASE_USERNAME"),
+        password=os.getenv("COUCHBASE_PASSWORD"),
+        bucket_name=os.getenv("COUCHBASE_BUCKET"),
+        scope_name=args.scope,
+        collection_name=args.collection,
+    )
+    positions = [args.after] * memory.backend.change_partitions
+    while True:
+        printed = 0
+        for partition, position in enumerate(positions):
+            changes = memory.backend.read_changes(position, partition=partition)
+            for change in changes:
+                print(
+                    f"{partition:>3}:{change['seq']:<8} "
+                    f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(change['at']))} "
+                    f"{change['op']:<6} {change['user_id']}/{change['category']} ({len(change['values'])} values)"
+                )
+                positions[partition] = change["seq"]
+            printed += len(changes)
+        if printed:
+            continue
+        if not args.follow:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
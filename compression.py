@@ -0,0 +1,253 @@
+"""
+Transparent compression of stored memory values.
+
+Usage:
+    python compression.py train --user alice --scope agent --category emails --output compression-dicts/
+
+Values larger than ``min_size`` are stored as a tagged envelope::
+
+    {"__memory_codec__": 1, "codec": "zlib", "dict": "1a2b3c4d", "data": "<base64>"}
+
+``__memory_codec__`` is the envelope format version. Anything without the
+tag is returned as stored, so documents written before compression was
+enabled (or with it disabled) keep reading correctly. Sealed Couchbase
+chunks are compressed as a whole, which lets repeated headers and quoted
+replies across emails share one compressed window.
+
+A shared dictionary trained on the stored corpus gives small values the
+same head start. Dictionaries are files named ``<id>.dict``; every
+dictionary in the directory of the active one is loaded for reading.
+
+Configured with ``MEMORY_COMPRESSION`` (``off``, ``zlib`` or ``zstd``; zstd
+needs the optional ``zstandard`` package) and ``MEMORY_COMPRESSION_DICT``
+(path of the dictionary used for new writes).
+"""
+import argparse
+import base64
+import glob
+import hashlib
+import json
+import os
+import zlib
+
+from dotenv import load_dotenv
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FORMAT_VERSION = 1
+MARKER = "__memory_codec__"
+ALGORITHMS = ("zlib", "zstd")
+
+
+def dictionary_id(dictionary: bytes) -> str:
+    """Short stable identifier of a compression dictionary."""
+    return hashlib.blake2b(dictionary, digest_size=4).hexdigest()
+
+
+def load_dictionaries(directory: str) -> dict:
+    """
+    Load every ``<id>.dict`` file in a directory.
+
+    Args:
+        directory (str): Directory holding dictionary files
+
+    Returns:
+        dict: Dictionary bytes keyed by id
+    """
+    dictionaries = {}
+    for path in glob.glob(os.path.join(directory, "*.dict")):
+        with open(path, "rb") as source:
+            dictionaries[os.path.basename(path)[: -len(".dict")]] = source.read()
+    return dictionaries
+
+
+def train_dictionary(values: list, algorithm: str = "zlib", size: int = 32768) -> bytes:
+    """
+    Build a shared dictionary from sample values.
+
+    zstd trains one with ``zstandard.train_dictionary``. zlib only uses a
+    preset window of up to 32 KiB, so its dictionary is the serialised
+    samples themselves: field names, headers, greetings and quoted text then
+    compress to back-references even in a value's first bytes.
+
+    Args:
+        values (list): Sample values as stored in memory
+        algorithm (str): "zlib" or "zstd"
+        size (int): Maximum dictionary size in bytes (zlib uses at most 32 KiB)
+
+    Returns:
+        bytes: The dictionary
+    """
+    samples = [json.dumps(value, separators=(",", ":")).encode("utf-8") for value in values]
+    if algorithm == "zstd":
+        return zstandard.train_dictionary(size, samples).as_bytes()
+    # Deflate reaches the end of the window most cheaply, so it keeps the newest samples.
+    return b"".join(samples)[-min(size, 32768):]
+
+
+class Codec:
+    """Encodes values into compressed envelopes and decodes them back."""
+
+    def __init__(
+        self,
+        algorithm: str = None,
+        level: int = 6,
+        min_size: int = 256,
+        dictionaries: dict = None,
+        dictionary: str = None,
+    ):
+        """
+        Args:
+            algorithm (str): "zlib" or "zstd" to compress new values, None to store them as-is
+            level (int): Compression level
+            min_size (int): Serialised size below which values are stored as-is
+            dictionaries (dict): Dictionary bytes keyed by id, needed to read values
+                compressed with them
+            dictionary (str): Id of the dictionary used for new values
+        """
+        if algorithm not in (None,) + ALGORITHMS:
+            raise ValueError(f"Unknown compression algorithm '{algorithm}'")
+        if "zstd" == algorithm and zstandard is None:
+            raise ValueError("zstd compression needs the 'zstandard' package")
+        self.algorithm = algorithm
+        self.level = level
+        self.min_size = min_size
+        self.dictionaries = dict(dictionaries or {})
+        self.dictionary = dictionary
+        if dictionary is not None and dictionary not in self.dictionaries:
+            raise ValueError(f"Compression dictionary '{dictionary}' is not loaded")
+
+    def _compress(self, raw: bytes) -> bytes:
+        zdict = self.dictionaries.get(self.dictionary)
+        if self.algorithm == "zstd":
+            dict_data = zstandard.ZstdCompressionDict(zdict) if zdict else None
+            return zstandard.ZstdCompressor(level=self.level, dict_data=dict_data).compress(raw)
+        compressor = zlib.compressobj(self.level, zdict=zdict) if zdict else zlib.compressobj(self.level)
+        return compressor.compress(raw) + compressor.flush()
+
+    def _decompress(self, envelope: dict) -> bytes:
+        data = base64.b64decode(envelope["data"])
+        name = envelope.get("dict")
+        if name is not None and name not in self.dictionaries:
+            raise ValueError(f"Compression dictionary '{name}' is needed to read this value")
+        zdict = self.dictionaries.get(name)
+        if envelope["codec"] == "zstd":
+            if zstandard is None:
+                raise ValueError("Reading zstd-compressed values needs the 'zstandard' package")
+            dict_data = zstandard.ZstdCompressionDict(zdict) if zdict else None
+            return zstandard.ZstdDecompressor(dict_data=dict_data).decompress(data)
+        decompressor = zlib.decompressobj(zdict=zdict) if zdict else zlib.decompressobj()
+        return decompressor.decompress(data) + decompressor.flush()
+
+    def encode(self, value):
+        """
+        Compress a value if that makes it smaller.
+
+        Args:
+            value: JSON value to store (a single item or a whole chunk list)
+
+        Returns:
+            The envelope, or the value itself when compression is off or does not pay
+        """
+        if self.algorithm is None:
+            return value
+        raw = json.dumps(value, separators=(",", ":")).encode("utf-8")
+        if len(raw) < self.min_size:
+            return value
+        envelope = {
+            MARKER: FORMAT_VERSION,
+            "codec": self.algorithm,
+            "data": base64.b64encode(self._compress(raw)).decode("ascii"),
+        }
+        if self.dictionary is not None:
+            envelope["dict"] = self.dictionary
+        if len(json.dumps(envelope, separators=(",", ":"))) >= len(raw):
+            return value
+        return envelope
+
+    def decode(self, stored):
+        """
+        Restore a value written by ``encode``.
+
+        Args:
+            stored: Value as read from storage
+
+        Returns:
+            The original value; values without an envelope are returned unchanged
+        """
+        if not isinstance(stored, dict) or MARKER not in stored:
+            return stored
+        if stored[MARKER] > FORMAT_VERSION:
+            raise ValueError(f"Stored value uses codec format {stored[MARKER]}, newer than {FORMAT_VERSION}")
+        return json.loads(self._decompress(stored))
+
+
+def codec_from_env() -> Codec:
+    """
+    Build the codec configured by ``MEMORY_COMPRESSION`` and ``MEMORY_COMPRESSION_DICT``.
+
+    Returns:
+        Codec: Codec for new writes; it can always read uncompressed values
+    """
+    algorithm = os.getenv("MEMORY_COMPRESSION", "off").lower()
+    path = os.getenv("MEMORY_COMPRESSION_DICT")
+    dictionaries, dictionary = {}, None
+    if path:
+        dictionaries = load_dictionaries(os.path.dirname(os.path.abspath(path)))
+        dictionary = os.path.basename(path)[: -len(".dict")]
+    return Codec(
+        None if algorithm in ("", "off", "none") else algorithm,
+        dictionaries=dictionaries,
+        dictionary=dictionary,
+    )
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    train = subcommands.add_parser("train", help="Train a dictionary from a user's stored category")
+    train.add_argument("--user", required=True, help="User whose values are sampled")
+    train.add_argument("--scope", default="agent", help="Scope holding the memory collection")
+    train.add_argument("--collection", default="memory", help="Memory collection name")
+    train.add_argument("--category", default="emails", help="Category to sample")
+    train.add_argument("--algorithm", choices=ALGORITHMS, default="zlib", help="Compression the dictionary is for")
+    train.add_argument("--size", type=int, default=32768, help="Maximum dictionary size in bytes")
+    train.add_argument("--output", default="compression-dicts", help="Directory the dictionary is written to")
+    args = parser.parse_args()
+
+    from memory import CouchbaseMemory
+
+    memory = CouchbaseMemory(
+        conn_str=os.getenv("COUCHBASE_CONN_STR"),
+        username=os.getenv("COUCHBASE_USERNAME"),
+        password=os.getenv("COUCHBASE_PASSWORD"),
+        bucket_name=os.getenv("COUCHBASE_BUCKET"),
+        scope_name=args.scope,
+        collection_name=args.collection,
+    )
+    values = memory.search_by_category(args.user, args.category)
+    if not values:
+        parser.error(f"No values stored in '{args.category}' for user '{args.user}'")
+    dictionary = train_dictionary(values, args.algorithm, args.size)
+    name = dictionary_id(dictionary)
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, f"{name}.dict")
+    with open(path, "wb") as output:
+        output.write(dictionary)
+
+    raw = sum(len(json.dumps(value)) for value in values)
+    plain = Codec(args.algorithm, min_size=0)
+    shared = Codec(args.algorithm, min_size=0, dictionaries={name: dictionary}, dictionary=name)
+    for label, codec in (("without dictionary", plain), ("with dictionary", shared)):
+        stored = sum(len(json.dumps(codec.encode(value))) for value in values)
+        print(f"Per-value size {label}: {stored} of {raw} bytes ({raw / stored:.1f}x)")
+    print(f"Wrote {len(dictionary)}-byte dictionary to {path}")
+    print(f"Enable it with MEMORY_COMPRESSION={args.algorithm} MEMORY_COMPRESSION_DICT={path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Request-scoped identity for tool calls.
+
+Tools read the current user and session from context variables instead of
+process-global state, so concurrent conversations in one process never see
+each other's identity. Values set inside ``request_context`` are inherited
+by tasks spawned from it and by work offloaded through AsyncCouchbaseMemory.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+current_user_id = ContextVar("current_user_id", default=None)
+current_session_id = ContextVar("current_session_id", default=None)
+
+
+@contextmanager
+def request_context(user_id: str, session_id: str = None):
+    """
+    Bind a user and session to the current request.
+
+    Args:
+        user_id (str): User the request acts for
+        session_id (str): Session the request belongs to
+    """
+    user_token = current_user_id.set(user_id)
+    session_token = current_session_id.set(session_id)
+    try:
+        yield
+    finally:
+        current_session_id.reset(session_token)
+        current_user_id.reset(user_token)
+
+
+def get_user_id(default: str = None) -> str:
+    """
+    Return the user bound to the current request.
+
+    Args:
+        default (str): Fallback when no request context is active
+
+    Returns:
+        str: The current user ID
+    """
+    return current_user_id.get() or default
+
+
+def get_session_id(default: str = None) -> str:
+    """
+    Return the session bound to the current request.
+
+    Args:
+        default (str): Fallback when no request context is active
+
+    Returns:
+        str: The current session ID
+    """
+    return current_session_id.get() or default
@@ -0,0 +1,603 @@
+import bisect
+import heapq
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from itertools import islice
+
+from storage import content_digest
+from vectors import VectorIndex, decode_vector, encode_vector
+
+TOKEN_PATTERN = re.compile(r"\w+")
+REPLY_PREFIX = re.compile(r"^\s*((re|fw|fwd|aw)\s*(\[\d+\])?\s*:\s*)+", re.IGNORECASE)
+HEADERS = {"From": "from", "To": "to", "Date": "date", "CC": "cc", "Subject": "subject"}
+DATE_FORMATS = ("%d/%m/%Y", "%d %b %Y", "%d %B %Y", "%B %d, %Y")
+
+
+def tokenize(text: str) -> list:
+    """
+    Split text into lowercase word tokens.
+
+    Args:
+        text (str): Text to tokenize
+
+    Returns:
+        list: Tokens in order of appearance
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def make_email(
+    from_sender: str,
+    to_recipient: str,
+    date: str,
+    subject: str,
+    body: str,
+    cc: str = None,
+) -> dict:
+    """
+    Build a structured email record.
+
+    Args:
+        from_sender (str): Sender of the email
+        to_recipient (str): Recipients of the email
+        date (str): Date of the email
+        subject (str): Subject line
+        body (str): Content of the email
+        cc (str): CC recipients, if any
+
+    Returns:
+        dict: The email record
+    """
+    return {
+        "from": from_sender,
+        "to": to_recipient,
+        "cc": cc or "",
+        "date": date,
+        "subject": subject,
+        "body": body,
+    }
+
+
+def parse_email(text: str) -> dict:
+    """
+    Parse an email stored as a flat ``"From: ...\nTo: ..."`` string.
+
+    Args:
+        text (str): Email in the flattened format used before records
+
+    Returns:
+        dict: The email record
+    """
+    headers, _, body = text.partition("Body: ")
+    email = make_email("", "", "", "", body)
+    for line in headers.splitlines():
+        name, _, value = line.partition(":")
+        if name in HEADERS:
+            email[HEADERS[name]] = value.strip()
+    return email
+
+
+def as_email(value) -> dict:
+    """Return a stored email as a record, parsing the legacy flat format."""
+    return value if isinstance(value, dict) else parse_email(value)
+
+
+def format_email(email: dict) -> str:
+    """
+    Render an email record as text for indexing and embedding.
+
+    Args:
+        email (dict): The email record
+
+    Returns:
+        str: Headers followed by the body
+    """
+    return (
+        f"From: {email['from']}\n"
+        f"To: {email['to']}\n"
+        f"Date: {email['date']}\n"
+        f"CC: {email['cc']}\n"
+        f"Subject: {email['subject']}\n"
+        f"Body: {email['body']}"
+    )
+
+
+def normalize_date(value: str):
+    """
+    Convert a date to ISO ``YYYY-MM-DD`` so dates sort correctly.
+
+    Args:
+        value (str): Date in ISO, common day/month or RFC 2822 form
+
+    Returns:
+        str: The ISO date, or None if it cannot be parsed
+    """
+    value = (value or "").strip()
+    try:
+        return datetime.fromisoformat(value[:10]).date().isoformat()
+    except ValueError:
+        pass
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date().isoformat()
+        except ValueError:
+            continue
+    try:
+        return parsedate_to_datetime(value).date().isoformat()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def thread_key(subject: str) -> str:
+    """
+    Normalise a subject line to identify its thread.
+
+    Args:
+        subject (str): Subject line, possibly with Re:/Fwd: prefixes
+
+    Returns:
+        str: Lowercase subject without reply or forward prefixes
+    """
+    return " ".join(REPLY_PREFIX.sub("", subject or "").lower().split())
+
+
+def _intersect(sets: list) -> set:
+    """Intersect sets, starting from the smallest."""
+    sets = sorted(sets, key=len)
+    result = set(sets[0])
+    for other in sets[1:]:
+        result.intersection_update(other)
+    return result
+
+
+class InvertedIndex:
+    """
+    Tokenized inverted index over one mailbox with BM25 ranking.
+
+    Postings map each term to the documents containing it and the term
+    frequency, so a query only touches the postings of its own terms.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        """
+        Args:
+            k1 (float): BM25 term frequency saturation
+            b (float): BM25 document length normalisation
+        """
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.lengths = {}
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def add(self, key: str, text: str) -> bool:
+        """
+        Index a document.
+
+        Args:
+            key (str): Stable document key
+            text (str): Document text
+
+        Returns:
+            bool: True if the document was new
+        """
+        if key in self.lengths:
+            return False
+        terms = Counter(tokenize(text))
+        for term, frequency in terms.items():
+            self.postings.setdefault(term, {})[key] = frequency
+        self.lengths[key] = sum(terms.values())
+        self.total_length += self.lengths[key]
+        return True
+
+    def search(
+        self, query: str, limit: int = 10, match_all: bool = True, within: set = None
+    ) -> list:
+        """
+        Rank documents against a query with BM25.
+
+        Args:
+            query (str): Free-text query
+            limit (int): Maximum number of documents to return
+            match_all (bool): Require every term (AND) instead of any term (OR)
+            within (set): Only consider these document keys
+
+        Returns:
+            list: (key, score) pairs, best match first
+        """
+        terms = set(tokenize(query))
+        postings = [self.postings.get(term, {}) for term in terms]
+        if not postings:
+            return []
+
+        if match_all:
+            candidates = _intersect(postings)
+        else:
+            candidates = set().union(*postings)
+        if within is not None:
+            candidates.intersection_update(within)
+        if not candidates:
+            return []
+
+        count = len(self.lengths)
+        average_length = self.total_length / count
+        scores = dict.fromkeys(candidates, 0.0)
+        for posting in postings:
+            idf = math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+            for key, frequency in posting.items():
+                if key not in scores:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[key] / average_length)
+                scores[key] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+
+class FieldIndex:
+    """
+    Secondary indexes over email header fields.
+
+    Sender and recipient (To and CC) postings are keyed by the tokens of the
+    names and addresses, threads by normalised subject, and dates are kept in
+    a sorted list for range queries.
+    """
+
+    def __init__(self):
+        self.senders = {}
+        self.recipients = {}
+        self.threads = {}
+        self.dates = []
+
+    def add(self, key: str, email: dict) -> None:
+        """
+        Index the header fields of an email.
+
+        Args:
+            key (str): Stable email key
+            email (dict): The email record
+        """
+        for token in set(tokenize(email["from"])):
+            self.senders.setdefault(token, set()).add(key)
+        for token in set(tokenize(f"{email['to']} {email['cc']}")):
+            self.recipients.setdefault(token, set()).add(key)
+        self.threads.setdefault(thread_key(email["subject"]), set()).add(key)
+        date = normalize_date(email["date"])
+        if date:
+            bisect.insort(self.dates, (date, key))
+
+    def _match(self, postings: dict, text: str) -> set:
+        """Keys whose field contains every token of text."""
+        tokens = set(tokenize(text))
+        if not tokens:
+            return set()
+        return _intersect([postings.get(token, set()) for token in tokens])
+
+    def _date_range(self, date_from: str, date_to: str) -> set:
+        """Keys dated within an inclusive range; either end may be open."""
+        start = normalize_date(date_from) or ""
+        end = normalize_date(date_to) or "\uffff"
+        low = bisect.bisect_left(self.dates, (start,))
+        high = bisect.bisect_right(self.dates, (end, "\uffff"))
+        return {key for _, key in self.dates[low:high]}
+
+    def filter(
+        self,
+        sender: str = None,
+        recipient: str = None,
+        date_from: str = None,
+        date_to: str = None,
+        thread: str = None,
+    ):
+        """
+        Find emails matching every given field filter.
+
+        Args:
+            sender (str): Name or address of the sender
+            recipient (str): Name or address of a To or CC recipient
+            date_from (str): Earliest date, inclusive
+            date_to (str): Latest date, inclusive
+            thread (str): Subject of the thread, with or without Re:/Fwd:
+
+        Returns:
+            set: Matching keys, or None if no filter was given
+        """
+        matches = []
+        if sender:
+            matches.append(self._match(self.senders, sender))
+        if recipient:
+            matches.append(self._match(self.recipients, recipient))
+        if thread:
+            matches.append(self.threads.get(thread_key(thread), set()))
+        if date_from or date_to:
+            matches.append(self._date_range(date_from, date_to))
+        return _intersect(matches) if matches else None
+
+
+class Mailbox:
+    """Search structures over one user's emails."""
+
+    def __init__(self):
+        self.emails = {}
+        self.text = InvertedIndex()
+        self.fields = FieldIndex()
+
+    def add(self, key: str, value) -> None:
+        """
+        Index a stored email.
+
+        Args:
+            key (str): Content digest of the stored value
+            value (dict | str): Email record, or a legacy flat string
+        """
+        if key in self.emails:
+            return
+        email = as_email(value)
+        self.emails[key] = email
+        self.text.add(key, format_email(email))
+        self.fields.add(key, email)
+
+    def by_date(self, keys) -> list:
+        """Return the emails for keys, oldest first."""
+        return sorted(
+            (self.emails[key] for key in keys),
+            key=lambda email: normalize_date(email["date"]) or "",
+        )
+
+
+class EmailIndex:
+    """
+    Per-user email search indexes kept in step with a memory system.
+
+    A user's mailbox is built from memory on first use and then updated
+    incrementally as emails are stored. With an embedder, every stored email
+    is also embedded once and the vector saved to memory under
+    ``{category}_vectors``, so semantic search never re-embeds at startup.
+
+    Each user's indexes are loaded, updated and searched under a lock striped
+    by user, so loading one user's mailbox never holds up another's. At most
+    ``max_users`` mailboxes and vector indexes are kept, least recently used
+    are dropped and reloaded on next use.
+    """
+
+    # Number of locks users are striped over.
+    USER_LOCKS = 64
+
+    def __init__(self, memory, category: str = "emails", embedder=None, max_users: int = 256):
+        """
+        Args:
+            memory (CouchbaseMemory): Memory system holding the emails
+            category (str): Category the emails are stored under
+            embedder (HashingEmbedder): Enables semantic search when given
+            max_users (int): Users whose mailbox and vector index are kept loaded
+        """
+        self.memory = memory
+        self.category = category
+        self.vector_category = f"{category}_vectors"
+        self.embedder = embedder
+        self.max_users = max_users
+        self._mailboxes = OrderedDict()
+        self._vectors = OrderedDict()
+        # Guards the two tables only; never held across a storage read.
+        self._lock = threading.Lock()
+        self._user_locks = [threading.RLock() for _ in range(self.USER_LOCKS)]
+
+    def _user_lock(self, user_id: str) -> threading.RLock:
+        """Lock serialising the loads and updates of a user's indexes."""
+        return self._user_locks[hash(user_id) % self.USER_LOCKS]
+
+    def _loaded(self, table: OrderedDict, user_id: str):
+        """Return a user's loaded mailbox or vector index, marking it recently used."""
+        with self._lock:
+            loaded = table.get(user_id)
+            if loaded is not None:
+                table.move_to_end(user_id)
+            return loaded
+
+    def _keep(self, table: OrderedDict, user_id: str, loaded) -> None:
+        """Keep a freshly loaded mailbox or vector index, dropping the least recently used."""
+        with self._lock:
+            table[user_id] = loaded
+            while len(table) > self.max_users:
+                table.popitem(last=False)
+
+    def _mailbox(self, user_id: str) -> Mailbox:
+        """Return a user's mailbox, loading it from memory the first time."""
+        mailbox = self._loaded(self._mailboxes, user_id)
+        if mailbox is not None:
+            return mailbox
+        with self._user_lock(user_id):
+            mailbox = self._loaded(self._mailboxes, user_id)
+            if mailbox is None:
+                mailbox = Mailbox()
+                for value in self.memory.search_by_category(user_id, self.category):
+                    mailbox.add(content_digest(value), value)
+                self._keep(self._mailboxes, user_id, mailbox)
+            return mailbox
+
+    def _vector_index(self, user_id: str) -> VectorIndex:
+        """Return a user's vector index, loading stored embeddings the first time."""
+        emails = self._mailbox(user_id).emails
+        vectors = self._loaded(self._vectors, user_id)
+        if vectors is not None:
+            return vectors
+        with self._user_lock(user_id):
+            vectors = self._loaded(self._vectors, user_id)
+            if vectors is not None:
+                return vectors
+            vectors = VectorIndex(self.embedder.dim)
+            for record in self.memory.search_by_category(user_id, self.vector_category):
+                key, model, vector = decode_vector(record)
+                if model == self.embedder.name and key in emails:
+                    vectors.add(key, vector)
+            missing = [key for key in emails if key not in vectors]
+            self._keep(self._vectors, user_id, vectors)
+        # Emails stored before embeddings were enabled are embedded once.
+        for key in missing:
+            self._embed(user_id, key, emails[key])
+        return vectors
+
+    def _embed(self, user_id: str, key: str, email: dict) -> None:
+        """Embed an email, persist the vector and add it to a loaded index."""
+        vector = self.embedder.embed(format_email(email))
+        self.memory.add(user_id, self.vector_category, encode_vector(key, self.embedder.name, vector))
+        with self._user_lock(user_id):
+            vectors = self._loaded(self._vectors, user_id)
+            if vectors is not None:
+                vectors.add(key, vector)
+
+    def embed_many(self, values: list) -> list:
+        """
+        Embed a batch of emails for ``add_many``, e.g. on a worker ahead of the write.
+
+        Args:
+            values (list): Emails exactly as stored in memory
+
+        Returns:
+            list: One embedding per email, None without an embedder
+        """
+        if self.embedder is None:
+            return None
+        return [self.embedder.embed(format_email(as_email(value))) for value in values]
+
+    def add_many(self, user_id: str, values: list, vectors: list = None) -> None:
+        """
+        Index a batch of newly stored emails, persisting their embeddings in one write.
+
+        Args:
+            user_id (str): Owner of the emails
+            values (list): Emails exactly as stored in memory
+            vectors (list): Their embeddings from ``embed_many``, computed here if None
+        """
+        keys = [content_digest(value) for value in values]
+        with self._user_lock(user_id):
+            mailbox = self._loaded(self._mailboxes, user_id)
+            if mailbox is not None:
+                for key, value in zip(keys, values):
+                    mailbox.add(key, value)
+        if vectors is None:
+            vectors = self.embed_many(values)
+        if vectors is None:
+            return
+        self.memory.add_many(
+            user_id,
+            self.vector_category,
+            [encode_vector(key, self.embedder.name, vector) for key, vector in zip(keys, vectors)],
+        )
+        with self._user_lock(user_id):
+            index = self._loaded(self._vectors, user_id)
+            if index is not None:
+                for key, vector in zip(keys, vectors):
+                    index.add(key, vector)
+
+    def add(self, user_id: str, value) -> None:
+        """
+        Index a newly stored email.
+
+        The mailbox is only updated if loaded; the embedding, if enabled, is
+        always computed and persisted.
+
+        Args:
+            user_id (str): Owner of the email
+            value (dict | str): Email exactly as stored in memory
+        """
+        key = content_digest(value)
+        with self._user_lock(user_id):
+            mailbox = self._loaded(self._mailboxes, user_id)
+            if mailbox is not None:
+                mailbox.add(key, value)
+        if self.embedder is not None:
+            self._embed(user_id, key, as_email(value))
+
+    def invalidate(self, user_id: str) -> None:
+        """
+        Drop a user's loaded indexes so they are rebuilt from memory on next use.
+
+        Needed after emails are removed from the category, e.g. by tiering.
+
+        Args:
+            user_id (str): Owner of the mailbox
+        """
+        with self._user_lock(user_id), self._lock:
+            self._mailboxes.pop(user_id, None)
+            self._vectors.pop(user_id, None)
+
+    def apply_change(self, change: dict) -> None:
+        """
+        Bring a user's loaded indexes up to date with a change made by any process.
+
+        Appended emails are added to a loaded mailbox, and embedded if its
+        vectors are loaded; emails already indexed are skipped. Removed emails
+        drop the user's indexes so they are rebuilt on next use.
+
+        Args:
+            change (dict): Change to the category, from ``MemoryBackend.read_changes``
+        """
+        user_id = change["user_id"]
+        if change["op"] != "append":
+            self.invalidate(user_id)
+            return
+        added = []
+        with self._user_lock(user_id):
+            mailbox = self._loaded(self._mailboxes, user_id)
+            if mailbox is None:
+                return
+            for value in change["values"]:
+                key = content_digest(value)
+                if key not in mailbox.emails:
+                    mailbox.add(key, value)
+                    added.append(key)
+            vectors = self._loaded(self._vectors, user_id)
+            missing = [key for key in added if vectors is not None and key not in vectors]
+        for key in missing:
+            self._embed(user_id, key, mailbox.emails[key])
+
+    def find(
+        self,
+        user_id: str,
+        query: str = None,
+        limit: int = 10,
+        match_all: bool = True,
+        semantic: bool = False,
+        offset: int = 0,
+        **filters,
+    ) -> list:
+        """
+        Find a user's emails by query and/or header fields.
+
+        Field filters are answered from the secondary indexes and narrow the
+        candidates of the query. Without a query, matches are returned oldest
+        first; without either, emails are returned in the order they were stored.
+
+        Args:
+            user_id (str): Owner of the mailbox
+            query (str): Free-text or natural language query
+            limit (int): Maximum number of emails to return
+            match_all (bool): Require every query term (AND) instead of any (OR)
+            semantic (bool): Rank by embedding similarity instead of BM25
+            offset (int): Number of leading matches to skip, for paging
+            **filters: sender, recipient, date_from, date_to and thread, as
+                accepted by ``FieldIndex.filter``
+
+        Returns:
+            list: Matching email records
+        """
+        mailbox = self._mailbox(user_id)
+        vectors = self._vector_index(user_id) if query and semantic else None
+        embedded = self.embedder.embed(query) if vectors is not None else None
+        with self._user_lock(user_id):
+            within = mailbox.fields.filter(**filters)
+            if not query:
+                if within is None:
+                    return list(islice(mailbox.emails.values(), offset, offset + limit))
+                return mailbox.by_date(within)[offset : offset + limit]
+            if vectors is not None:
+                hits = vectors.search(embedded, offset + limit, within)
+            else:
+                hits = mailbox.text.search(query, offset + limit, match_all, within)
+            return [mailbox.emails[key] for key, _ in hits[offset:]]
@@ -0,0 +1,446 @@
+"""
+In-process stand-in for a Couchbase collection.
+
+``FakeCollection`` keeps documents in a dict and implements the key-value,
+multi-document, binary counter and sub-document calls ``CouchbaseBackend``
+makes, with CAS checks and the SDK's exceptions, so the backend can be
+benchmarked and tested without a cluster. ``FakeClusterRegistry`` stands in
+for the connection pool and hands out one collection per name::
+
+    backend = create_backend("couchbase", bucket_name="bench", registry=FakeClusterRegistry())
+
+Every document and sub-document value is copied in and out as JSON, the way
+the SDK serialises it, and ``bytes_sent``/``bytes_received`` count those
+payloads. There is no network, expiry or durability, and every call copies
+whole documents through JSON, so latencies are only comparable between runs
+against the fake; the calls made and payload bytes moved are what it shows.
+"""
+import itertools
+import json
+import threading
+
+from couchbase.exceptions import (
+    CasMismatchException,
+    DocumentExistsException,
+    DocumentNotFoundException,
+    PathExistsException,
+    PathMismatchException,
+    PathNotFoundException,
+)
+from couchbase.subdocument import StoreSemantics, SubDocOp
+
+
+class ContentProxy:
+    """``content_as[type]`` of a stored value: converts it with ``type``."""
+
+    def __init__(self, value):
+        self._value = value
+
+    def __getitem__(self, content_type):
+        return content_type(self._value)
+
+
+class SubdocContentProxy:
+    """``content_as[type](index)`` of a lookup: converts one path's value with ``type``."""
+
+    def __init__(self, values: list, key: str):
+        self._values = values
+        self._key = key
+
+    def __getitem__(self, content_type):
+        def content(index: int):
+            found, value = self._values[index]
+            if not found:
+                raise PathNotFoundException(message=f"path {index} not found in {self._key}")
+            return content_type(value)
+
+        return content
+
+
+class GetResult:
+    """Result of a document read."""
+
+    def __init__(self, key: str, value, cas: int):
+        self.key = key
+        self.value = value
+        self.cas = cas
+
+    @property
+    def content_as(self) -> ContentProxy:
+        return ContentProxy(self.value)
+
+
+class LookupInResult:
+    """Result of a sub-document lookup: one ``(found, value)`` per spec."""
+
+    def __init__(self, key: str, values: list, cas: int):
+        self.key = key
+        self.cas = cas
+        self._values = values
+
+    def exists(self, index: int) -> bool:
+        return self._values[index][0]
+
+    @property
+    def content_as(self) -> SubdocContentProxy:
+        return SubdocContentProxy(self._values, self.key)
+
+
+class MutationResult:
+    """Result of a write; ``content_as`` holds counter values of a sub-document mutation."""
+
+    def __init__(self, key: str, cas: int, values: list = None):
+        self.key = key
+        self.cas = cas
+        self._values = [(value is not None, value) for value in values or []]
+
+    @property
+    def content_as(self) -> SubdocContentProxy:
+        return SubdocContentProxy(self._values, self.key)
+
+
+class CounterResult:
+    """Result of a binary counter operation."""
+
+    def __init__(self, key: str, content: int, cas: int):
+        self.key = key
+        self.content = content
+        self.cas = cas
+
+
+class ExistsResult:
+    """Result of an existence check."""
+
+    def __init__(self, key: str, exists: bool):
+        self.key = key
+        self.exists = exists
+
+
+class MultiResult:
+    """Result of a multi-document operation: successes and exceptions keyed by document ID."""
+
+    def __init__(self, results: dict, exceptions: dict):
+        self.results = results
+        self.exceptions = exceptions
+        self.all_ok = not exceptions
+
+
+class FakeBinaryCollection:
+    """``collection.binary()``: counters stored as plain integer documents."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def increment(self, key: str, options: dict = None) -> CounterResult:
+        options = options or {}
+        collection = self.collection
+        with collection.lock:
+            if key in collection.docs:
+                delta = options.get("delta")
+                value = collection._load(key)[0] + (delta.value if delta is not None else 1)
+            else:
+                initial = options.get("initial")
+                value = initial.value if initial is not None else 0
+            cas = collection._store(key, value)
+        return CounterResult(key, value, cas)
+
+
+def _split_path(path: str) -> list:
+    """
+    Split a sub-document path into ``(field, index)`` steps.
+
+    Args:
+        path (str): Dotted path, fields optionally backquoted, e.g. ```items`[3]``
+
+    Returns:
+        list: One ``(field, index or None)`` tuple per step
+    """
+    steps, field, quoted, position = [], "", False, 0
+    while position < len(path):
+        char = path[position]
+        if quoted:
+            if char == "`" and path[position + 1 : position + 2] == "`":
+                field += "`"
+                position += 1
+            elif char == "`":
+                quoted = False
+            else:
+                field += char
+        elif char == "`":
+            quoted = True
+        elif char == ".":
+            steps.append(field)
+            field = ""
+        else:
+            field += char
+        position += 1
+    steps.append(field)
+    parsed = []
+    for step in steps:
+        index = None
+        if step.endswith("]") and "[" in step:
+            step, index = step[:-1].rsplit("[", 1)
+            index = int(index)
+        parsed.append((step, index))
+    return parsed
+
+
+def _resolve(document, path: str):
+    """
+    Find the value at a sub-document path.
+
+    Returns:
+        tuple: (found, value)
+    """
+    node = document
+    for field, index in _split_path(path):
+        if not isinstance(node, dict) or field not in node:
+            return False, None
+        node = node[field]
+        if index is not None:
+            if not isinstance(node, list) or not -len(node) <= index < len(node):
+                return False, None
+            node = node[index]
+    return True, node
+
+
+def _project(document: dict, paths: list) -> dict:
+    """Keep only the given sub-document paths of a document, nested as they were."""
+    projected = {}
+    for path in paths:
+        found, value = _resolve(document, path)
+        if not found:
+            continue
+        fields = [field for field, _ in _split_path(path)]
+        node = projected
+        for field in fields[:-1]:
+            node = node.setdefault(field, {})
+        node[fields[-1]] = value
+    return projected
+
+
+class FakeCollection:
+    """Thread-safe in-memory collection with the SDK's calling conventions."""
+
+    def __init__(self):
+        self.docs = {}
+        self.lock = threading.RLock()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._cas = itertools.count(1)
+
+    def _store(self, key: str, value, sent: int = None) -> int:
+        """Save a document; ``sent`` is the payload size when only part of it was sent."""
+        encoded = json.dumps(value)
+        self.bytes_sent += len(encoded) if sent is None else sent
+        cas = next(self._cas)
+        self.docs[key] = (encoded, cas)
+        return cas
+
+    def _load(self, key: str) -> tuple:
+        if key not in self.docs:
+            raise DocumentNotFoundException(message=f"{key} not found")
+        encoded, cas = self.docs[key]
+        return json.loads(encoded), cas
+
+    def _received(self, value):
+        encoded = json.dumps(value)
+        with self.lock:
+            self.bytes_received += len(encoded)
+        return json.loads(encoded)
+
+    def _check_cas(self, key: str, options: dict) -> None:
+        cas = (options or {}).get("cas")
+        if cas and self.docs[key][1] != cas:
+            raise CasMismatchException(message=f"{key} changed")
+
+    def binary(self) -> FakeBinaryCollection:
+        return FakeBinaryCollection(self)
+
+    def exists(self, key: str, options: dict = None) -> ExistsResult:
+        with self.lock:
+            return ExistsResult(key, key in self.docs)
+
+    def get(self, key: str, options: dict = None) -> GetResult:
+        with self.lock:
+            value, cas = self._load(key)
+        fields = (options or {}).get("project")
+        if fields:
+            value = _project(value, fields)
+        return GetResult(key, self._received(value), cas)
+
+    def get_multi(self, keys: list, options: dict = None) -> MultiResult:
+        results, exceptions = {}, {}
+        for key in keys:
+            try:
+                results[key] = self.get(key, options)
+            except DocumentNotFoundException as e:
+                exceptions[key] = e
+        return MultiResult(results, exceptions)
+
+    def insert(self, key: str, value, options: dict = None) -> MutationResult:
+        with self.lock:
+            if key in self.docs:
+                raise DocumentExistsException(message=f"{key} exists")
+            return MutationResult(key, self._store(key, value))
+
+    def upsert(self, key: str, value, options: dict = None) -> MutationResult:
+        with self.lock:
+            return MutationResult(key, self._store(key, value))
+
+    def upsert_multi(self, documents: dict, options: dict = None) -> MultiResult:
+        return MultiResult({key: self.upsert(key, value) for key, value in documents.items()}, {})
+
+    def replace(self, key: str, value, options: dict = None) -> MutationResult:
+        with self.lock:
+            self._load(key)
+            self._check_cas(key, options)
+            return MutationResult(key, self._store(key, value))
+
+    def remove(self, key: str, options: dict = None) -> MutationResult:
+        with self.lock:
+            self._load(key)
+            self._check_cas(key, options)
+            return MutationResult(key, self.docs.pop(key)[1])
+
+    def remove_multi(self, keys: list, options: dict = None) -> MultiResult:
+        results, exceptions = {}, {}
+        for key in keys:
+            try:
+                results[key] = self.remove(key)
+            except DocumentNotFoundException as e:
+                exceptions[key] = e
+        return MultiResult(results, exceptions)
+
+    def lookup_in(self, key: str, specs: list, options: dict = None) -> LookupInResult:
+        with self.lock:
+            document, cas = self._load(key)
+        values = []
+        for spec in specs:
+            found, value = _resolve(document, spec[1])
+            if spec[0] == SubDocOp.EXISTS:
+                value = found
+            elif spec[0] == SubDocOp.GET_COUNT and found:
+                value = len(value)
+            values.append((found, self._received(value) if found else None))
+        return LookupInResult(key, values, cas)
+
+    def mutate_in(self, key: str, specs: list, options: dict = None) -> MutationResult:
+        options = options or {}
+        semantics = options.get("store_semantics", StoreSemantics.REPLACE)
+        with self.lock:
+            if key in self.docs:
+                if semantics == StoreSemantics.INSERT:
+                    raise DocumentExistsException(message=f"{key} exists")
+                document, _ = self._load(key)
+                self._check_cas(key, options)
+            elif semantics == StoreSemantics.REPLACE:
+                raise DocumentNotFoundException(message=f"{key} not found")
+            else:
+                document = {}
+            counters = [self._apply(document, spec) for spec in specs]
+            # Only the specs' values travel, not the whole document.
+            cas = self._store(key, document, sum(len(json.dumps(spec[5])) for spec in specs if len(spec) > 5))
+        return MutationResult(key, cas, counters)
+
+    def _apply(self, document: dict, spec: tuple):
+        """Apply one mutation spec in place; returns the new value of a counter."""
+        operation, path, create_parents = spec[0], spec[1], spec[2]
+        value = json.loads(json.dumps(spec[5])) if len(spec) > 5 else None
+        steps = _split_path(path)
+        parent = document
+        for field, _ in steps[:-1]:
+            if field not in parent:
+                if not create_parents:
+                    raise PathNotFoundException(message=f"{path} not found")
+                parent[field] = {}
+            parent = parent[field]
+        field = steps[-1][0]
+        if operation in (SubDocOp.ARRAY_PUSH_LAST, SubDocOp.ARRAY_ADD_UNIQUE):
+            if field not in parent and not create_parents:
+                raise PathNotFoundException(message=f"{path} not found")
+            array = parent.setdefault(field, [])
+            if not isinstance(array, list):
+                raise PathMismatchException(message=f"{path} is not an array")
+            if operation == SubDocOp.ARRAY_PUSH_LAST:
+                array.extend(value)
+            elif value in array:
+                raise PathExistsException(message=f"{path} already holds the value")
+            else:
+                array.append(value)
+        elif operation == SubDocOp.DICT_ADD:
+            if field in parent:
+                raise PathExistsException(message=f"{path} exists")
+            parent[field] = value
+        elif operation == SubDocOp.DICT_UPSERT:
+            parent[field] = value
+        elif operation in (SubDocOp.REPLACE, SubDocOp.REMOVE):
+            if field not in parent:
+                raise PathNotFoundException(message=f"{path} not found")
+            if operation == SubDocOp.REMOVE:
+                del parent[field]
+            else:
+                parent[field] = value
+        elif operation == SubDocOp.COUNTER:
+            parent[field] = parent.get(field, 0) + value
+            return parent[field]
+        else:
+            raise NotImplementedError(f"Sub-document operation {operation} is not supported")
+        return None
+
+
+class FakeScope:
+    """Scope whose collections are created on first use."""
+
+    def __init__(self):
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def collection(self, name: str) -> FakeCollection:
+        with self._lock:
+            return self._collections.setdefault(name, FakeCollection())
+
+
+class FakeBucket:
+    """Bucket whose scopes are created on first use."""
+
+    def __init__(self):
+        self._scopes = {}
+        self._lock = threading.Lock()
+
+    def scope(self, name: str) -> FakeScope:
+        with self._lock:
+            return self._scopes.setdefault(name, FakeScope())
+
+
+class FakeCluster:
+    """Cluster that is always ready."""
+
+    def wait_until_ready(self, timeout=None) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class FakeClusterRegistry:
+    """
+    ``ClusterRegistry`` stand-in: backends sharing a registry share its
+    buckets, so several memories or processes' worth of backends see the
+    same documents.
+    """
+
+    def __init__(self):
+        self._cluster = FakeCluster()
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def cluster(self, conn_str: str, username: str, password: str) -> FakeCluster:
+        return self._cluster
+
+    def bucket(self, conn_str: str, username: str, password: str, bucket_name: str) -> FakeBucket:
+        with self._lock:
+            return self._buckets.setdefault(bucket_name, FakeBucket())
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,369 @@
+"""
+Bulk-import mailbox files into the email memory used by the RAG agent.
+
+Usage:
+    python ingest.py sample-data.md --user alice
+    python ingest.py archive.mbox --user alice --workers 16 --batch-size 200
+    python ingest.py exports/ --user alice
+
+Markdown dumps (the ``**From:** ... ----`` layout of sample-data.md), mbox
+files and EML files (or a directory of them) are streamed record by record.
+Batches are parsed and embedded on a pool of workers, then written and
+indexed one at a time in source order. Concurrent writes to the same
+category document would only contend for it and store emails in whatever
+order they finished. Progress is checkpointed so an interrupted import
+resumes where it stopped.
+
+An agent already running in another process does not see the imported
+emails in its loaded mailboxes until it restarts, unless
+``MEMORY_CHANGE_LOG=on``. With the change log its change feed adds them
+within ``CHANGE_FEED_INTERVAL`` seconds.
+"""
+import argparse
+import json
+import mailbox
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email import policy
+from email.parser import BytesParser
+from itertools import islice
+
+from dotenv import load_dotenv
+
+from email_index import EmailIndex, make_email
+from memory import CouchbaseMemory
+from vectors import HashingEmbedder
+
+MARKDOWN_HEADER = re.compile(r"^\*\*(From|To|Date|CC|Subject|Body):\*\*[ \t]*(.*?)\s*$")
+MARKDOWN_SEPARATOR = "----"
+
+
+def read_markdown(path: str):
+    """
+    Stream emails from a Markdown dump laid out like sample-data.md.
+
+    Args:
+        path (str): Markdown file
+
+    Yields:
+        dict: Email records in file order
+    """
+    fields, body = {}, None
+
+    def record():
+        return make_email(
+            fields.get("From", ""),
+            fields.get("To", ""),
+            fields.get("Date", ""),
+            fields.get("Subject", ""),
+            "\n".join(body or []).strip(),
+            fields.get("CC"),
+        )
+
+    with open(path, encoding="utf-8") as source:
+        for line in source:
+            line = line.rstrip()
+            if line == MARKDOWN_SEPARATOR:
+                if fields:
+                    yield record()
+                fields, body = {}, None
+                continue
+            header = MARKDOWN_HEADER.match(line) if body is None else None
+            if header and header.group(1) == "Body":
+                body = [header.group(2)] if header.group(2) else []
+            elif header:
+                fields[header.group(1)] = header.group(2)
+            elif body is not None:
+                body.append(line)
+    if fields:
+        yield record()
+
+
+def _from_message(message) -> dict:
+    """Convert a parsed email message to a record, preferring the plain text body."""
+    part = message.get_body(preferencelist=("plain", "html"))
+    body = part.get_content() if part is not None else ""
+    return make_email(
+        str(message.get("From", "")),
+        str(message.get("To", "")),
+        str(message.get("Date", "")),
+        str(message.get("Subject", "")),
+        body.strip(),
+        str(message.get("Cc", "")) or None,
+    )
+
+
+def parse_message(raw: bytes) -> dict:
+    """
+    Parse one raw RFC 822 message into an email record.
+
+    Args:
+        raw (bytes): The message as stored in an mbox or EML file
+
+    Returns:
+        dict: The email record
+    """
+    return _from_message(BytesParser(policy=policy.default).parsebytes(raw))
+
+
+def mbox_messages(path: str):
+    """
+    Stream the raw messages of an mbox file, unparsed.
+
+    Args:
+        path (str): mbox file
+
+    Yields:
+        bytes: Messages in file order
+    """
+    box = mailbox.mbox(path, create=False)
+    try:
+        for key in box.iterkeys():
+            yield box.get_bytes(key)
+    finally:
+        box.close()
+
+
+def eml_messages(path: str):
+    """
+    Stream the raw messages of an EML file or a directory of them, unparsed.
+
+    Args:
+        path (str): EML file, or directory searched for ``*.eml`` files
+
+    Yields:
+        bytes: Messages, directory entries in name order
+    """
+    if os.path.isdir(path):
+        paths = sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(path)
+            for name in names
+            if name.lower().endswith(".eml")
+        )
+    else:
+        paths = [path]
+    for eml_path in paths:
+        with open(eml_path, "rb") as source:
+            yield source.read()
+
+
+def read_mbox(path: str):
+    """
+    Stream emails from an mbox file.
+
+    Args:
+        path (str): mbox file
+
+    Yields:
+        dict: Email records in file order
+    """
+    for raw in mbox_messages(path):
+        yield parse_message(raw)
+
+
+def read_eml(path: str):
+    """
+    Stream emails from an EML file or a directory of them.
+
+    Args:
+        path (str): EML file, or directory searched for ``*.eml`` files
+
+    Yields:
+        dict: Email records, directory entries in name order
+    """
+    for raw in eml_messages(path):
+        yield parse_message(raw)
+
+
+READERS = {"markdown": read_markdown, "mbox": read_mbox, "eml": read_eml}
+# Unparsed sources and their parser, so ``ingest`` can parse on its workers.
+RAW_READERS = {"mbox": (mbox_messages, parse_message), "eml": (eml_messages, parse_message)}
+
+
+def detect_format(path: str) -> str:
+    """Guess the source format from a path."""
+    if os.path.isdir(path) or path.lower().endswith(".eml"):
+        return "eml"
+    if path.lower().endswith((".md", ".markdown")):
+        return "markdown"
+    return "mbox"
+
+
+def batched(records, size: int):
+    """Group an iterator into lists of at most size items."""
+    while True:
+        batch = list(islice(records, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Checkpoint:
+    """Records how many leading records of a source have been imported."""
+
+    def __init__(self, path: str, source: str):
+        """
+        Args:
+            path (str): Checkpoint file, or None to disable checkpointing
+            source (str): Identifies the import so other sources start fresh
+        """
+        self.path = path
+        self.source = source
+        self.records = 0
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as state_file:
+                state = json.load(state_file)
+            if state.get("source") == source:
+                self.records = state.get("records", 0)
+
+    def save(self, records: int) -> None:
+        """Atomically persist the number of imported records."""
+        self.records = records
+        if not self.path:
+            return
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as state_file:
+            json.dump({"source": self.source, "records": records}, state_file)
+        os.replace(temporary, self.path)
+
+
+def ingest(
+    memory: CouchbaseMemory,
+    email_index: EmailIndex,
+    user_id: str,
+    records,
+    checkpoint: Checkpoint,
+    category: str = "emails",
+    batch_size: int = 100,
+    workers: int = 8,
+    report_every: float = 5.0,
+    parse=None,
+) -> dict:
+    """
+    Write a stream of email records to memory and the email indexes.
+
+    Batches are parsed and embedded by ``workers`` threads. Every write to
+    the category goes through the calling thread in source order, so the
+    stored order is deterministic and writes never contend for the category
+    document. At most ``2 * workers`` batches are prepared ahead of the
+    writer, so memory use stays flat however large the source is. The
+    checkpoint advances after each written batch; a batch replayed after a
+    crash is deduplicated by the memory layer.
+
+    Args:
+        memory (CouchbaseMemory): Memory system to write to
+        email_index (EmailIndex): Indexes to update alongside
+        user_id (str): Owner of the mailbox
+        records (iterator): Email records in source order, or raw messages with ``parse``
+        checkpoint (Checkpoint): Resume position, updated as batches finish
+        category (str): Category the emails are stored under
+        batch_size (int): Records per bulk write
+        workers (int): Batches parsed and embedded concurrently
+        report_every (float): Seconds between progress lines
+        parse (callable): Turns each item of ``records`` into an email record, on the workers
+
+    Returns:
+        dict: Records read, records saved, elapsed seconds and records per second
+    """
+    def prepare(batch):
+        if parse is not None:
+            batch = [parse(record) for record in batch]
+        return batch, email_index.embed_many(batch)
+
+    skipped = checkpoint.records
+    records = islice(records, skipped, None)
+    started = last_report = time.perf_counter()
+    prepared = deque()
+    totals = {"records": 0, "saved": 0}
+
+    def write_next():
+        nonlocal last_report
+        batch, vectors = prepared.popleft().result()
+        totals["saved"] += memory.add_many(user_id, category, batch)
+        email_index.add_many(user_id, batch, vectors)
+        totals["records"] += len(batch)
+        checkpoint.save(skipped + totals["records"])
+        now = time.perf_counter()
+        if now - last_report >= report_every:
+            last_report = now
+            rate = totals["records"] / (now - started)
+            print(f"INFO: Imported {totals['records']} emails ({rate:.0f}/s)")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for batch in batched(records, batch_size):
+            if len(prepared) >= 2 * workers:
+                write_next()
+            prepared.append(pool.submit(prepare, batch))
+        while prepared:
+            write_next()
+
+    elapsed = time.perf_counter() - started
+    return {
+        "records": totals["records"],
+        "saved": totals["saved"],
+        "skipped": skipped,
+        "seconds": elapsed,
+        "rate": totals["records"] / elapsed if elapsed else 0.0,
+    }
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("source", help="Markdown dump, mbox file, EML file or directory of EML files")
+    parser.add_argument("--user", default=os.getenv("USER_ID"), help="Owner of the mailbox")
+    parser.add_argument("--format", choices=sorted(READERS), help="Source format (guessed from the path by default)")
+    parser.add_argument("--scope", default="agent", help="Scope holding the memory collection")
+    parser.add_argument("--collection", default="memory", help="Memory collection name")
+    parser.add_argument("--batch-size", type=int, default=100, help="Emails per bulk write")
+    parser.add_argument("--workers", type=int, default=8, help="Batches parsed and embedded concurrently")
+    parser.add_argument("--checkpoint", default=".ingest-checkpoint.json", help="Resume state file ('' to disable)")
+    parser.add_argument("--no-embeddings", action="store_true", help="Skip computing semantic search vectors")
+    args = parser.parse_args()
+    if not args.user:
+        parser.error("--user is required when USER_ID is not set")
+
+    memory = CouchbaseMemory(
+        conn_str=os.getenv("COUCHBASE_CONN_STR"),
+        username=os.getenv("COUCHBASE_USERNAME"),
+        password=os.getenv("COUCHBASE_PASSWORD"),
+        bucket_name=os.getenv("COUCHBASE_BUCKET"),
+        scope_name=args.scope,
+        collection_name=args.collection,
+    )
+    email_index = EmailIndex(
+        memory, category="emails", embedder=None if args.no_embeddings else HashingEmbedder()
+    )
+    source_format = args.format or detect_format(args.source)
+    checkpoint = Checkpoint(
+        args.checkpoint or None,
+        f"{os.path.abspath(args.source)}:{source_format}:{args.scope}.{args.collection}:{args.user}",
+    )
+
+    if source_format in RAW_READERS:
+        read, parse = RAW_READERS[source_format]
+        records = read(args.source)
+    else:
+        records, parse = READERS[source_format](args.source), None
+    stats = ingest(
+        memory,
+        email_index,
+        args.user,
+        records,
+        checkpoint,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        parse=parse,
+    )
+    print(
+        f"Imported {stats['records']} emails ({stats['saved']} new, {stats['skipped']} skipped "
+        f"from checkpoint) in {stats['seconds']:.1f}s, {stats['rate']:.0f} emails/s."
+    )
+
+
+if __name__ == "__main__":
+    main()
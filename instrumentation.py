@@ -0,0 +1,399 @@
+"""
+Pluggable instrumentation for the memory layer and the agent tools.
+
+Call sites time work with ``span`` and bump ``count``ers, and emit events
+with ``log`` instead of printing. By default nothing is recorded, so the hot
+path pays for a function call and nothing else. ``Telemetry`` records spans
+and counters, writes leveled JSON log lines (sampling the chatty levels) and
+can export to a local file:
+
+- ``PrometheusFileExporter`` rewrites a Prometheus text exposition file
+- ``SpanFileExporter`` appends finished spans as OpenTelemetry (OTLP JSON) records
+
+Configured from the environment on first use:
+
+- ``TELEMETRY``: ``off`` (default) or ``on``
+- ``TELEMETRY_LOG_LEVEL``: lowest level logged (default ``INFO``)
+- ``TELEMETRY_SAMPLE_RATE``: fraction of DEBUG/INFO events logged (default 1.0)
+- ``TELEMETRY_EXPORT``: ``prometheus`` or ``otel`` to export to a file
+- ``TELEMETRY_EXPORT_PATH``: file the exporter writes (default ``telemetry.prom``
+  or ``telemetry-spans.jsonl``)
+"""
+import atexit
+import functools
+import json
+import os
+import random
+import sys
+import threading
+import time
+from contextvars import ContextVar
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_current_span = ContextVar("current_span", default=None)
+
+
+class _NullSpan:
+    """Span returned when nothing is recorded."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **attributes) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Instrumentation:
+    """No-op instrumentation, the default."""
+
+    enabled = False
+
+    def span(self, name: str, **attributes):
+        """
+        Time a block of work.
+
+        Args:
+            name (str): Operation name, e.g. "memory.read"
+            **attributes: Details attached to the span (not used as metric labels)
+
+        Returns:
+            Context manager yielding a span whose ``set`` adds attributes
+        """
+        return _NULL_SPAN
+
+    def count(self, name: str, value: float = 1, **labels) -> None:
+        """
+        Add to a counter.
+
+        Args:
+            name (str): Counter name, e.g. "memory_cache_hits_total"
+            value (float): Amount to add
+            **labels: Low-cardinality labels, e.g. operation="read"
+        """
+
+    def log(self, level: str, event: str, **fields) -> None:
+        """
+        Emit a structured event.
+
+        Args:
+            level (str): DEBUG, INFO, WARNING or ERROR
+            event (str): Event name, e.g. "memory.saved"
+            **fields: Event fields
+        """
+
+    def flush(self) -> None:
+        """Write anything buffered to the exporter."""
+
+
+class Span:
+    """A timed operation recorded by ``Telemetry``."""
+
+    def __init__(self, telemetry, name: str, attributes: dict):
+        self.telemetry = telemetry
+        self.name = name
+        self.attributes = attributes
+        self.status = "ok"
+
+    def set(self, **attributes) -> None:
+        """Attach more attributes to the span."""
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        parent = _current_span.get()
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.span_id = os.urandom(8).hex()
+        self._token = _current_span.set(self)
+        self.start_ns = time.time_ns()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.duration = time.perf_counter() - self._started
+        self.end_ns = self.start_ns + int(self.duration * 1e9)
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.status = "error"
+            self.attributes["error"] = exc_type.__name__
+        self.telemetry._finish(self)
+        return False
+
+
+class Telemetry(Instrumentation):
+    """Records spans and counters and writes leveled, sampled JSON log lines."""
+
+    enabled = True
+
+    def __init__(
+        self,
+        log_level: str = "INFO",
+        sample_rate: float = 1.0,
+        stream=None,
+        exporter=None,
+        export_every: float = 10.0,
+    ):
+        """
+        Args:
+            log_level (str): Lowest level written to the log
+            sample_rate (float): Fraction of DEBUG and INFO events written;
+                warnings and errors are always written
+            stream: Log destination, stderr by default
+            exporter: ``PrometheusFileExporter``, ``SpanFileExporter`` or None
+            export_every (float): Seconds between automatic exports
+        """
+        self.log_level = LEVELS[log_level.upper()]
+        self.sample_rate = sample_rate
+        self.stream = stream or sys.stderr
+        self.exporter = exporter
+        self.export_every = export_every
+        self.counters = {}
+        self.histograms = {}
+        self._exported = time.monotonic()
+        self._lock = threading.Lock()
+
+    def span(self, name: str, **attributes):
+        return Span(self, name, attributes)
+
+    def count(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def log(self, level: str, event: str, **fields) -> None:
+        severity = LEVELS[level]
+        if severity < self.log_level:
+            return
+        if severity < LEVELS["WARNING"] and random.random() >= self.sample_rate:
+            return
+        record = {"ts": time.time(), "level": level, "event": event, **fields}
+        span = _current_span.get()
+        if span is not None:
+            record["trace_id"] = span.trace_id
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self.stream.write(line + "\n")
+
+    def _finish(self, span: Span) -> None:
+        """Fold a finished span into its latency histogram and pass it to the exporter."""
+        key = (span.name, span.status)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"count": 0, "sum": 0.0, "buckets": [0] * len(BUCKETS)}
+            histogram["count"] += 1
+            histogram["sum"] += span.duration
+            for index, bound in enumerate(BUCKETS):
+                if span.duration <= bound:
+                    histogram["buckets"][index] += 1
+            due = time.monotonic() - self._exported >= self.export_every
+        if self.exporter is not None:
+            self.exporter.on_span(span)
+            if due:
+                self.flush()
+        self.log("DEBUG", "span", name=span.name, seconds=span.duration, status=span.status)
+
+    def snapshot(self) -> dict:
+        """
+        Copy the recorded counters and span histograms.
+
+        Returns:
+            dict: ``counters`` keyed by (name, labels) and ``histograms`` keyed
+                by (span name, status)
+        """
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "histograms": {
+                    key: {**value, "buckets": list(value["buckets"])}
+                    for key, value in self.histograms.items()
+                },
+            }
+
+    def flush(self) -> None:
+        self._exported = time.monotonic()
+        if self.exporter is not None:
+            self.exporter.export(self)
+
+
+def _atomic_write(path: str, text: str) -> None:
+    """Replace a file's contents in one step."""
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as output:
+        output.write(text)
+    os.replace(temporary, path)
+
+
+def _labels(pairs) -> str:
+    """Format Prometheus labels."""
+    escaped = (
+        f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for key, value in pairs
+    )
+    return "{" + ",".join(escaped) + "}" if pairs else ""
+
+
+class PrometheusFileExporter:
+    """Writes counters and span latency histograms in Prometheus text format."""
+
+    def __init__(self, path: str = "telemetry.prom"):
+        """
+        Args:
+            path (str): File rewritten on every export, e.g. for node_exporter's textfile collector
+        """
+        self.path = path
+
+    def on_span(self, span: Span) -> None:
+        pass
+
+    def export(self, telemetry: Telemetry) -> None:
+        snapshot = telemetry.snapshot()
+        lines = []
+        counters = {}
+        for (name, labels), value in sorted(snapshot["counters"].items()):
+            counters.setdefault(name, []).append((labels, value))
+        for name, series in counters.items():
+            lines.append(f"# TYPE {name} counter")
+            lines.extend(f"{name}{_labels(labels)} {value}" for labels, value in series)
+        if snapshot["histograms"]:
+            lines.append("# TYPE span_duration_seconds histogram")
+        for (name, status), histogram in sorted(snapshot["histograms"].items()):
+            labels = [("span", name), ("status", status)]
+            for bound, count in zip(BUCKETS, histogram["buckets"]):
+                lines.append(f"span_duration_seconds_bucket{_labels(labels + [('le', bound)])} {count}")
+            lines.append(f"span_duration_seconds_bucket{_labels(labels + [('le', '+Inf')])} {histogram['count']}")
+            lines.append(f"span_duration_seconds_sum{_labels(labels)} {histogram['sum']}")
+            lines.append(f"span_duration_seconds_count{_labels(labels)} {histogram['count']}")
+        _atomic_write(self.path, "\n".join(lines) + "\n")
+
+
+class SpanFileExporter:
+    """Appends finished spans to a file as OpenTelemetry OTLP JSON, one export request per line."""
+
+    def __init__(self, path: str = "telemetry-spans.jsonl", service_name: str = "couchbase-memory"):
+        """
+        Args:
+            path (str): File spans are appended to
+            service_name (str): ``service.name`` resource attribute
+        """
+        self.path = path
+        self.service_name = service_name
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def on_span(self, span: Span) -> None:
+        record = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 1,
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns),
+            "attributes": [
+                {"key": key, "value": {"stringValue": str(value)}}
+                for key, value in span.attributes.items()
+            ],
+            "status": {"code": 2 if span.status == "error" else 1},
+        }
+        if span.parent_id:
+            record["parentSpanId"] = span.parent_id
+        with self._lock:
+            self._pending.append(record)
+
+    def export(self, telemetry: Telemetry) -> None:
+        with self._lock:
+            spans, self._pending = self._pending, []
+        if not spans:
+            return
+        request = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]
+                    },
+                    "scopeSpans": [{"scope": {"name": "couchbase-memory"}, "spans": spans}],
+                }
+            ]
+        }
+        with open(self.path, "a", encoding="utf-8") as output:
+            output.write(json.dumps(request) + "\n")
+
+
+def configure_from_env() -> Instrumentation:
+    """
+    Build instrumentation from the ``TELEMETRY*`` environment variables.
+
+    Returns:
+        Instrumentation: A no-op instance unless ``TELEMETRY`` is enabled
+    """
+    if os.getenv("TELEMETRY", "off").lower() not in ("on", "1", "true"):
+        return Instrumentation()
+    exporter = None
+    export = os.getenv("TELEMETRY_EXPORT", "").lower()
+    if export == "prometheus":
+        exporter = PrometheusFileExporter(os.getenv("TELEMETRY_EXPORT_PATH", "telemetry.prom"))
+    elif export == "otel":
+        exporter = SpanFileExporter(os.getenv("TELEMETRY_EXPORT_PATH", "telemetry-spans.jsonl"))
+    elif export:
+        raise ValueError(f"Unknown TELEMETRY_EXPORT '{export}'")
+    return Telemetry(
+        log_level=os.getenv("TELEMETRY_LOG_LEVEL", "INFO"),
+        sample_rate=float(os.getenv("TELEMETRY_SAMPLE_RATE", "1.0")),
+        exporter=exporter,
+    )
+
+
+_instrumentation = None
+
+
+def get_instrumentation() -> Instrumentation:
+    """Return the process-wide instrumentation, configuring it from the environment on first use."""
+    global _instrumentation
+    if _instrumentation is None:
+        set_instrumentation(configure_from_env())
+    return _instrumentation
+
+
+def set_instrumentation(instrumentation: Instrumentation) -> None:
+    """
+    Replace the process-wide instrumentation, flushing the one it replaces.
+
+    Args:
+        instrumentation (Instrumentation): New instrumentation; flushed at exit
+            while it is the current one
+    """
+    global _instrumentation
+    previous, _instrumentation = _instrumentation, instrumentation
+    if previous is not None and previous is not instrumentation:
+        previous.flush()
+
+
+@atexit.register
+def _flush_current() -> None:
+    """Flush whichever instrumentation is current when the process exits."""
+    if _instrumentation is not None:
+        _instrumentation.flush()
+
+
+def instrument_tool(function):
+    """
+    Wrap an async agent tool in a ``tool.<name>`` span.
+
+    The wrapper keeps the tool's name, docstring and signature, so the model
+    sees the same declaration.
+    """
+    name = f"tool.{function.__name__}"
+
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        with get_instrumentation().span(name):
+            return await function(*args, **kwargs)
+
+    return wrapper
@@ -6,14 +6,19 @@ from typing import Optional
 from dotenv import load_dotenv
 
 from google.adk.agents import Agent
-from google.adk.sessions import InMemorySessionService
 from google.adk.runners import Runner
 from google.genai import types
 from google.adk.models.lite_llm import LiteLlm
-from couchbase.cluster import Cluster
-from couchbase.options import ClusterOptions
-from couchbase.auth import PasswordAuthenticator
-from couchbase.exceptions import DocumentNotFoundException
+
+from changes import CacheInvalidator, CallbackConsumer, ChangeFeed
+from context import get_user_id, request_context
+from email_index import EmailIndex, as_email, make_email
+from instrumentation import get_instrumentation, instrument_tool
+from memory import AsyncCouchbaseMemory, CouchbaseMemory
+from paging import decode_cursor, encode_cursor, fit_to_budget
+from sessions import session_service_from_env
+from tiering import EmailTiering
+from vectors import HashingEmbedder
 
 # Load environment variables from .env file
 load_dotenv()
@@ -33,57 +38,6 @@ if OPENROUTER_API_KEY:
         api_key=API_KEY,
     )
 
-# --- Couchbase Memory Class ---
-class CouchbaseMemory:
-    def __init__(
-        self,
-        conn_str,
-        username,
-        password,
-        bucket_name,
-        scope_name="email",
-        collection_name="memory",
-    ):
-        self.cluster = Cluster(
-            conn_str, ClusterOptions(PasswordAuthenticator(username, password))
-        )
-        self.bucket = self.cluster.bucket(bucket_name)
-        self.scope = self.bucket.scope(scope_name)
-        self.collection = self.scope.collection(collection_name)
-        print("[Memory System] Connected to Couchbase Capella")
-
-    def _doc_id(self, user_id: str):
-        return f"user::{user_id}"
-
-    def add(self, user_id: str, category: str, data: str):
-        doc_id = self._doc_id(user_id)
-        try:
-            doc = self.collection.get(doc_id).content_as[dict]
-        except DocumentNotFoundException:
-            doc = {}
-
-        doc.setdefault(category, [])
-        if data not in doc[category]:
-            doc[category].append(data)
-            self.collection.upsert(doc_id, doc)
-            print(
-                f"[Memory System] Saved data for user '{user_id}' in category '{category}': '{data}'"
-            )
-        return True
-
-    def search_by_category(self, user_id: str, category: str) -> list:
-        doc_id = self._doc_id(user_id)
-        try:
-            doc = self.collection.get(doc_id).content_as[dict]
-            results = doc.get(category, [])
-        except DocumentNotFoundException:
-            results = []
-        print(
-            f"[Memory System] Retrieved {len(results)} items from category '{category}' for user '{user_id}'."
-        )
-        return results
-
-
 # --- Replace with your Capella credentials ---
 COUCHBASE_CONN_STR = os.getenv("COUCHBASE_CONN_STR")
 COUCHBASE_USERNAME = os.getenv("COUCHBASE_USERNAME")
@@ -98,9 +52,21 @@ persistent_data = CouchbaseMemory(
     scope_name="agent",  # match your setup
     collection_name="memory",  # match your setup
 )
+async_memory = AsyncCouchbaseMemory(persistent_data)
+email_index = EmailIndex(persistent_data, category="emails", embedder=HashingEmbedder())
+archive_index = EmailIndex(persistent_data, category="emails_archive", embedder=HashingEmbedder())
+# Old emails move to the archive in the background so the hot mailbox stays small
+email_tiering = EmailTiering(
+    persistent_data,
+    category="emails",
+    hot_items=int(os.getenv("TIERING_HOT_ITEMS", "500")),
+    max_age_days=int(os.environ["TIERING_MAX_AGE_DAYS"]) if os.getenv("TIERING_MAX_AGE_DAYS") else None,
+    indexes=[email_index, archive_index],
+)
 
 
-def store_email(
+@instrument_tool
+async def store_email(
     from_sender: str,
     to_recipient: str,
     date: str,
@@ -121,41 +87,147 @@ def store_email(
     Returns:
         A dictionary with the status of the operation.
     """
-    user_id = getattr(store_email, "user_id", USER_ID)
-    email_data = (
-        f"From: {from_sender}\n"
-        f"To: {to_recipient}\n"
-        f"Date: {date}\n"
-        f"CC: {cc or ''}\n"
-        f"Subject: {subject}\n"
-        f"Body: {body}"
-    )
-    persistent_data.add(user_id=user_id, category="emails", data=email_data)
+    user_id = get_user_id(USER_ID)
+    email_data = make_email(from_sender, to_recipient, date, subject, body, cc)
+    await async_memory.add(user_id=user_id, category="emails", data=email_data)
+    await async_memory.run(email_index.add, user_id, email_data)
+    email_tiering.schedule(user_id)
     return {"status": "success", "message": "Email stored successfully."}
 
 
-def retrieve_emails(query: Optional[str] = None) -> dict:
-    """Retrieves emails from memory that match a query.
+@instrument_tool
+async def retrieve_emails(
+    query: Optional[str] = None,
+    from_sender: Optional[str] = None,
+    to_recipient: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    thread: Optional[str] = None,
+    limit: int = 10,
+    cursor: Optional[str] = None,
+    semantic: bool = False,
+    archive: bool = False,
+) -> dict:
+    """Retrieves emails from memory that match a query and/or field filters.
 
     Args:
-        query: The search term to filter emails. If empty, all emails are returned.
+        query: Search terms to filter emails. Every term must appear in an email unless
+            the terms are separated by OR (e.g. 'price OR valuation'). Results are most
+            relevant first.
+        from_sender: Only emails whose sender name or address contains these words.
+        to_recipient: Only emails sent or copied to a name or address containing these words.
+        date_from: Only emails on or after this date (YYYY-MM-DD).
+        date_to: Only emails on or before this date (YYYY-MM-DD).
+        thread: Only emails in the thread with this subject (Re:/Fwd: prefixes are ignored).
+        limit: The maximum number of emails to return in this page.
+        cursor: The `next_cursor` of a previous call, to get the following page.
+        semantic: Match on meaning instead of keywords, for questions like
+            'what did the vendor say about price?'.
+        archive: Search the archive of older emails instead of the recent ones.
+
+    If neither a query nor a filter is given, all emails are listed page by page.
+    Bodies that do not fit in the response are shortened and flagged with 'truncated'.
 
     Returns:
-        A dictionary containing the list of matching emails.
+        A dictionary containing a page of matching emails and, if there are more,
+        a `next_cursor`.
     """
-    user_id = getattr(retrieve_emails, "user_id", USER_ID)
-    all_emails = persistent_data.search_by_category(user_id=user_id, category="emails")
+    user_id = get_user_id(USER_ID)
+    try:
+        offset = decode_cursor(cursor)
+    except ValueError:
+        return {"status": "error", "message": "Invalid cursor. Repeat the search without one."}
+    filters = {
+        "sender": from_sender,
+        "recipient": to_recipient,
+        "date_from": date_from,
+        "date_to": date_to,
+        "thread": thread,
+    }
+
+    index, category = (archive_index, "emails_archive") if archive else (email_index, "emails")
+    if query or any(filters.values()):
+        match_all = not query or " OR " not in f" {query} "
+        terms = query if match_all else query.replace(" OR ", " ")
+        # One extra match tells whether another page exists
+        matching_emails = await async_memory.run(
+            index.find,
+            user_id, terms, limit=limit + 1, match_all=match_all, semantic=semantic,
+            offset=offset, **filters
+        )
+        get_instrumentation().log(
+            "INFO", "tool.emails_found", query=query, filters=filters, archive=archive, count=len(matching_emails)
+        )
+    else:
+        # Listing the mailbox only fetches the requested page from storage
+        stored, _ = await async_memory.search_page(user_id, category, offset, limit + 1)
+        matching_emails = [as_email(value) for value in stored]
 
-    if not query:
-        return {"status": "success", "emails": all_emails, "count": len(all_emails)}
+    emails = fit_to_budget(matching_emails[:limit])
+    more = len(matching_emails) > len(emails)
+    return {
+        "status": "success",
+        "emails": emails,
+        "count": len(emails),
+        "next_cursor": encode_cursor(offset + len(emails)) if more else None,
+    }
 
-    matching_emails = [email for email in all_emails if query.lower() in email.lower()]
 
-    print(
-        f"INFO: Found {len(matching_emails)} emails matching '{query}'"
-    )
+@instrument_tool
+async def retrieve_email_threads(limit: int = 20, cursor: Optional[str] = None) -> dict:
+    """Lists digests of the older email threads that were moved to the archive.
+
+    Args:
+        limit: The maximum number of threads to return in this page.
+        cursor: The `next_cursor` of a previous call, to get the following page.
 
-    return {"status": "success", "emails": matching_emails, "count": len(matching_emails)}
+    Returns:
+        A dictionary containing thread digests (subject, participants, date range,
+        number of archived emails and the latest message), most recent first.
+    """
+    user_id = get_user_id(USER_ID)
+    try:
+        offset = decode_cursor(cursor)
+    except ValueError:
+        return {"status": "error", "message": "Invalid cursor. List the threads again without one."}
+    digests = await async_memory.run(email_tiering.digests, user_id)
+    page = [
+        {key: value for key, value in digest.items() if key != "generation"}
+        for digest in digests[offset : offset + limit]
+    ]
+    more = offset + len(page) < len(digests)
+    return {
+        "status": "success",
+        "threads": page,
+        "count": len(page),
+        "next_cursor": encode_cursor(offset + len(page)) if more else None,
+    }
+
+
+async def compact_emails():
+    """Background job archiving cold emails of users who stored new ones."""
+    await email_tiering.run(async_memory, interval=float(os.getenv("TIERING_INTERVAL", "60")))
+
+
+# With MEMORY_CHANGE_LOG=on, emails stored by other processes (e.g. ingest.py)
+# reach this process's cache and search indexes within seconds
+change_feed = ChangeFeed(
+    persistent_data,
+    [
+        CacheInvalidator(persistent_data),
+        CallbackConsumer("email-index", email_index.apply_change, categories=["emails"]),
+        CallbackConsumer("archive-index", archive_index.apply_change, categories=["emails_archive"]),
+    ],
+) if persistent_data.backend.change_log else None
+
+
+async def follow_changes():
+    """Background job applying the change log to this process's caches and indexes."""
+    if change_feed is not None:
+        await change_feed.run(async_memory, interval=float(os.getenv("CHANGE_FEED_INTERVAL", "1")))
+
+
+background_jobs = [compact_emails, follow_changes]
 
 
 rag_agent = Agent(
@@ -167,14 +239,15 @@ You are a friendly and efficient RAG agent for managing emails.
 
 Email Management Workflow:
 1. To save an email, use the `store_email` tool. You must provide `from_sender`, `to_recipient`, `date`, `subject`, and `body`. The `cc` field is optional.
-2. To find emails, use the `retrieve_emails` tool. You can provide an optional `query` to search through the content of all stored emails. If you omit the query, you will get all emails.
-3. Use the retrieved emails to answer questions or compose new messages.
+2. To find emails, use the `retrieve_emails` tool. You can provide an optional `query` of keywords to search through the content of all stored emails; results are ranked by relevance and every keyword must match unless you separate them with OR. You can also narrow the search with `from_sender`, `to_recipient`, `date_from`/`date_to` (YYYY-MM-DD) and `thread` (a subject line), with or without a query. If you omit the query and filters, all emails are listed. Results come a page at a time: when the response has a `next_cursor`, pass it as `cursor` (with the same other arguments) to get more. Bodies marked `truncated` were shortened to fit; repeat the search with `limit` 1 to read one in full. For questions phrased in natural language, or when a keyword search finds nothing, set `semantic` to true to match emails by meaning.
+3. Only recent emails are searched by default; older ones are moved to an archive. Use `retrieve_email_threads` to see digests of archived threads, and set `archive` to true in `retrieve_emails` to search the archived emails themselves.
+4. Use the retrieved emails to answer questions or compose new messages.
 """,
-    tools=[store_email, retrieve_emails],
+    tools=[store_email, retrieve_emails, retrieve_email_threads],
 )
 
 
-session_service = InMemorySessionService()
+session_service = session_service_from_env()
 APP_NAME = "email_rag_app"
 SESSION_ID = "session_001"
 
@@ -188,39 +261,49 @@ runner = Runner(
 async def call_agent_async(query: str, user_id: str, session_id: str):
     print(f"\n>>> User ({user_id}): {query}")
     content = types.Content(role="user", parts=[types.Part(text=query)])
-    # Set user_id for tool functions
-    setattr(store_email, "user_id", user_id)
-    setattr(retrieve_emails, "user_id", user_id)
-
-    async for event in runner.run_async(
-        user_id=user_id, session_id=session_id, new_message=content
-    ):
-        if event.is_final_response() and event.content and event.content.parts:
-            final_response = event.content.parts[0].text
-            print(f"<<< Assistant: {final_response}")
-            return final_response
+    # Bind the user to this request so the tools read the right memory, and
+    # write the emails stored during the turn together before replying
+    with request_context(user_id, session_id):
+        async with async_memory.turn():
+            async for event in runner.run_async(
+                user_id=user_id, session_id=session_id, new_message=content
+            ):
+                if event.is_final_response() and event.content and event.content.parts:
+                    final_response = event.content.parts[0].text
+                    print(f"<<< Assistant: {final_response}")
+                    return final_response
 
     return "No response received."
 
 
 async def interactive_chat():
+    compaction = asyncio.create_task(compact_emails())
+    changes = asyncio.create_task(follow_changes())
     print("--- Starting Interactive Email RAG Agent ---")
     print("You can store and retrieve emails.")
     print("Example storage: store email from 'John <j.doe@example.com>' to 'Jane <jane@example.com>' with date '2023-01-01', subject 'Meeting' and body 'Hi, team.'")
     print("Example retrieval: what are the emails about 'Meeting'?")
     print("Type 'quit' to end the session.")
     while True:
-        user_query = input("\n> ")
+        # Read in a worker thread so compaction and the change feed keep running
+        user_query = await asyncio.to_thread(input, "\n> ")
         if user_query.lower() in ["quit", "exit"]:
             print("Ending session. Goodbye!")
+            compaction.cancel()
+            changes.cancel()
             break
         await call_agent_async(query=user_query, user_id=USER_ID, session_id=SESSION_ID)
 
 
 async def create_session():
-    await session_service.create_session(
+    # Sessions are durable, so the conversation may already exist from an earlier run
+    session = await session_service.get_session(
         app_name=APP_NAME, user_id=USER_ID, session_id=SESSION_ID
     )
+    if session is None:
+        await session_service.create_session(
+            app_name=APP_NAME, user_id=USER_ID, session_id=SESSION_ID
+        )
 
 
 if __name__ == "__main__":
@@ -2,15 +2,16 @@ import os
 import asyncio
 from dotenv import load_dotenv
 from google.adk.agents import Agent
-from google.adk.sessions import InMemorySessionService
 from google.adk.runners import Runner
 from google.genai import types
 
 # Load environment variables from .env file
 load_dotenv()
 
+from context import request_context
 from real_estate_agent import real_estate_advisor, call_agent_async, create_session
-from tools import save_user_preference, retrieve_user_preferences, find_properties
+from sessions import session_service_from_env
+from tools import async_memory, follow_changes, preference_context, save_user_preference, retrieve_user_preferences, find_properties
 
 USER_ID = "RealEstateClient"
 
@@ -22,10 +23,10 @@ Agent(
             tailored to the Portuguese property market. If no useful research can be found, reply with 'NO USEFUL RESEARCH FOUND'
             otherwise provide valuable insights and property recommendations.
             """,
-    instruction="""
+    instruction=preference_context.instruction("""
 You are an expert Real Estate Advisor specializing in the Portuguese property market. Your role is to:
 1. Understand client needs and preferences through email communication
-2. Use `retrieve_user_preferences` with category 'property_preferences' to recall client history
+2. The client's saved preferences are listed at the end of these instructions; only call `retrieve_user_preferences` when the list says more are stored than shown (if the result has a `next_cursor`, pass it as `cursor` to read more)
 3. Call `find_properties` with location and budget parameters to suggest suitable properties
 4. Provide market analysis and negotiation support based on current market conditions
 5. If no preferences exist, guide the client to save their preferences using `save_user_preference`
@@ -36,11 +37,11 @@ Key Expertise:
 - Negotiation strategies
 - Market research and analytics
 - Client communication and relationship management
-""",
+"""),
     tools=[save_user_preference, retrieve_user_preferences, find_properties])
 
 
-session_service = InMemorySessionService()
+session_service = session_service_from_env()
 APP_NAME = "real_estate_advisor_app"
 SESSION_ID = "session_001"
 
@@ -54,35 +55,49 @@ runner = Runner(
 async def call_agent_async(query: str, user_id: str, session_id: str):
     print(f"\n>>> User ({user_id}): {query}")
     content = types.Content(role="user", parts=[types.Part(text=query)])
-    setattr(save_user_preference, "user_id", user_id)
-    setattr(retrieve_user_preferences, "user_id", user_id)
 
-    async for event in runner.run_async(
-        user_id=user_id, session_id=session_id, new_message=content
-    ):
-        if event.is_final_response() and event.content and event.content.parts:
-            final_response = event.content.parts[0].text
-            print(f"<<< Assistant: {final_response}")
-            return final_response
+    # Preferences saved during the turn are written together before replying
+    with request_context(user_id, session_id):
+        async with async_memory.turn():
+            async for event in runner.run_async(
+                user_id=user_id, session_id=session_id, new_message=content
+            ):
+                if event.is_final_response() and event.content and event.content.parts:
+                    final_response = event.content.parts[0].text
+                    print(f"<<< Assistant: {final_response}")
+                    return final_response
 
     return "No response received."
 
 
+background_jobs = [follow_changes]
+
+
 async def interactive_chat():
+    changes = asyncio.create_task(follow_changes())
     print("--- Starting Interactive Property Advisor ---")
     print("Type 'quit' to end the session.")
     while True:
-        user_query = input("\n> ")
+        # Read in a worker thread so the change feed keeps running
+        user_query = await asyncio.to_thread(input, "\n> ")
         if user_query.lower() in ["quit", "exit"]:
             print("Ending session. Goodbye!")
+            changes.cancel()
             break
         await call_agent_async(query=user_query, user_id=USER_ID, session_id=SESSION_ID)
 
 
 async def create_session():
-    await session_service.create_session(
+    # Sessions are durable, so the conversation may already exist from an earlier run
+    session = await session_service.get_session(
         app_name=APP_NAME, user_id=USER_ID, session_id=SESSION_ID
     )
+    if session is None:
+        await session_service.create_session(
+            app_name=APP_NAME, user_id=USER_ID, session_id=SESSION_ID
+        )
+    # Load the client's preferences before the first message rather than during it
+    await preference_context.prefetch(USER_ID)
 
 
 
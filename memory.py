@@ -1,21 +1,249 @@
-from couchbase.cluster import Cluster
-from couchbase.options import ClusterOptions
-from couchbase.auth import PasswordAuthenticator
-from couchbase.exceptions import DocumentNotFoundException
+import asyncio
+import contextvars
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import asynccontextmanager, contextmanager
+from typing import Union
+
+from compression import Codec, codec_from_env
+from instrumentation import get_instrumentation
+from storage import MemoryBackend, create_backend
+
+
+def _payload_bytes(value) -> int:
+    """Serialised size of stored data, as counted for the bytes read/written metrics."""
+    return len(json.dumps(value, default=str))
+
+
+class MemoryCache:
+    """
+    Bounded in-process cache of category contents keyed by (user, category).
+
+    Entries are evicted least-recently-used once ``max_entries`` is reached
+    and expire ``ttl`` seconds after they were fetched from the backend.
+
+    Writes through this process update or drop their entry. Every write also
+    takes a new generation, and a category read from the backend is only
+    cached if no write reached it since the read began. Otherwise a read
+    racing an ``append`` could cache a copy without the new value. Writes
+    made by other processes are not seen until the entry expires, unless the
+    change log is on and a ``CacheInvalidator`` follows it.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 300.0):
+        """
+        Args:
+            max_entries (int): Maximum number of cached categories
+            ttl (float): Seconds a fetched category stays valid
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # Generation of the latest write to each recently written category.
+        # Older ones are forgotten; ``_forgotten`` is the newest of those.
+        self._written = OrderedDict()
+        self._forgotten = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def generation(self) -> int:
+        """Return the current write generation; take it before reading a category to ``put``."""
+        with self._lock:
+            return self._generation
+
+    def _written_to(self, key: tuple) -> None:
+        """Give a write to a category the next generation. Call with the lock held."""
+        self._generation += 1
+        self._written[key] = self._generation
+        self._written.move_to_end(key)
+        while len(self._written) > max(self.max_entries, 256):
+            _, self._forgotten = self._written.popitem(last=False)
+
+    def get(self, key: tuple):
+        """
+        Look up a cached category.
+
+        Args:
+            key (tuple): (user_id, category)
+
+        Returns:
+            list: A copy of the cached items, or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                self._entries.pop(key, None)
+                self.misses += 1
+                get_instrumentation().count("memory_cache_misses_total")
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            get_instrumentation().count("memory_cache_hits_total")
+            return list(entry[1])
+
+    def put(self, key: tuple, items: list, generation: int = None) -> None:
+        """
+        Cache the full contents of a category as read from the backend.
+
+        Args:
+            key (tuple): (user_id, category)
+            items (list): Items stored under the category
+            generation (int): ``generation()`` taken before the read; the items
+                are dropped if the category was written since
+        """
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            if generation is not None and self._written.get(key, self._forgotten) > generation:
+                get_instrumentation().count("memory_cache_stale_puts_total")
+                return
+            self._entries[key] = (time.monotonic(), list(items))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def append(self, key: tuple, item) -> None:
+        """
+        Write a newly stored item through to a cached category, if present.
+
+        Args:
+            key (tuple): (user_id, category)
+            item: The stored item
+        """
+        with self._lock:
+            self._written_to(key)
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[1].append(item)
+
+    def invalidate(self, key: tuple) -> None:
+        """
+        Drop a cached category.
+
+        Args:
+            key (tuple): (user_id, category)
+        """
+        with self._lock:
+            self._written_to(key)
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """Drop every cached category."""
+        with self._lock:
+            self._generation += 1
+            self._written.clear()
+            self._forgotten = self._generation
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and the current size."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+class WriteBuffer:
+    """
+    Memory writes collected during one agent turn, grouped per (user, category).
+
+    Writes are flushed as one batched append per category document instead
+    of one round trip per value.
+    """
+
+    def __init__(self, max_items: int = 64, max_age: float = 5.0):
+        """
+        Args:
+            max_items (int): Buffered values that trigger an early flush
+            max_age (float): Seconds after the first buffered value that trigger
+                an early flush, checked on each write
+        """
+        self.max_items = max_items
+        self.max_age = max_age
+        self._pending = {}
+        self._size = 0
+        self._started = None
+        self._lock = threading.Lock()
+
+    def add(self, key: tuple, data) -> bool:
+        """
+        Buffer a value for a category.
+
+        Args:
+            key (tuple): (user_id, category) the value belongs to
+            data (str | dict): Value to store
+
+        Returns:
+            bool: True once the buffer has reached its size or age threshold
+        """
+        with self._lock:
+            if not self._size:
+                self._started = time.monotonic()
+            self._pending.setdefault(key, []).append(data)
+            self._size += 1
+            return self._size >= self.max_items or time.monotonic() - self._started >= self.max_age
+
+    def take(self, key: tuple = None) -> dict:
+        """
+        Remove and return buffered values.
+
+        Args:
+            key (tuple): Only take this (user_id, category), None for everything
+
+        Returns:
+            dict: Buffered values in write order, keyed by (user_id, category)
+        """
+        with self._lock:
+            if key is None:
+                taken, self._pending = self._pending, {}
+            else:
+                taken = {key: self._pending.pop(key)} if key in self._pending else {}
+            self._size -= sum(len(values) for values in taken.values())
+            return taken
+
+    def restore(self, taken: dict) -> None:
+        """
+        Put values that failed to flush back, ahead of any buffered since.
+
+        Args:
+            taken (dict): Values returned by ``take`` that were not written
+        """
+        with self._lock:
+            for key, values in taken.items():
+                self._pending[key] = values + self._pending.get(key, [])
+                self._size += len(values)
 
 
 class CouchbaseMemory:
     def __init__(
         self,
-        conn_str: str,
-        username: str,
-        password: str,
-        bucket_name: str,
+        conn_str: str = None,
+        username: str = None,
+        password: str = None,
+        bucket_name: str = None,
         scope_name: str = "real_estate",
         collection_name: str = "memory",
+        chunk_size: int = 500,
+        max_cas_retries: int = 10,
+        backend: MemoryBackend = None,
+        backend_type: str = None,
+        cache_size: int = 1024,
+        cache_ttl: float = 300.0,
+        codec: Codec = None,
+        change_log: bool = None,
     ):
         """
         Initialize Couchbase memory system.
+
+        The storage engine is chosen by ``backend_type`` (or the
+        ``MEMORY_BACKEND`` environment variable): "couchbase" (default) or
+        "sqlite" for an embedded local store at ``MEMORY_SQLITE_PATH``.
         
         Args:
             conn_str (str): Connection string to Couchbase
@@ -24,49 +252,181 @@ class CouchbaseMemory:
             bucket_name (str): Name of the bucket to use
             scope_name (str): Scope name for the memory system
             collection_name (str): Collection name for the memory system
+            chunk_size (int): Number of items a category head holds before they are
+                sealed into a chunk document
+            max_cas_retries (int): Attempts made by the CAS fallback before giving up
+            backend (MemoryBackend): Ready-made backend, overrides all other settings
+            backend_type (str): Name of the backend to build
+            cache_size (int): Categories kept in the read cache, 0 disables it
+            cache_ttl (float): Seconds a cached category stays valid; also how long
+                writes by other processes can go unseen without the change log
+            codec (Codec): Compression of stored values, configured by
+                ``MEMORY_COMPRESSION`` and ``MEMORY_COMPRESSION_DICT`` by default
+            change_log (bool): Record every append and trim in the backend's change
+                log, on when ``MEMORY_CHANGE_LOG`` is "on" by default
         """
-        self.cluster = Cluster(
-            conn_str, ClusterOptions(PasswordAuthenticator(username, password))
-        )
-        self.bucket = self.cluster.bucket(bucket_name)
-        self.scope = self.bucket.scope(scope_name)
-        self.collection = self.scope.collection(collection_name)
-        print("[Memory System] Connected to Couchbase Capella")
+        if backend is None:
+            backend_type = backend_type or os.getenv("MEMORY_BACKEND", "couchbase")
+            backend = create_backend(
+                backend_type,
+                conn_str=conn_str,
+                username=username,
+                password=password,
+                bucket_name=bucket_name,
+                scope_name=scope_name,
+                collection_name=collection_name,
+                sqlite_path=os.getenv("MEMORY_SQLITE_PATH", "memory.db"),
+                codec=codec or codec_from_env(),
+                change_log=(
+                    os.getenv("MEMORY_CHANGE_LOG", "off").lower() in ("on", "1", "true")
+                    if change_log is None
+                    else change_log
+                ),
+                chunk_size=chunk_size,
+                max_cas_retries=max_cas_retries,
+            )
+        self.backend = backend
+        self.cache = MemoryCache(cache_size, cache_ttl)
+        self._buffer = contextvars.ContextVar(f"memory_write_buffer_{id(self)}", default=None)
+
+    def begin_turn(self, max_items: int = 64, max_age: float = 5.0):
+        """
+        Start buffering this context's writes until ``end_turn``.
+
+        Args:
+            max_items (int): Buffered values that trigger an early flush
+            max_age (float): Seconds after the first buffered value that trigger an early flush
+
+        Returns:
+            Token to pass to ``end_turn``
+        """
+        return self._buffer.set(WriteBuffer(max_items, max_age))
+
+    def end_turn(self, token) -> WriteBuffer:
+        """
+        Stop buffering writes. The caller must ``flush`` the returned buffer.
+
+        Args:
+            token: Token returned by ``begin_turn``
+
+        Returns:
+            WriteBuffer: The buffer of the finished turn
+        """
+        buffer = self._buffer.get()
+        self._buffer.reset(token)
+        return buffer
+
+    @contextmanager
+    def turn(self, max_items: int = 64, max_age: float = 5.0):
+        """
+        Buffer the writes made inside the block and flush them when it exits.
+
+        Reads inside the block flush the category they read first, so they
+        see the buffered writes.
+
+        Args:
+            max_items (int): Buffered values that trigger an early flush
+            max_age (float): Seconds after the first buffered value that trigger an early flush
+        """
+        token = self.begin_turn(max_items, max_age)
+        try:
+            yield
+        finally:
+            self.flush(self.end_turn(token))
+
+    def flush(self, buffer: WriteBuffer, key: tuple = None) -> int:
+        """
+        Write buffered values with one batched append per category.
+
+        If an append fails, its category and those not written yet go back
+        into the buffer before the error is raised, so flushing it again
+        retries them; values the failed append did store are then skipped as
+        duplicates.
+
+        Args:
+            buffer (WriteBuffer): Buffer to drain
+            key (tuple): Only flush this (user_id, category), None for everything
+
+        Returns:
+            int: Number of values that were not already stored
+        """
+        taken = buffer.take(key)
+        saved = 0
+        try:
+            for user_id, category in list(taken):
+                saved += self.add_many(user_id, category, taken[(user_id, category)])
+                del taken[(user_id, category)]
+        except BaseException:
+            buffer.restore(taken)
+            raise
+        return saved
 
-    def _doc_id(self, user_id: str) -> str:
-        """Generate document ID for a user."""
-        return f"user::{user_id}"
+    def _flush_pending(self, user_id: str, category: str) -> None:
+        """Write the current turn's buffered values for a category before it is read."""
+        buffer = self._buffer.get()
+        if buffer is not None:
+            self.flush(buffer, (user_id, category))
 
-    def add(self, user_id: str, category: str, data: str) -> bool:
+    def add(self, user_id: str, category: str, data: Union[str, dict]) -> bool:
         """
         Add data to a user's memory in a specific category.
+
+        Inside a ``turn`` the value is buffered and written with the rest of
+        the turn's writes.
         
         Args:
             user_id (str): User ID to associate the data with
             category (str): Category to store the data in
-            data (str): Data to store
+            data (str | dict): Data to store
             
         Returns:
             bool: True if successful
         """
-        doc_id = self._doc_id(user_id)
-        try:
-            doc = self.collection.get(doc_id).content_as[dict]
-        except DocumentNotFoundException:
-            doc = {}
-
-        doc.setdefault(category, [])
-        if data not in doc[category]:
-            doc[category].append(data)
-            self.collection.upsert(doc_id, doc)
-            print(
-                f"[Memory System] Saved data for user '{user_id}' in category '{category}': '{data}'"
-            )
+        buffer = self._buffer.get()
+        if buffer is not None:
+            if buffer.add((user_id, category), data):
+                self.flush(buffer)
+            return True
+        metrics = get_instrumentation()
+        with metrics.span("memory.append", category=category):
+            saved = self.backend.append(user_id, category, data)
+        if saved:
+            self.cache.append((user_id, category), data)
+            if metrics.enabled:
+                metrics.count("memory_bytes_written_total", _payload_bytes(data))
+            metrics.log("DEBUG", "memory.saved", user_id=user_id, category=category)
         return True
 
+    def add_many(self, user_id: str, category: str, values: list) -> int:
+        """
+        Add several values to a user's memory in one batched write.
+
+        Args:
+            user_id (str): User ID to associate the data with
+            category (str): Category to store the data in
+            values (list): Values to store, in order
+
+        Returns:
+            int: Number of values that were not already stored
+        """
+        metrics = get_instrumentation()
+        with metrics.span("memory.append_many", category=category, values=len(values)):
+            saved = self.backend.append_many(user_id, category, values)
+        if saved:
+            self.cache.invalidate((user_id, category))
+        if metrics.enabled:
+            metrics.count("memory_bytes_written_total", _payload_bytes(values))
+        metrics.log(
+            "DEBUG", "memory.saved_many", user_id=user_id, category=category, saved=saved, values=len(values)
+        )
+        return saved
+
     def search_by_category(self, user_id: str, category: str) -> list:
         """
         Search for data in a specific category for a user.
+
+        Repeated reads are served from the in-process cache until the entry
+        expires or is evicted.
         
         Args:
             user_id (str): User ID to search for
@@ -75,13 +435,289 @@ class CouchbaseMemory:
         Returns:
             list: List of items found in the category
         """
-        doc_id = self._doc_id(user_id)
-        try:
-            doc = self.collection.get(doc_id).content_as[dict]
-            results = doc.get(category, [])
-        except DocumentNotFoundException:
-            results = []
-        print(
-            f"[Memory System] Retrieved {len(results)} items from category '{category}' for user '{user_id}'."
-        )
+        self._flush_pending(user_id, category)
+        key = (user_id, category)
+        results = self.cache.get(key)
+        metrics = get_instrumentation()
+        if results is None:
+            generation = self.cache.generation()
+            with metrics.span("memory.read", category=category):
+                results = self.backend.read(user_id, category)
+            self.cache.put(key, results, generation)
+            if metrics.enabled:
+                metrics.count("memory_bytes_read_total", _payload_bytes(results))
+        metrics.log("DEBUG", "memory.retrieved", user_id=user_id, category=category, items=len(results))
         return results
+
+    def search_many(self, keys: list, batch_size: int = 256, concurrency: int = 8) -> dict:
+        """
+        Read several categories, fetching the uncached ones in batched backend reads.
+
+        Args:
+            keys (list): (user_id, category) pairs to read
+            batch_size (int): Categories fetched per backend read
+            concurrency (int): Backend reads in flight at once
+
+        Returns:
+            dict: Items of each category, keyed by (user_id, category)
+        """
+        return dict(self.iter_many(keys, batch_size, concurrency))
+
+    def iter_many(self, keys: list, batch_size: int = 256, concurrency: int = 8, cache: bool = True):
+        """
+        Read many categories of many users, yielding each one as soon as it arrives.
+
+        Repeated pairs are read once and cached categories are yielded first.
+        The rest are split into batches of ``batch_size``, each fetched with
+        one backend ``read_many`` (multi-gets on Couchbase), with at most
+        ``concurrency`` batches in flight; categories are yielded batch by
+        batch in completion order.
+
+        Args:
+            keys (list): (user_id, category) pairs to read
+            batch_size (int): Categories fetched per backend read
+            concurrency (int): Backend reads in flight at once
+            cache (bool): Keep the fetched categories in the read cache; bulk
+                exports pass False so they do not evict the hot entries
+
+        Yields:
+            tuple: ((user_id, category), items)
+        """
+        cached, missing = self._split_cached(keys)
+        yield from cached.items()
+        batches = [missing[start : start + batch_size] for start in range(0, len(missing), batch_size)]
+        if len(batches) <= 1 or concurrency <= 1:
+            for batch in batches:
+                yield from self._read_batch(batch, cache).items()
+            return
+        with ThreadPoolExecutor(min(concurrency, len(batches)), thread_name_prefix="memory-read") as pool:
+            queued = iter(batches)
+
+            def submit(batch):
+                return pool.submit(contextvars.copy_context().run, self._read_batch, batch, cache)
+
+            in_flight = {submit(batch) for batch in itertools.islice(queued, concurrency)}
+            while in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = next(queued, None)
+                    if batch is not None:
+                        in_flight.add(submit(batch))
+                    yield from future.result().items()
+
+    def _split_cached(self, keys: list) -> tuple:
+        """Dedupe keys, flush their pending writes and separate the cached categories."""
+        cached, missing = {}, []
+        for key in dict.fromkeys(keys):
+            self._flush_pending(*key)
+            items = self.cache.get(key)
+            if items is None:
+                missing.append(key)
+            else:
+                cached[key] = items
+        return cached, missing
+
+    def _read_batch(self, keys: list, cache: bool = True) -> dict:
+        """Fetch one batch of categories with a single backend read."""
+        metrics = get_instrumentation()
+        generation = self.cache.generation()
+        with metrics.span("memory.read_many", keys=len(keys)):
+            fetched = self.backend.read_many(keys)
+        if cache:
+            for key, items in fetched.items():
+                self.cache.put(key, items, generation)
+        if metrics.enabled:
+            metrics.count("memory_bytes_read_total", _payload_bytes(list(fetched.values())))
+        return fetched
+
+    def search_page(self, user_id: str, category: str, offset: int = 0, limit: int = None) -> tuple:
+        """
+        Read one page of a category without loading the rest of it.
+
+        A cached category is sliced in place; otherwise only the page is
+        fetched from the backend and the cache is left untouched.
+
+        Args:
+            user_id (str): User ID to search for
+            category (str): Category to search in
+            offset (int): Number of leading items to skip
+            limit (int): Maximum number of items to return, None for all
+
+        Returns:
+            tuple: (items in the page oldest first, total items in the category)
+        """
+        self._flush_pending(user_id, category)
+        cached = self.cache.get((user_id, category))
+        metrics = get_instrumentation()
+        if cached is None:
+            with metrics.span("memory.read_page", category=category, offset=offset, limit=limit):
+                results, total = self.backend.read_page(user_id, category, offset, limit)
+            if metrics.enabled:
+                metrics.count("memory_bytes_read_total", _payload_bytes(results))
+        else:
+            end = None if limit is None else offset + limit
+            results, total = cached[offset:end], len(cached)
+        metrics.log(
+            "DEBUG", "memory.retrieved_page", user_id=user_id, category=category, items=len(results), total=total
+        )
+        return results, total
+
+    def trim(self, user_id: str, category: str, values: list, forget: bool = False) -> int:
+        """
+        Remove values from the front of a category, e.g. once they are archived.
+
+        Args:
+            user_id (str): User ID to trim
+            category (str): Category to trim
+            values (list): The values expected at the front of the category, oldest first
+            forget (bool): Also forget the removed values, so storing one again is not a duplicate
+
+        Returns:
+            int: Number of values removed; values no longer leading the category are kept
+        """
+        self._flush_pending(user_id, category)
+        metrics = get_instrumentation()
+        with metrics.span("memory.trim", category=category, values=len(values)):
+            removed = self.backend.trim(user_id, category, values, forget)
+        if removed:
+            self.cache.invalidate((user_id, category))
+        metrics.log("DEBUG", "memory.trimmed", user_id=user_id, category=category, removed=removed)
+        return removed
+
+    def connect(self) -> None:
+        """Open the backend's connections now instead of on first use."""
+        self.backend.connect()
+
+    def health_check(self) -> dict:
+        """
+        Check that the backend answers.
+
+        Returns:
+            dict: ``status`` ("ok" or "error"), ``latency_ms`` or ``error``
+        """
+        return self.backend.health_check()
+
+    def cache_stats(self) -> dict:
+        """
+        Report read cache effectiveness.
+
+        Returns:
+            dict: Hit and miss counters plus the number of cached categories
+        """
+        return self.cache.stats()
+
+
+class AsyncCouchbaseMemory:
+    """
+    Awaitable facade over CouchbaseMemory for use inside the ADK event loop.
+
+    Blocking storage calls run on a bounded thread pool, so concurrent
+    sessions overlap their I/O instead of stalling the loop one round trip at
+    a time.
+    """
+
+    def __init__(self, memory: CouchbaseMemory, max_workers: int = 32):
+        """
+        Args:
+            memory (CouchbaseMemory): Memory system to wrap
+            max_workers (int): Maximum number of storage calls in flight
+        """
+        self.memory = memory
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="memory")
+
+    async def run(self, function, *args, **kwargs):
+        """
+        Run a blocking callable on the memory thread pool.
+
+        The caller's context variables (such as the request's user) are
+        visible to the callable.
+
+        Args:
+            function (callable): Blocking function, e.g. one that reads memory
+            *args: Positional arguments for the function
+            **kwargs: Keyword arguments for the function
+
+        Returns:
+            The function's result
+        """
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(context.run, function, *args, **kwargs)
+        )
+
+    @asynccontextmanager
+    async def turn(self, max_items: int = 64, max_age: float = 5.0):
+        """
+        Awaitable ``CouchbaseMemory.turn``: the flush runs on the thread pool
+        and completes before the block's result reaches the caller.
+        """
+        token = self.memory.begin_turn(max_items, max_age)
+        try:
+            yield
+        finally:
+            await self.run(self.memory.flush, self.memory.end_turn(token))
+
+    async def add(self, user_id: str, category: str, data: Union[str, dict]) -> bool:
+        """Awaitable ``CouchbaseMemory.add``."""
+        return await self.run(self.memory.add, user_id, category, data)
+
+    async def add_many(self, user_id: str, category: str, values: list) -> int:
+        """Awaitable ``CouchbaseMemory.add_many``."""
+        return await self.run(self.memory.add_many, user_id, category, values)
+
+    async def search_by_category(self, user_id: str, category: str) -> list:
+        """Awaitable ``CouchbaseMemory.search_by_category``."""
+        return await self.run(self.memory.search_by_category, user_id, category)
+
+    async def search_many(self, keys: list, batch_size: int = 256, concurrency: int = 8) -> dict:
+        """Awaitable ``CouchbaseMemory.search_many``."""
+        return {key: items async for key, items in self.iter_many(keys, batch_size, concurrency)}
+
+    async def iter_many(self, keys: list, batch_size: int = 256, concurrency: int = 8, cache: bool = True):
+        """
+        Asynchronous ``CouchbaseMemory.iter_many``: batches run on the memory
+        thread pool, at most ``concurrency`` at a time, and categories are
+        yielded as their batch completes.
+        """
+        cached, missing = await self.run(self.memory._split_cached, keys)
+        for key, items in cached.items():
+            yield key, items
+        queued = iter([missing[start : start + batch_size] for start in range(0, len(missing), batch_size)])
+        in_flight = {
+            asyncio.ensure_future(self.run(self.memory._read_batch, batch, cache))
+            for batch in itertools.islice(queued, max(concurrency, 1))
+        }
+        try:
+            while in_flight:
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    batch = next(queued, None)
+                    if batch is not None:
+                        in_flight.add(asyncio.ensure_future(self.run(self.memory._read_batch, batch, cache)))
+                    for key, items in task.result().items():
+                        yield key, items
+        finally:
+            # A consumer that stops early does not leave batches running
+            for task in in_flight:
+                task.cancel()
+
+    async def search_page(self, user_id: str, category: str, offset: int = 0, limit: int = None) -> tuple:
+        """Awaitable ``CouchbaseMemory.search_page``."""
+        return await self.run(self.memory.search_page, user_id, category, offset, limit)
+
+    async def trim(self, user_id: str, category: str, values: list, forget: bool = False) -> int:
+        """Awaitable ``CouchbaseMemory.trim``."""
+        return await self.run(self.memory.trim, user_id, category, values, forget)
+
+    async def connect(self) -> None:
+        """Awaitable ``CouchbaseMemory.connect``."""
+        await self.run(self.memory.connect)
+
+    async def health_check(self) -> dict:
+        """Awaitable ``CouchbaseMemory.health_check``."""
+        return await self.run(self.memory.health_check)
+
+    def close(self) -> None:
+        """Wait for in-flight calls and stop the thread pool."""
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,62 @@
+"""
+Migrate legacy ``user::{user_id}`` memory documents to the per-category layout.
+
+Usage:
+    python migrate.py --scope real_estate --collection memory
+    python migrate.py --scope agent --user alice --user bob --delete-legacy
+
+Without ``--user`` the legacy document IDs are discovered with a query, which
+needs a primary index on the collection.
+"""
+import argparse
+import os
+
+from dotenv import load_dotenv
+
+from compression import codec_from_env
+from storage import CouchbaseBackend
+
+
+def legacy_user_ids(backend: CouchbaseBackend, collection_name: str) -> list:
+    """
+    List the users that still have a legacy single-document memory.
+
+    Args:
+        backend (CouchbaseBackend): Backend connected to the collection
+        collection_name (str): Name of the collection to scan
+
+    Returns:
+        list: User IDs owning a ``user::{user_id}`` document
+    """
+    statement = (
+        f"SELECT RAW META(m).id FROM `{collection_name}` m "
+        "WHERE META(m).id LIKE 'user::%' AND META(m).id NOT LIKE 'user::%::%'"
+    )
+    return [doc_id[len("user::"):] for doc_id in backend.scope.query(statement).rows()]
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scope", default="real_estate", help="Scope holding the memory collection")
+    parser.add_argument("--collection", default="memory", help="Memory collection name")
+    parser.add_argument("--user", action="append", help="Only migrate these user IDs")
+    parser.add_argument("--delete-legacy", action="store_true", help="Remove legacy documents once migrated")
+    args = parser.parse_args()
+
+    backend = CouchbaseBackend(
+        conn_str=os.getenv("COUCHBASE_CONN_STR"),
+        username=os.getenv("COUCHBASE_USERNAME"),
+        password=os.getenv("COUCHBASE_PASSWORD"),
+        bucket_name=os.getenv("COUCHBASE_BUCKET"),
+        scope_name=args.scope,
+        collection_name=args.collection,
+        codec=codec_from_env(),
+    )
+    user_ids = args.user or legacy_user_ids(backend, args.collection)
+    migrated = sum(backend.migrate_user(user_id, args.delete_legacy) for user_id in user_ids)
+    print(f"Migrated {migrated} categories across {len(user_ids)} users.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Cursor pagination and response budgets for tools that return stored items.
+
+Everything a tool returns is serialised into the model's context, so large
+categories are returned a page at a time behind an opaque cursor, and items
+that would overflow a page's budget are cut to snippets.
+"""
+import base64
+import json
+
+# Roughly 3k tokens at ~4 characters per token.
+RESPONSE_BUDGET = 12000
+SNIPPET_CHARS = 1500
+
+
+def encode_cursor(offset: int) -> str:
+    """
+    Build the cursor that resumes a listing at an offset.
+
+    Args:
+        offset (int): Number of items already returned
+
+    Returns:
+        str: Opaque cursor for the next call
+    """
+    return base64.urlsafe_b64encode(json.dumps({"offset": offset}).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> int:
+    """
+    Read the offset back from a cursor.
+
+    Args:
+        cursor (str): Cursor from a previous page, or None for the first page
+
+    Returns:
+        int: Number of items to skip
+
+    Raises:
+        ValueError: If the cursor was not produced by ``encode_cursor``
+    """
+    if not cursor:
+        return 0
+    try:
+        offset = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))["offset"]
+    except (ValueError, TypeError, KeyError) as e:
+        raise ValueError(f"Invalid cursor '{cursor}'") from e
+    if not isinstance(offset, int) or offset < 0:
+        raise ValueError(f"Invalid cursor '{cursor}'")
+    return offset
+
+
+def snippet(value, max_chars: int = SNIPPET_CHARS):
+    """
+    Shorten a stored item for display.
+
+    Strings are cut to ``max_chars``; email records get their body cut and
+    are flagged with ``"truncated": True``.
+
+    Args:
+        value (str | dict): Item to shorten
+        max_chars (int): Maximum characters of text kept
+
+    Returns:
+        str | dict: The item, shortened if it was too long
+    """
+    if isinstance(value, str):
+        return value if len(value) <= max_chars else value[:max_chars] + "..."
+    body = value.get("body") if isinstance(value, dict) else None
+    if isinstance(body, str) and len(body) > max_chars:
+        return {**value, "body": body[:max_chars] + "...", "truncated": True}
+    return value
+
+
+def fit_to_budget(items: list, budget: int = RESPONSE_BUDGET, max_chars: int = SNIPPET_CHARS) -> list:
+    """
+    Keep the leading items of a page whose serialised size fits a budget.
+
+    Items are kept whole while they fit and shortened with ``snippet`` once
+    they would not. The first item is always kept so a page never comes back
+    empty while more items remain.
+
+    Args:
+        items (list): Items of the page, in order
+        budget (int): Maximum serialised characters for the page
+        max_chars (int): Maximum characters of text kept per shortened item
+
+    Returns:
+        list: Leading items within the budget
+    """
+    page, used = [], 0
+    for item in items:
+        size = len(json.dumps(item, default=str))
+        if used + size > budget:
+            item = snippet(item, max_chars)
+            size = len(json.dumps(item, default=str))
+            if page and used + size > budget:
+                break
+        page.append(item)
+        used += size
+    return page
@@ -0,0 +1,172 @@
+"""
+Preference prefetch: a compact digest of a user's saved preferences in the agent's instruction.
+
+Rather than spending a model turn and a storage read on
+``retrieve_user_preferences`` at the start of every conversation, the agent's
+instruction carries what is already known about the user. The digest is
+built from one batched read of the user's preference categories, cached
+per user and rebuilt after ``save_user_preference`` writes.
+"""
+import threading
+from collections import OrderedDict
+
+from paging import snippet
+
+# Category listing the preference categories a user has saved to.
+CATEGORY_INDEX = "preference_categories"
+DEFAULT_CATEGORIES = ("property_preferences",)
+
+
+class PreferenceContext:
+    """Builds, caches and injects per-user preference digests."""
+
+    def __init__(
+        self,
+        async_memory,
+        categories: tuple = DEFAULT_CATEGORIES,
+        max_items: int = 20,
+        max_chars: int = 2000,
+        cache_size: int = 1024,
+    ):
+        """
+        Args:
+            async_memory (AsyncCouchbaseMemory): Memory the preferences are stored in
+            categories (tuple): Categories always read, in addition to those the user has saved to
+            max_items (int): Most recent preferences shown per category
+            max_chars (int): Size budget of the whole digest
+            cache_size (int): Users whose digest is kept, least recently used are dropped
+        """
+        self.async_memory = async_memory
+        self.categories = tuple(categories)
+        self.max_items = max_items
+        self.max_chars = max_chars
+        self.cache_size = cache_size
+        self._digests = OrderedDict()
+        # Generation of the latest invalidation of each recently invalidated
+        # user. Older ones are forgotten; ``_forgotten`` is the newest of those.
+        self._invalidated = OrderedDict()
+        self._forgotten = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def load(self, user_id: str) -> dict:
+        """
+        Read a user's preference categories.
+
+        The category index and the default categories come back in one
+        batched read; only categories missing from the defaults need a second one.
+
+        Args:
+            user_id (str): User whose preferences are read
+
+        Returns:
+            dict: Preferences keyed by category, oldest first
+        """
+        memory = self.async_memory.memory
+        keys = [(user_id, CATEGORY_INDEX)] + [(user_id, category) for category in self.categories]
+        found = memory.search_many(keys)
+        extra = [
+            (user_id, category)
+            for category in found[(user_id, CATEGORY_INDEX)]
+            if category not in self.categories
+        ]
+        if extra:
+            found.update(memory.search_many(extra))
+        return {category: found[(user_id, category)] for _, category in keys[1:] + extra}
+
+    def format(self, preferences: dict) -> str:
+        """
+        Render preferences as a compact digest within ``max_chars``.
+
+        Args:
+            preferences (dict): Preferences keyed by category
+
+        Returns:
+            str: The digest; categories with more than shown say how many are stored
+        """
+        lines, used = [], 0
+        for category, values in preferences.items():
+            if not values:
+                continue
+            shown = values[-self.max_items:]
+            header = f"{category} ({len(values)} saved{', most recent shown' if len(shown) < len(values) else ''}):"
+            lines.append(header)
+            used += len(header)
+            for value in shown:
+                line = f"- {snippet(value, 200)}"
+                if used + len(line) > self.max_chars:
+                    lines.append("- ... (use retrieve_user_preferences for the rest)")
+                    return "\n".join(lines)
+                lines.append(line)
+                used += len(line)
+        return "\n".join(lines) if lines else "No preferences saved yet."
+
+    def digest(self, user_id: str) -> str:
+        """
+        Return a user's preference digest, building it on first use.
+
+        A digest is only cached if the user's preferences were not
+        invalidated while it was built, since it may predate that write.
+
+        Args:
+            user_id (str): User whose digest is returned
+
+        Returns:
+            str: The digest text
+        """
+        with self._lock:
+            text = self._digests.get(user_id)
+            if text is not None:
+                self._digests.move_to_end(user_id)
+                return text
+            generation = self._generation
+        text = self.format(self.load(user_id))
+        with self._lock:
+            if self._invalidated.get(user_id, self._forgotten) <= generation:
+                self._digests[user_id] = text
+                while len(self._digests) > self.cache_size:
+                    self._digests.popitem(last=False)
+        return text
+
+    async def prefetch(self, user_id: str) -> str:
+        """Build a user's digest on the memory thread pool, e.g. when their session starts."""
+        return await self.async_memory.run(self.digest, user_id)
+
+    def invalidate(self, user_id: str) -> None:
+        """Drop a user's digest so the next model call sees their latest preferences."""
+        with self._lock:
+            self._generation += 1
+            self._invalidated[user_id] = self._generation
+            self._invalidated.move_to_end(user_id)
+            while len(self._invalidated) > max(self.cache_size, 256):
+                _, self._forgotten = self._invalidated.popitem(last=False)
+            self._digests.pop(user_id, None)
+
+    async def saved(self, user_id: str, category: str) -> None:
+        """
+        Record a preference write: index its category and refresh the digest.
+
+        Args:
+            user_id (str): User who saved a preference
+            category (str): Category it was saved to
+        """
+        if category not in self.categories:
+            await self.async_memory.add(user_id, CATEGORY_INDEX, category)
+        self.invalidate(user_id)
+
+    def instruction(self, base: str):
+        """
+        Wrap an agent instruction so every model call sees the user's preference digest.
+
+        Args:
+            base (str): The agent's instruction
+
+        Returns:
+            callable: Instruction provider for ``Agent(instruction=...)``
+        """
+
+        async def provider(context) -> str:
+            digest = await self.prefetch(context.user_id)
+            return f"{base}\nKnown client preferences (already loaded, no need to retrieve them):\n{digest}\n"
+
+        return provider
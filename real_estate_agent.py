@@ -1,13 +1,14 @@
 from google.adk.agents import Agent
-from google.adk.sessions import InMemorySessionService
 from google.adk.runners import Runner
 from google.genai import types
 
+from context import request_context
 from memory import CouchbaseMemory
-from tools import save_user_preference, retrieve_user_preferences, find_properties
+from sessions import session_service_from_env
+from tools import async_memory, preference_context, save_user_preference, retrieve_user_preferences, find_properties
 
 # Initialize session service and runner
-session_service = InMemorySessionService()
+session_service = session_service_from_env()
 
 # Create the Real Estate Advisor agent
 real_estate_advisor = Agent(
@@ -18,10 +19,10 @@ real_estate_advisor = Agent(
             tailored to the Portuguese property market. If no useful research can be found, reply with 'NO USEFUL RESEARCH FOUND'
             otherwise provide valuable insights and property recommendations.
             """,
-    instruction="""
+    instruction=preference_context.instruction("""
 You are an expert Real Estate Advisor specializing in the Portuguese property market. Your role is to:
 1. Understand client needs and preferences through email communication
-2. Use `retrieve_user_preferences` with category 'property_preferences' to recall client history
+2. The client's saved preferences are listed at the end of these instructions; only call `retrieve_user_preferences` when the list says more are stored than shown (if the result has a `next_cursor`, pass it as `cursor` to read more)
 3. Call `find_properties` with location and budget parameters to suggest suitable properties
 4. Provide market analysis and negotiation support based on current market conditions
 5. If no preferences exist, guide the client to save their preferences using `save_user_preference`
@@ -32,7 +33,7 @@ Key Expertise:
 - Negotiation strategies
 - Market research and analytics
 - Client communication and relationship management
-""",
+"""),
     tools=[save_user_preference, retrieve_user_preferences, find_properties],
 )
 
@@ -46,20 +47,25 @@ runner = Runner(
 async def call_agent_async(query: str, user_id: str, session_id: str):
     print(f"\n>>> User ({user_id}): {query}")
     content = types.Content(role="user", parts=[types.Part(text=query)])
-    setattr(save_user_preference, "user_id", user_id)
-    setattr(retrieve_user_preferences, "user_id", user_id)
 
-    async for event in runner.run_async(
-        content=content,
-        session_id=session_id,
-        user_id=user_id,
-    ):
-        if event.type == "message":
-            print(f"\n<<< Agent: {event.content.parts[0].text}")
-        elif event.type == "error":
-            print(f"\n!!! Error: {event.content.parts[0].text}")
+    with request_context(user_id, session_id):
+        async with async_memory.turn():
+            async for event in runner.run_async(
+                content=content,
+                session_id=session_id,
+                user_id=user_id,
+            ):
+                if event.type == "message":
+                    print(f"\n<<< Agent: {event.content.parts[0].text}")
+                elif event.type == "error":
+                    print(f"\n!!! Error: {event.content.parts[0].text}")
 
 async def create_session():
-    await session_service.create_session(
+    # Sessions are durable, so the conversation may already exist from an earlier run
+    session = await session_service.get_session(
         app_name="real_estate_advisor_app", user_id=USER_ID, session_id=SESSION_ID
     )
+    if session is None:
+        await session_service.create_session(
+            app_name="real_estate_advisor_app", user_id=USER_ID, session_id=SESSION_ID
+        )
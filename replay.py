@@ -0,0 +1,312 @@
+"""
+Replay scripted conversations through an agent without calling a live model.
+
+Usage:
+    python replay.py replays/email.json
+    python replay.py replays/real_estate.json --output replay-results.json
+    python replay.py replays/email.json --backend couchbase
+
+The agent runs in the normal ADK Runner with its real tools and memory; only
+the model is replaced by ``ScriptedModel``, which answers each turn with the
+tool calls and reply recorded in the script. Every turn reports its wall
+time, the time spent in each tool call and the storage operations it caused,
+so the cost of the memory layer can be tracked separately from the model.
+
+Script format::
+
+    {
+      "agent": "email",
+      "user_id": "replay-user",
+      "turns": [
+        {
+          "user": "Save these emails",
+          "model": [
+            {"ingest": "../sample-data.md"},
+            {"reply": "Saved."}
+          ]
+        },
+        {
+          "user": "What did the buyer offer?",
+          "model": [
+            {"calls": [{"name": "retrieve_emails", "args": {"query": "offer"}}]},
+            {"reply": "They offered 450k."}
+          ]
+        }
+      ]
+    }
+
+A ``calls`` step makes the model request those tool calls (in parallel when
+there are several); a ``reply`` step ends the turn with that text. An
+``ingest`` step expands to one ``store_email`` call per email in a mailbox
+file (relative to the script), read with the ``ingest`` module's readers.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+from dotenv import load_dotenv
+from google.adk.models import BaseLlm, LlmResponse
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+from pydantic import PrivateAttr
+
+from context import request_context
+
+STORAGE_OPERATIONS = ("append", "append_many", "read", "read_many", "read_page", "trim")
+
+
+class ScriptedModel(BaseLlm):
+    """Stand-in model that replays the responses queued for the current turn."""
+
+    model: str = "scripted"
+    _steps: list = PrivateAttr(default_factory=list)
+    calls: int = 0
+
+    def queue(self, steps: list) -> None:
+        """Set the responses for the next turn, in order."""
+        self._steps = list(steps)
+
+    async def generate_content_async(self, llm_request, stream: bool = False):
+        self.calls += 1
+        step = self._steps.pop(0) if self._steps else {"reply": ""}
+        if "calls" in step:
+            parts = [
+                types.Part(function_call=types.FunctionCall(name=call["name"], args=call.get("args", {})))
+                for call in step["calls"]
+            ]
+        else:
+            parts = [types.Part(text=step["reply"])]
+        yield LlmResponse(
+            content=types.Content(role="model", parts=parts),
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=0, candidates_token_count=0, total_token_count=0
+            ),
+        )
+
+
+class CountingBackend:
+    """Wraps a memory backend, counting and timing the storage calls made through it."""
+
+    def __init__(self, backend):
+        """
+        Args:
+            backend (MemoryBackend): Backend to wrap
+        """
+        self.backend = backend
+        self.counts = Counter()
+        self.seconds = Counter()
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attribute = getattr(self.backend, name)
+        if name not in STORAGE_OPERATIONS:
+            return attribute
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return attribute(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.counts[name] += 1
+                    self.seconds[name] += time.perf_counter() - started
+
+        return timed
+
+    def reset(self) -> tuple:
+        """Return the counts and seconds recorded so far and start again."""
+        with self._lock:
+            counts, seconds = dict(self.counts), dict(self.seconds)
+            self.counts.clear()
+            self.seconds.clear()
+        return counts, seconds
+
+
+def expand_steps(steps: list, base_dir: str = ".") -> list:
+    """Replace ``ingest`` steps with one ``store_email`` call per email."""
+    from ingest import READERS, detect_format
+
+    expanded = []
+    for step in steps:
+        if "ingest" not in step:
+            expanded.append(step)
+            continue
+        path = os.path.join(base_dir, step["ingest"])
+        for email in READERS[step.get("format") or detect_format(path)](path):
+            args = {
+                "from_sender": email["from"],
+                "to_recipient": email["to"],
+                "date": email["date"],
+                "subject": email["subject"],
+                "body": email["body"],
+            }
+            if email.get("cc"):
+                args["cc"] = email["cc"]
+            expanded.append({"calls": [{"name": "store_email", "args": args}]})
+    return expanded
+
+
+class ReplayHarness:
+    """Runs scripted turns through an agent module and records where the time goes."""
+
+    def __init__(self, module, base_dir: str = "."):
+        """
+        Args:
+            module: Loaded agent script exposing ``runner`` and ``async_memory``
+            base_dir (str): Directory that mailbox paths in ``ingest`` steps are relative to
+        """
+        self.module = module
+        self.base_dir = base_dir
+        self.model = ScriptedModel()
+        self.storage = CountingBackend(module.async_memory.memory.backend)
+        module.async_memory.memory.backend = self.storage
+        self._started = {}
+        self._tools = []
+        agent = module.runner.agent.clone(
+            update={
+                "model": self.model,
+                "before_tool_callback": self._before_tool,
+                "after_tool_callback": self._after_tool,
+            }
+        )
+        self.session_service = InMemorySessionService()
+        self.runner = Runner(
+            agent=agent, app_name=module.APP_NAME, session_service=self.session_service
+        )
+
+    def _before_tool(self, tool, args, tool_context):
+        self._started[tool_context.function_call_id] = time.perf_counter()
+
+    def _after_tool(self, tool, args, tool_context, tool_response):
+        started = self._started.pop(tool_context.function_call_id, None)
+        if started is not None:
+            self._tools.append((tool.name, time.perf_counter() - started))
+
+    async def run_turn(self, user_id: str, session_id: str, message: str, steps: list) -> dict:
+        """
+        Replay one turn.
+
+        Args:
+            user_id (str): User the turn runs for
+            session_id (str): Session of the conversation
+            message (str): The user's message
+            steps (list): Scripted model responses for the turn
+
+        Returns:
+            dict: Reply, wall time, tool timings and storage operation counts
+        """
+        self.model.queue(expand_steps(steps, self.base_dir))
+        self.model.calls = 0
+        self._tools = []
+        self.storage.reset()
+        content = types.Content(role="user", parts=[types.Part(text=message)])
+        reply = None
+        started = time.perf_counter()
+        with request_context(user_id, session_id):
+            async with self.module.async_memory.turn():
+                async for event in self.runner.run_async(
+                    user_id=user_id, session_id=session_id, new_message=content
+                ):
+                    if event.is_final_response() and event.content and event.content.parts:
+                        reply = event.content.parts[0].text
+        wall = time.perf_counter() - started
+        counts, seconds = self.storage.reset()
+
+        tools = defaultdict(lambda: {"calls": 0, "seconds": 0.0})
+        for name, elapsed in self._tools:
+            tools[name]["calls"] += 1
+            tools[name]["seconds"] += elapsed
+        return {
+            "user": message,
+            "reply": reply,
+            "wall_seconds": wall,
+            "model_calls": self.model.calls,
+            "tool_seconds": sum(elapsed for _, elapsed in self._tools),
+            "tools": dict(tools),
+            "storage_operations": counts,
+            "storage_seconds": sum(seconds.values()),
+        }
+
+    async def replay(self, script: dict) -> list:
+        """
+        Replay every turn of a script in one session.
+
+        Args:
+            script (dict): Parsed replay script
+
+        Returns:
+            list: One result dict per turn
+        """
+        user_id = script.get("user_id", "replay-user")
+        session_id = script.get("session_id", "replay-session")
+        await self.session_service.create_session(
+            app_name=self.runner.app_name, user_id=user_id, session_id=session_id
+        )
+        results = []
+        for turn in script["turns"]:
+            result = await self.run_turn(user_id, session_id, turn["user"], turn["model"])
+            results.append(result)
+            operations = sum(result["storage_operations"].values())
+            print(
+                f"turn {len(results):>3}: {result['wall_seconds'] * 1000:8.1f}ms wall, "
+                f"{result['tool_seconds'] * 1000:8.1f}ms in {sum(t['calls'] for t in result['tools'].values())} "
+                f"tool calls, {operations} storage ops ({result['storage_seconds'] * 1000:.1f}ms)"
+            )
+        return results
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("script", help="Replay script (JSON)")
+    parser.add_argument("--agent", choices=["real_estate", "email"], help="Agent to replay against (default: the script's)")
+    parser.add_argument("--backend", choices=["sqlite", "couchbase"], default="sqlite",
+                        help="Memory backend (sqlite uses a temporary store)")
+    parser.add_argument("--output", help="Write per-turn results to this JSON file")
+    args = parser.parse_args()
+
+    with open(args.script, encoding="utf-8") as script_file:
+        script = json.load(script_file)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.environ["MEMORY_BACKEND"] = args.backend
+        if args.backend == "sqlite":
+            os.environ["MEMORY_SQLITE_PATH"] = os.path.join(workdir, "replay.db")
+        os.environ["SESSION_DB_PATH"] = os.path.join(workdir, "sessions.db")
+        # The email agent refuses to start without a key; the scripted model never uses it.
+        if not os.getenv("OPENROUTER_API_KEY") and not os.getenv("GEMINI_API_KEY"):
+            os.environ["GEMINI_API_KEY"] = "unused-by-replay"
+
+        from server import load_agent
+
+        harness = ReplayHarness(
+            load_agent(args.agent or script.get("agent", "real_estate")),
+            os.path.dirname(os.path.abspath(args.script)),
+        )
+        results = asyncio.run(harness.replay(script))
+
+    total = {
+        "turns": len(results),
+        "wall_seconds": sum(result["wall_seconds"] for result in results),
+        "tool_seconds": sum(result["tool_seconds"] for result in results),
+        "storage_seconds": sum(result["storage_seconds"] for result in results),
+        "storage_operations": dict(sum((Counter(result["storage_operations"]) for result in results), Counter())),
+    }
+    print(
+        f"\n{total['turns']} turns in {total['wall_seconds']:.2f}s: {total['tool_seconds']:.2f}s in tools, "
+        f"{total['storage_seconds']:.2f}s in storage {total['storage_operations']}"
+    )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump({"script": args.script, "total": total, "turns": results}, output, indent=2)
+        print(f"Wrote results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Serve an agent to many users concurrently over HTTP.
+
+Usage:
+    python server.py --agent real_estate --port 8000
+    python server.py --agent email --max-concurrent 512 --per-user-limit 2
+
+    curl -X POST localhost:8000/chat \\
+        -H 'Content-Type: application/json' \\
+        -d '{"user_id": "alice", "session_id": "s1", "message": "Hi"}'
+
+Every request runs in its own task with the caller's user and session bound
+through ``context.request_context``, so tools read and write that user's
+memory only. Concurrency is capped globally and per user, and turns of the
+same session are serialised because a session's history is append-only.
+"""
+import argparse
+import asyncio
+import importlib.util
+import os
+from collections import defaultdict
+from contextlib import nullcontext
+
+from dotenv import load_dotenv
+from google.genai import types
+
+from context import request_context
+
+AGENTS = {"real_estate": "main.py", "email": "main-demo.py"}
+
+
+class AgentServer:
+    """Runs agent turns for many users and sessions on one event loop."""
+
+    def __init__(
+        self,
+        runner,
+        session_service,
+        app_name: str,
+        max_concurrent: int = 256,
+        per_user_limit: int = 4,
+        memory=None,
+        background: list = (),
+    ):
+        """
+        Args:
+            runner (Runner): ADK runner for the agent
+            session_service (BaseSessionService): Session store used by the runner
+            app_name (str): Application name the sessions belong to
+            max_concurrent (int): Maximum turns running at once across all users
+            per_user_limit (int): Maximum turns running at once for one user
+            memory (AsyncCouchbaseMemory): Memory used by the agent's tools; its
+                writes are buffered per turn and flushed before the response
+            background (list): Coroutine functions run as tasks while the server is up,
+                e.g. the email agent's archive compaction
+        """
+        self.runner = runner
+        self.memory = memory
+        self.session_service = session_service
+        self.app_name = app_name
+        self.background = list(background)
+        self.per_user_limit = per_user_limit
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._user_slots = {}
+        self._session_locks = {}
+        self._waiters = defaultdict(int)
+
+    async def _ensure_session(self, user_id: str, session_id: str) -> None:
+        """Create the session on its first turn."""
+        session = await self.session_service.get_session(
+            app_name=self.app_name, user_id=user_id, session_id=session_id
+        )
+        if session is None:
+            await self.session_service.create_session(
+                app_name=self.app_name, user_id=user_id, session_id=session_id
+            )
+
+    async def warm_up(self) -> None:
+        """Open the memory connections before the first request arrives."""
+        if self.memory is not None:
+            await self.memory.connect()
+
+    async def health(self) -> dict:
+        """
+        Report whether the server can reach its memory.
+
+        Returns:
+            dict: ``status`` plus the memory backend's health check
+        """
+        if self.memory is None:
+            return {"status": "ok"}
+        memory = await self.memory.health_check()
+        return {"status": memory["status"], "memory": memory}
+
+    async def handle(self, user_id: str, session_id: str, message: str) -> str:
+        """
+        Run one conversational turn for a user.
+
+        Args:
+            user_id (str): User sending the message
+            session_id (str): Conversation the message belongs to
+            message (str): The user's message
+
+        Returns:
+            str: The agent's final response
+        """
+        key = (user_id, session_id)
+        user_slots = self._user_slots.setdefault(user_id, asyncio.Semaphore(self.per_user_limit))
+        session_lock = self._session_locks.setdefault(key, asyncio.Lock())
+        self._waiters[user_id] += 1
+        self._waiters[key] += 1
+        try:
+            async with user_slots, session_lock, self._slots:
+                with request_context(user_id, session_id):
+                    await self._ensure_session(user_id, session_id)
+                    content = types.Content(role="user", parts=[types.Part(text=message)])
+                    async with self.memory.turn() if self.memory else nullcontext():
+                        async for event in self.runner.run_async(
+                            user_id=user_id, session_id=session_id, new_message=content
+                        ):
+                            if event.is_final_response() and event.content and event.content.parts:
+                                return event.content.parts[0].text
+            return "No response received."
+        finally:
+            # Drop idle per-user state so memory does not grow with the number of users seen
+            for waiting, limits in ((key, self._session_locks), (user_id, self._user_slots)):
+                self._waiters[waiting] -= 1
+                if not self._waiters[waiting]:
+                    del self._waiters[waiting]
+                    del limits[waiting]
+
+
+def create_app(server: AgentServer):
+    """
+    Build the HTTP application for an agent server.
+
+    Args:
+        server (AgentServer): Server that runs the turns
+
+    Returns:
+        FastAPI: Application exposing ``POST /chat`` and ``GET /health``;
+            memory connections are warmed up at startup
+    """
+    from contextlib import asynccontextmanager
+
+    from fastapi import FastAPI
+    from fastapi.responses import JSONResponse
+    from pydantic import BaseModel
+
+    class ChatRequest(BaseModel):
+        user_id: str
+        session_id: str
+        message: str
+
+    @asynccontextmanager
+    async def lifespan(app):
+        await server.warm_up()
+        tasks = [asyncio.create_task(job()) for job in server.background]
+        yield
+        for task in tasks:
+            task.cancel()
+
+    app = FastAPI(title=server.app_name, lifespan=lifespan)
+
+    @app.get("/health")
+    async def health():
+        report = await server.health()
+        return JSONResponse(report, status_code=200 if report["status"] == "ok" else 503)
+
+    @app.post("/chat")
+    async def chat(request: ChatRequest) -> dict:
+        response = await server.handle(request.user_id, request.session_id, request.message)
+        return {"user_id": request.user_id, "session_id": request.session_id, "response": response}
+
+    return app
+
+
+def load_agent(name: str):
+    """Import an agent script and return its module."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), AGENTS[name])
+    spec = importlib.util.spec_from_file_location(f"{name}_agent", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Serve an agent to many users concurrently over HTTP")
+    parser.add_argument("--agent", choices=sorted(AGENTS), default="real_estate", help="Agent to serve")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    parser.add_argument("--max-concurrent", type=int, default=256, help="Turns running at once across all users")
+    parser.add_argument("--per-user-limit", type=int, default=4, help="Turns running at once for one user")
+    args = parser.parse_args()
+
+    import uvicorn
+
+    agent = load_agent(args.agent)
+    server = AgentServer(
+        agent.runner,
+        agent.session_service,
+        agent.APP_NAME,
+        max_concurrent=args.max_concurrent,
+        per_user_limit=args.per_user_limit,
+        memory=agent.async_memory,
+        background=getattr(agent, "background_jobs", ()),
+    )
+    uvicorn.run(create_app(server), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
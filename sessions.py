@@ -0,0 +1,340 @@
+"""
+Durable ADK session service with bounded memory use.
+
+Events are appended to a log in a local SQLite file, so conversations survive
+restarts. Only a window of each session's most recent events is kept in
+process memory, for at most ``max_sessions`` recently used sessions; older
+events stay on disk and are read back only when a caller asks for them.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Optional
+
+from google.adk.errors.already_exists_error import AlreadyExistsError
+from google.adk.errors.session_not_found_error import SessionNotFoundError
+from google.adk.events import Event
+from google.adk.sessions import BaseSessionService, Session
+from google.adk.sessions.base_session_service import GetSessionConfig, ListSessionsResponse
+from google.adk.sessions.state import State
+
+
+def _split_state(state: dict) -> tuple:
+    """Split a state delta into (app, user, session) parts, dropping temp keys."""
+    app, user, session = {}, {}, {}
+    for key, value in (state or {}).items():
+        if key.startswith(State.APP_PREFIX):
+            app[key[len(State.APP_PREFIX):]] = value
+        elif key.startswith(State.USER_PREFIX):
+            user[key[len(State.USER_PREFIX):]] = value
+        elif not key.startswith(State.TEMP_PREFIX):
+            session[key] = value
+    return app, user, session
+
+
+class DurableSessionService(BaseSessionService):
+    """
+    Session service keeping an append-only event log on disk and a bounded window in memory.
+
+    ``get_session`` without a config returns the session's last ``window``
+    events (moved forward past tool responses whose calls fell outside it), so the model's
+    context and the process's memory stay bounded however long a
+    conversation runs. Pass ``GetSessionConfig`` to read further back.
+    """
+
+    def __init__(self, path: str = "sessions.db", window: int = 50, max_sessions: int = 1000):
+        """
+        Open (and create if needed) a session store.
+
+        Args:
+            path (str): SQLite database file, or ":memory:" for a throwaway store
+            window (int): Most recent events kept in memory and returned per session
+            max_sessions (int): Sessions whose window is kept in memory, least
+                recently used are evicted first
+        """
+        self.path = path
+        self.window = window
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Run the body in one write transaction, committed if it returns and rolled back if it raises.
+
+        Callers hold ``_lock``; the cached windows are only updated once the
+        transaction has committed, so they never show a write that was rolled back.
+        """
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+            self._conn.execute("COMMIT")
+        except BaseException:
+            if self._conn.in_transaction:
+                self._conn.execute("ROLLBACK")
+            raise
+
+    def _create_schema(self) -> None:
+        """Create the session tables if they do not exist."""
+        with self._lock:
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS sessions (
+                    app_name TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    last_update_time REAL NOT NULL,
+                    PRIMARY KEY (app_name, user_id, id)
+                );
+                CREATE TABLE IF NOT EXISTS events (
+                    seq INTEGER PRIMARY KEY,
+                    app_name TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    session_id TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    timestamp REAL NOT NULL,
+                    event TEXT NOT NULL,
+                    UNIQUE (app_name, user_id, session_id, id)
+                );
+                CREATE INDEX IF NOT EXISTS events_session
+                    ON events (app_name, user_id, session_id, seq);
+                CREATE TABLE IF NOT EXISTS app_state (
+                    app_name TEXT PRIMARY KEY,
+                    state TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS user_state (
+                    app_name TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    PRIMARY KEY (app_name, user_id)
+                );
+                """
+            )
+
+    def _scoped_state(self, table: str, key: tuple) -> dict:
+        """Read the app or user state row for a key, empty if there is none."""
+        where = " AND ".join(f"{column} = ?" for column in ("app_name", "user_id")[: len(key)])
+        row = self._conn.execute(f"SELECT state FROM {table} WHERE {where}", key).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def _update_scoped_state(self, table: str, key: tuple, delta: dict) -> None:
+        """Merge a delta into the app or user state row for a key."""
+        if not delta:
+            return
+        state = {**self._scoped_state(table, key), **delta}
+        columns = ("app_name", "user_id")[: len(key)]
+        self._conn.execute(
+            f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}, state) "
+            f"VALUES ({', '.join('?' for _ in columns)}, ?)",
+            (*key, json.dumps(state)),
+        )
+
+    def _merge_state(self, session: Session) -> Session:
+        """Return a copy of a session with the app and user state merged in."""
+        state = dict(session.state)
+        for key, value in self._scoped_state("app_state", (session.app_name,)).items():
+            state[State.APP_PREFIX + key] = value
+        for key, value in self._scoped_state("user_state", (session.app_name, session.user_id)).items():
+            state[State.USER_PREFIX + key] = value
+        return session.model_copy(update={"state": state, "events": list(session.events)})
+
+    def _window(self, events: list) -> list:
+        """The last ``window`` events, never starting with an orphaned tool response."""
+        start = max(len(events) - self.window, 0)
+        while start < len(events) and events[start].get_function_responses():
+            start += 1
+        return events[start:]
+
+    def _remember(self, key: tuple, session: Session) -> None:
+        """Cache a session's window, evicting the least recently used sessions."""
+        self._cache[key] = session
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_sessions:
+            self._cache.popitem(last=False)
+
+    def _load_events(self, key: tuple, limit: int = None, after: float = None) -> list:
+        """Read a session's events from the log, oldest first."""
+        query = "SELECT event FROM events WHERE app_name = ? AND user_id = ? AND session_id = ?"
+        params = list(key)
+        if after is not None:
+            query += " AND timestamp >= ?"
+            params.append(after)
+        query += " ORDER BY seq DESC LIMIT ?"
+        params.append(-1 if limit is None else limit)
+        rows = self._conn.execute(query, params).fetchall()
+        return [Event.model_validate_json(row[0]) for row in reversed(rows)]
+
+    def _cached(self, key: tuple) -> Optional[Session]:
+        """Return a session's cached window, loading it from disk on a miss."""
+        session = self._cache.get(key)
+        if session is not None:
+            self._cache.move_to_end(key)
+            return session
+        row = self._conn.execute(
+            "SELECT state, last_update_time FROM sessions WHERE app_name = ? AND user_id = ? AND id = ?",
+            key,
+        ).fetchone()
+        if row is None:
+            return None
+        # A few extra events let the window skip orphaned tool responses.
+        events = self._window(self._load_events(key, limit=self.window * 2))
+        session = Session(
+            app_name=key[0], user_id=key[1], id=key[2],
+            state=json.loads(row[0]), events=events, last_update_time=row[1],
+        )
+        self._remember(key, session)
+        return session
+
+    def _create(self, app_name: str, user_id: str, state: dict, session_id: str) -> Session:
+        session_id = (session_id or "").strip() or str(uuid.uuid4())
+        app, user, session_state = _split_state(state)
+        now = time.time()
+        with self._lock:
+            try:
+                with self._transaction():
+                    self._conn.execute(
+                        "INSERT INTO sessions (app_name, user_id, id, state, last_update_time) VALUES (?, ?, ?, ?, ?)",
+                        (app_name, user_id, session_id, json.dumps(session_state), now),
+                    )
+                    self._update_scoped_state("app_state", (app_name,), app)
+                    self._update_scoped_state("user_state", (app_name, user_id), user)
+            except sqlite3.IntegrityError:
+                raise AlreadyExistsError(f"Session with id {session_id} already exists.") from None
+            session = Session(
+                app_name=app_name, user_id=user_id, id=session_id,
+                state=session_state, last_update_time=now,
+            )
+            self._remember((app_name, user_id, session_id), session)
+            return self._merge_state(session)
+
+    async def create_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        state: Optional[dict[str, Any]] = None,
+        session_id: Optional[str] = None,
+    ) -> Session:
+        return await asyncio.to_thread(self._create, app_name, user_id, state, session_id)
+
+    def _get(self, key: tuple, config: Optional[GetSessionConfig]) -> Optional[Session]:
+        with self._lock:
+            session = self._cached(key)
+            if session is None:
+                return None
+            if config is not None and (config.num_recent_events is not None or config.after_timestamp is not None):
+                limit = config.num_recent_events
+                events = [] if limit == 0 else self._load_events(key, limit, config.after_timestamp)
+                session = session.model_copy(update={"events": events})
+            return self._merge_state(session)
+
+    async def get_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        config: Optional[GetSessionConfig] = None,
+    ) -> Optional[Session]:
+        return await asyncio.to_thread(self._get, (app_name, user_id, session_id.strip()), config)
+
+    def _list(self, app_name: str, user_id: Optional[str]) -> ListSessionsResponse:
+        query = "SELECT user_id, id, state, last_update_time FROM sessions WHERE app_name = ?"
+        params = [app_name]
+        if user_id is not None:
+            query += " AND user_id = ?"
+            params.append(user_id)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY last_update_time, user_id, id", params).fetchall()
+            sessions = [
+                self._merge_state(
+                    Session(app_name=app_name, user_id=row[0], id=row[1],
+                            state=json.loads(row[2]), last_update_time=row[3])
+                )
+                for row in rows
+            ]
+        return ListSessionsResponse(sessions=sessions)
+
+    async def list_sessions(self, *, app_name: str, user_id: Optional[str] = None) -> ListSessionsResponse:
+        return await asyncio.to_thread(self._list, app_name, user_id)
+
+    def _delete(self, key: tuple) -> None:
+        with self._lock:
+            with self._transaction():
+                self._conn.execute("DELETE FROM sessions WHERE app_name = ? AND user_id = ? AND id = ?", key)
+                self._conn.execute("DELETE FROM events WHERE app_name = ? AND user_id = ? AND session_id = ?", key)
+            self._cache.pop(key, None)
+
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        await asyncio.to_thread(self._delete, (app_name, user_id, session_id.strip()))
+
+    def _user_state(self, app_name: str, user_id: str) -> dict:
+        with self._lock:
+            return self._scoped_state("user_state", (app_name, user_id))
+
+    async def get_user_state(self, *, app_name: str, user_id: str) -> dict[str, Any]:
+        return await asyncio.to_thread(self._user_state, app_name, user_id)
+
+    def _append(self, key: tuple, event: Event) -> bool:
+        """Write an event to the log and the cached window; False if it was already stored."""
+        app, user, session_state = _split_state(event.actions.state_delta if event.actions else {})
+        with self._lock:
+            # Loaded before the insert, so a window read from disk does not hold the event yet.
+            session = self._cached(key)
+            if session is None:
+                raise SessionNotFoundError(f"Session {key[2]} not found.")
+            state = {**session.state, **session_state}
+            with self._transaction():
+                written = self._conn.execute(
+                    "INSERT OR IGNORE INTO events (app_name, user_id, session_id, id, timestamp, event) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (*key, event.id, event.timestamp, event.model_dump_json(exclude_none=True)),
+                ).rowcount
+                if not written:
+                    return False
+                self._conn.execute(
+                    "UPDATE sessions SET state = ?, last_update_time = ? WHERE app_name = ? AND user_id = ? AND id = ?",
+                    (json.dumps(state), event.timestamp, *key),
+                )
+                self._update_scoped_state("app_state", (key[0],), app)
+                self._update_scoped_state("user_state", key[:2], user)
+            session.state = state
+            session.events = self._window(session.events + [event])
+            session.last_update_time = event.timestamp
+            return True
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        if event.partial:
+            return event
+        self._apply_temp_state(session, event)
+        event = self._trim_temp_delta_state(event)
+        key = (session.app_name, session.user_id, session.id)
+        if await asyncio.to_thread(self._append, key, event):
+            self._commit_event_to_session(session, event)
+            session.last_update_time = event.timestamp
+        return event
+
+
+def session_service_from_env() -> DurableSessionService:
+    """
+    Build the session service configured by ``SESSION_DB_PATH`` and ``SESSION_WINDOW``.
+
+    Returns:
+        DurableSessionService: Session store shared by an agent's runner
+    """
+    return DurableSessionService(
+        os.getenv("SESSION_DB_PATH", "sessions.db"),
+        window=int(os.getenv("SESSION_WINDOW", "50")),
+    )
@@ -0,0 +1,1719 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Union
+
+import couchbase.subdocument as SD
+from couchbase.cluster import Cluster
+from couchbase.options import (
+    ClusterOptions,
+    GetMultiOptions,
+    IncrementOptions,
+    InsertOptions,
+    MutateInOptions,
+    ReplaceOptions,
+    SignedInt64,
+)
+from couchbase.auth import PasswordAuthenticator
+from couchbase.exceptions import (
+    CasMismatchException,
+    CouchbaseException,
+    DocumentExistsException,
+    DocumentNotFoundException,
+    PathExistsException,
+    PathMismatchException,
+    PathNotFoundException,
+)
+
+from compression import Codec
+from instrumentation import get_instrumentation
+
+
+def _normalise(data):
+    """Collapse whitespace in every string of a JSON value."""
+    if isinstance(data, str):
+        return " ".join(data.split())
+    if isinstance(data, dict):
+        return {key: _normalise(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [_normalise(value) for value in data]
+    return data
+
+
+def _as_stored(value):
+    """Return a sub-document value unconverted, for ``content_as`` on paths of mixed type."""
+    return value
+
+
+def content_digest(data: Union[str, dict]) -> str:
+    """
+    Hash a value for duplicate detection, ignoring differences in whitespace.
+
+    Args:
+        data (str | dict): Value to hash, a string or a JSON object
+
+    Returns:
+        str: Hex digest of the whitespace-normalised value
+    """
+    normalised = _normalise(data)
+    if not isinstance(normalised, str):
+        normalised = json.dumps(normalised, sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(normalised.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def unique_items(items: list) -> tuple:
+    """
+    Drop duplicate values, keeping the first occurrence.
+
+    Args:
+        items (list): Values in storage order
+
+    Returns:
+        tuple: (unique items, {digest: 1} map of their content digests)
+    """
+    unique, hashes = [], {}
+    for item in items:
+        digest = content_digest(item)
+        if digest not in hashes:
+            hashes[digest] = 1
+            unique.append(item)
+    return unique, hashes
+
+
+class MemoryBackend(ABC):
+    """Storage engine underneath CouchbaseMemory."""
+
+    # Whether appends and trims are recorded for ``read_changes``.
+    change_log = False
+    # Independent sequences the change log is split into. Each user's
+    # changes go to one of them, so they are ordered per user.
+    change_partitions = 1
+    # Recorded as the ``writer`` of every change this backend object makes,
+    # so a consumer can skip its own process's changes. Set per instance.
+    writer_id = None
+
+    @abstractmethod
+    def append(self, user_id: str, category: str, data: Union[str, dict]) -> bool:
+        """
+        Append data to a user's category unless it is already stored.
+
+        Args:
+            user_id (str): User ID to associate the data with
+            category (str): Category to store the data in
+            data (str | dict): Data to store
+
+        Returns:
+            bool: True if the data was written, False if it was already present
+        """
+
+    def append_many(self, user_id: str, category: str, values: list) -> int:
+        """
+        Append several values to a user's category, skipping stored ones.
+
+        Backends override this to batch the writes into fewer round trips.
+
+        Args:
+            user_id (str): User ID to associate the data with
+            category (str): Category to store the data in
+            values (list): Values to store, in order
+
+        Returns:
+            int: Number of values written
+        """
+        return sum(self.append(user_id, category, value) for value in values)
+
+    @abstractmethod
+    def read(self, user_id: str, category: str) -> list:
+        """
+        Read every item stored in a user's category.
+
+        Args:
+            user_id (str): User ID to read
+            category (str): Category to read
+
+        Returns:
+            list: Items stored under the category, oldest first
+        """
+
+    def read_many(self, keys: list) -> dict:
+        """
+        Read several categories at once.
+
+        Backends override this to fetch them in a few batched round trips.
+
+        Args:
+            keys (list): (user_id, category) pairs to read; repeats are read once
+
+        Returns:
+            dict: Items of each category oldest first, keyed by (user_id, category)
+        """
+        return {key: self.read(*key) for key in dict.fromkeys(keys)}
+
+    def read_page(self, user_id: str, category: str, offset: int = 0, limit: int = None) -> tuple:
+        """
+        Read a slice of a user's category.
+
+        Backends override this to fetch only the requested items.
+
+        Args:
+            user_id (str): User ID to read
+            category (str): Category to read
+            offset (int): Number of leading items to skip
+            limit (int): Maximum number of items to return, None for all
+
+        Returns:
+            tuple: (items in the slice oldest first, total items in the category)
+        """
+        items = self.read(user_id, category)
+        end = None if limit is None else offset + limit
+        return items[offset:end], len(items)
+
+    def trim(self, user_id: str, category: str, values: list, forget: bool = False) -> int:
+        """
+        Remove values from the front of a user's category.
+
+        Only the leading run of ``values`` that still matches the category's
+        oldest items is removed, so a trim that races another one (or is
+        retried) never removes items it did not mean to. The digests of
+        removed values are kept unless ``forget`` is set, so storing one of
+        them again in the same category is rejected as a duplicate.
+
+        Args:
+            user_id (str): User ID to trim
+            category (str): Category to trim
+            values (list): The values expected at the front of the category, oldest first
+            forget (bool): Drop the removed values' digests as well, for
+                categories that are rewritten rather than appended to
+
+        Returns:
+            int: Number of values removed
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support trimming")
+
+    def read_changes(self, after: int = 0, limit: int = 500, partition: int = 0) -> list:
+        """
+        Read one partition of the mutation log after a sequence number.
+
+        Mutations are only recorded by backends created with ``change_log``.
+
+        Args:
+            after (int): Sequence number of the last change already seen in the partition
+            limit (int): Maximum number of changes returned
+            partition (int): Partition to read, below ``change_partitions``
+
+        Returns:
+            list: Changes in sequence order, dicts with ``partition``, ``seq``,
+                ``user_id``, ``category``, ``op`` ("append" or "trim"), the
+                ``values`` appended or removed, the time ``at`` they were
+                recorded and the ``writer_id`` of the backend that made them
+                as ``writer``. A change whose write stored nothing has no values.
+        """
+        raise NotImplementedError(f"{type(self).__name__} has no change log")
+
+    def last_change(self, partition: int = 0) -> int:
+        """Sequence number of the newest change recorded in a partition, 0 if there is none."""
+        raise NotImplementedError(f"{type(self).__name__} has no change log")
+
+    def load_checkpoint(self, name: str) -> list:
+        """Sequence numbers a change consumer has applied up to, one per partition, 0 if it never ran."""
+        raise NotImplementedError(f"{type(self).__name__} has no change log")
+
+    def save_checkpoint(self, name: str, seqs: list) -> None:
+        """Record that a change consumer has applied every change up to ``seqs``, one per partition."""
+        raise NotImplementedError(f"{type(self).__name__} has no change log")
+
+    def connect(self) -> None:
+        """Open connections ahead of the first operation. Backends connect lazily otherwise."""
+
+    def health_check(self) -> dict:
+        """
+        Check that the store answers by timing a read of an empty category.
+
+        Returns:
+            dict: ``status`` ("ok" or "error"), ``latency_ms`` or ``error``
+        """
+        started = time.perf_counter()
+        try:
+            self.read("__health__", "__health__")
+        except Exception as e:
+            return {"status": "error", "error": f"{type(e).__name__}: {e}"}
+        return {"status": "ok", "latency_ms": (time.perf_counter() - started) * 1000}
+
+
+class ClusterRegistry:
+    """
+    Process-wide pool of Couchbase connections.
+
+    Every backend using the same connection string and credentials shares one
+    ``Cluster`` and its opened buckets, whatever scope or collection it reads,
+    so the real estate and email memories pay for a single connection.
+    Connections are opened on first request.
+    """
+
+    def __init__(self):
+        self._clusters = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def cluster(self, conn_str: str, username: str, password: str) -> Cluster:
+        """
+        Return the shared connection to a cluster, opening it if needed.
+
+        Args:
+            conn_str (str): Connection string to Couchbase
+            username (str): Username for authentication
+            password (str): Password for authentication
+
+        Returns:
+            Cluster: The shared cluster connection
+        """
+        key = (conn_str, username, password)
+        with self._lock:
+            cluster = self._clusters.get(key)
+            if cluster is None:
+                if not conn_str:
+                    raise ValueError("No Couchbase connection string configured (COUCHBASE_CONN_STR)")
+                cluster = Cluster(conn_str, ClusterOptions(PasswordAuthenticator(username, password)))
+                self._clusters[key] = cluster
+                print("[Memory System] Connected to Couchbase Capella")
+            return cluster
+
+    def bucket(self, conn_str: str, username: str, password: str, bucket_name: str):
+        """
+        Return a shared opened bucket.
+
+        Args:
+            conn_str (str): Connection string to Couchbase
+            username (str): Username for authentication
+            password (str): Password for authentication
+            bucket_name (str): Name of the bucket
+
+        Returns:
+            Bucket: The opened bucket
+        """
+        cluster = self.cluster(conn_str, username, password)
+        key = (conn_str, username, password, bucket_name)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = cluster.bucket(bucket_name)
+            return bucket
+
+    def close(self) -> None:
+        """Close every pooled connection."""
+        with self._lock:
+            clusters = list(self._clusters.values())
+            self._clusters.clear()
+            self._buckets.clear()
+        for cluster in clusters:
+            cluster.close()
+
+
+clusters = ClusterRegistry()
+
+
+class CouchbaseBackend(MemoryBackend):
+    """
+    Couchbase storage with one head document per (user, category).
+
+    The head ``user::{user_id}::{category}`` holds the newest items. Full runs
+    of ``chunk_size`` items are sealed into immutable
+    ``user::{user_id}::{category}::chunk::{n}`` documents. The head's
+    ``trimmed`` count records how many of the oldest items were removed, and
+    its ``epoch`` counts the seals and trims that shifted the head's items.
+
+    Duplicate checks use content digests. The head's ``hashes`` map only
+    covers the items appended since the last seal; sealing moves the other
+    digests into ``DIGEST_SHARDS`` documents ``...::digests::{n}``, picked by
+    digest, so neither the head nor any one shard grows with the category.
+
+    With ``change_log`` every append and trim is also recorded as a
+    ``changes::{partition}::{seq}`` document, expiring after
+    ``change_retention``. A user's changes all go to one of
+    ``change_partitions`` partitions, each numbered by its own
+    ``changes::seq::{partition}`` counter, so writers for different users do
+    not all increment one hot counter. A change is journalled before the
+    mutation it describes and confirmed after it.
+    """
+
+    # Sub-document mutations accept 16 specs; in an append group two of them
+    # go to the array append and the size counter.
+    MAX_SPECS = 16
+    MAX_BATCH = 14
+    # Documents the digests of sealed and trimmed items of a category are spread over.
+    DIGEST_SHARDS = 16
+    # Sub-document lookups accept 16 specs too; pages with at most this many
+    # head items fetch them one path each, alongside the head's epoch.
+    MAX_PAGE_PATHS = 15
+    # Seconds a missing or unconfirmed change is waited for: a writer numbers
+    # a change before journalling it, and confirms it after its mutation, and
+    # may die in between.
+    CHANGE_GAP_TIMEOUT = 5.0
+    # Fixed for the life of a change log: it decides which counter a user's changes take.
+    change_partitions = 16
+
+    def __init__(
+        self,
+        conn_str: str,
+        username: str,
+        password: str,
+        bucket_name: str,
+        scope_name: str = "real_estate",
+        collection_name: str = "memory",
+        chunk_size: int = 500,
+        max_cas_retries: int = 10,
+        registry: ClusterRegistry = None,
+        codec: Codec = None,
+        change_log: bool = False,
+        change_retention: timedelta = timedelta(days=7),
+    ):
+        """
+        Prepare access to a Couchbase collection. Nothing is opened until first use.
+
+        Args:
+            conn_str (str): Connection string to Couchbase
+            username (str): Username for authentication
+            password (str): Password for authentication
+            bucket_name (str): Name of the bucket to use
+            scope_name (str): Scope name for the memory system
+            collection_name (str): Collection name for the memory system
+            chunk_size (int): Number of items a category head holds before they are
+                sealed into a chunk document
+            max_cas_retries (int): Attempts made by the CAS fallback before giving up
+            registry (ClusterRegistry): Connection pool, the process-wide one by default
+            codec (Codec): Compresses stored items and sealed chunks; uncompressed
+                documents are read as they are
+            change_log (bool): Record appends and trims in the change log
+            change_retention (timedelta): How long recorded changes are kept
+        """
+        self.conn_str = conn_str
+        self.username = username
+        self.password = password
+        self.bucket_name = bucket_name
+        self.scope_name = scope_name
+        self.collection_name = collection_name
+        self.chunk_size = chunk_size
+        self.max_cas_retries = max_cas_retries
+        self.registry = registry or clusters
+        self.codec = codec or Codec()
+        self.change_log = change_log
+        self.change_retention = change_retention
+        self.writer_id = uuid.uuid4().hex
+        self._scope = None
+        self._collection = None
+        self._change_gaps = {}
+
+    @property
+    def cluster(self) -> Cluster:
+        """The shared cluster connection."""
+        return self.registry.cluster(self.conn_str, self.username, self.password)
+
+    @property
+    def scope(self):
+        """The memory scope, opened on first use."""
+        if self._scope is None:
+            bucket = self.registry.bucket(self.conn_str, self.username, self.password, self.bucket_name)
+            self._scope = bucket.scope(self.scope_name)
+        return self._scope
+
+    @property
+    def collection(self):
+        """The memory collection, opened on first use."""
+        if self._collection is None:
+            self._collection = self.scope.collection(self.collection_name)
+        return self._collection
+
+    def connect(self, timeout: float = 10.0) -> None:
+        """
+        Pre-warm the connection so the first request does not pay for it.
+
+        Args:
+            timeout (float): Seconds to wait for the cluster to be ready
+        """
+        self.collection  # opens the bucket, scope and collection
+        self.cluster.wait_until_ready(timedelta(seconds=timeout))
+
+    def _legacy_doc_id(self, user_id: str) -> str:
+        """Generate the ID of a user's legacy single-document memory."""
+        return f"user::{user_id}"
+
+    def _doc_id(self, user_id: str, category: str) -> str:
+        """Generate the head document ID for a user's category."""
+        return f"user::{user_id}::{category}"
+
+    def _chunk_id(self, doc_id: str, index: int) -> str:
+        """Generate the ID of a sealed chunk belonging to a category head."""
+        return f"{doc_id}::chunk::{index}"
+
+    def _digest_shard_id(self, doc_id: str, digest: str) -> str:
+        """Generate the ID of the digest shard document holding a sealed digest."""
+        return f"{doc_id}::digests::{int(digest[:8], 16) % self.DIGEST_SHARDS}"
+
+    def _path(self, field: str) -> str:
+        """Escape a field name for use as a sub-document path."""
+        return "`" + field.replace("`", "``") + "`"
+
+    def _decode(self, items: list) -> list:
+        """Restore stored items (or a compressed chunk) to their original values."""
+        return [self.codec.decode(item) for item in self.codec.decode(items)]
+
+    def _check_multi(self, result, missing_ok: bool = False) -> dict:
+        """
+        Raise the first failure of a multi-operation; the SDK returns them instead of raising.
+
+        Args:
+            result (MultiResult): Result of a ``*_multi`` call
+            missing_ok (bool): Leave documents that do not exist out of the
+                results instead of raising for them
+
+        Returns:
+            dict: The successful results, keyed by document ID
+        """
+        if not result.all_ok:
+            for error in result.exceptions.values():
+                if not (missing_ok and isinstance(error, DocumentNotFoundException)):
+                    raise error
+        return result.results
+
+    def _digest_shards(self, doc_id: str, digests: list) -> dict:
+        """Group digests by the digest shard document holding them."""
+        shards = {}
+        for digest in digests:
+            shards.setdefault(self._digest_shard_id(doc_id, digest), []).append(digest)
+        return shards
+
+    def _sealed_digests(self, doc_id: str, digests: list) -> set:
+        """
+        Look digests up in a category's digest shards with one multi-get.
+
+        Only the requested paths are projected, so at most ``MAX_BATCH``
+        digests are looked up at once.
+
+        Args:
+            doc_id (str): Category head document
+            digests (list): Content digests to look up
+
+        Returns:
+            set: The digests already stored in a shard
+        """
+        shards = self._digest_shards(doc_id, digests)
+        found = self._check_multi(
+            self.collection.get_multi(
+                list(shards), GetMultiOptions(project=[f"hashes.{digest}" for digest in digests])
+            ),
+            missing_ok=True,
+        )
+        sealed = set()
+        for shard_id, group in shards.items():
+            if shard_id in found:
+                stored = found[shard_id].content_as[dict].get("hashes", {})
+                sealed.update(digest for digest in group if digest in stored)
+        return sealed
+
+    def _store_sealed_digests(self, doc_id: str, digests: list) -> None:
+        """
+        Add digests to a category's digest shards, creating the shards as needed.
+
+        Args:
+            doc_id (str): Category head document
+            digests (list): Content digests of sealed or trimmed items
+        """
+        for shard_id, group in self._digest_shards(doc_id, digests).items():
+            for start in range(0, len(group), self.MAX_SPECS):
+                self.collection.mutate_in(
+                    shard_id,
+                    [
+                        SD.upsert(f"hashes.{digest}", 1, create_parents=True)
+                        for digest in group[start : start + self.MAX_SPECS]
+                    ],
+                    MutateInOptions(store_semantics=SD.StoreSemantics.UPSERT),
+                )
+
+    def _forget_sealed_digests(self, doc_id: str, digests: list) -> None:
+        """
+        Remove digests from a category's digest shards, where they are present.
+
+        Args:
+            doc_id (str): Category head document
+            digests (list): Content digests of trimmed items
+        """
+        for start in range(0, len(digests), self.MAX_BATCH):
+            sealed = self._sealed_digests(doc_id, digests[start : start + self.MAX_BATCH])
+            for shard_id, group in self._digest_shards(doc_id, list(sealed)).items():
+                try:
+                    self.collection.mutate_in(shard_id, [SD.remove(f"hashes.{digest}") for digest in group])
+                except (DocumentNotFoundException, PathNotFoundException):
+                    # Removed by a concurrent trim of the same values.
+                    continue
+
+    def append(self, user_id: str, category: str, data: Union[str, dict]) -> bool:
+        """
+        Append data to a category with a single sub-document mutation.
+
+        Only the new value crosses the network and concurrent writers for the
+        same user do not overwrite each other. Once the head holds
+        ``chunk_size`` items they are sealed into a chunk document.
+
+        Args:
+            user_id (str): User ID to associate the data with
+            category (str): Category to store the data in
+            data (str | dict): Data to store
+
+        Returns:
+            bool: True if the data was written, False if it was already present
+        """
+        change = self._journal_change(user_id, category, "append", [data])
+        saved, size = self._append(user_id, category, data)
+        self._confirm_change(change, [data] if saved else [])
+        if size >= self.chunk_size:
+            self._seal_chunks(self._doc_id(user_id, category))
+        return saved
+
+    def append_many(self, user_id: str, category: str, values: list) -> int:
+        """
+        Append several values with one sub-document mutation per group.
+
+        A mutation carries at most 16 specs, so values are sent in groups of
+        ``MAX_BATCH``: one digest insert each, plus a single multi-value array
+        append and the size counter. Each group's values found in the digest
+        shards are dropped first. A group containing a value already in the
+        head is rejected as a whole and replayed value by value.
+
+        Args:
+            user_id (str): User ID to associate the data with
+            category (str): Category to store the data in
+            values (list): Values to store, in order
+
+        Returns:
+            int: Number of values written
+        """
+        doc_id = self._doc_id(user_id, category)
+        values, hashes = unique_items(values)
+        digests = list(hashes)
+        change = self._journal_change(user_id, category, "append", values)
+        saved = []
+        for start in range(0, len(values), self.MAX_BATCH):
+            group = values[start : start + self.MAX_BATCH]
+            group_digests = digests[start : start + self.MAX_BATCH]
+            sealed = self._sealed_digests(doc_id, group_digests)
+            if sealed:
+                group = [value for value, digest in zip(group, group_digests) if digest not in sealed]
+                group_digests = [digest for digest in group_digests if digest not in sealed]
+            if not group:
+                continue
+            specs = [SD.insert(f"hashes.{digest}", 1) for digest in group_digests]
+            encoded = [self.codec.encode(value) for value in group]
+            specs += [SD.array_append("items", *encoded), SD.counter("size", len(group))]
+            try:
+                result = self.collection.mutate_in(doc_id, specs)
+                saved += group
+                size = result.content_as[int](len(specs) - 1)
+            except DocumentNotFoundException:
+                written, size = self._create_category(user_id, category, group)
+                saved += written
+            except (PathExistsException, PathNotFoundException, PathMismatchException):
+                get_instrumentation().count("memory_retries_total", operation="append_many_replay")
+                for value in group:
+                    written, size = self._append(user_id, category, value)
+                    if written:
+                        saved.append(value)
+            if size >= self.chunk_size:
+                self._seal_chunks(doc_id)
+        self._confirm_change(change, saved)
+        return len(saved)
+
+    def _append(self, user_id: str, category: str, data: Union[str, dict]) -> tuple:
+        """
+        Append data to a category head document.
+
+        The digest is first looked up in the category's digest shards, which
+        cover sealed and trimmed items. The head keeps a ``hashes`` map of the
+        digests appended since the last seal: inserting the digest fails on
+        the server when it is already there, which rejects the whole
+        mutation, so both checks are O(1).
+
+        A seal keeps the digests it moves in the head until the next one, so
+        the two checks only miss a duplicate appended concurrently if two
+        whole chunks are sealed between them.
+
+        Args:
+            user_id (str): User ID to associate the data with
+            category (str): Category to store the data in
+            data (str | dict): Data to store
+
+        Returns:
+            tuple: (saved, size) where size is the number of items in the head
+        """
+        doc_id = self._doc_id(user_id, category)
+        digest = content_digest(data)
+        if self._sealed_digests(doc_id, [digest]):
+            return False, 0
+        try:
+            result = self.collection.mutate_in(
+                doc_id,
+                [
+                    SD.insert(f"hashes.{digest}", 1),
+                    SD.array_append("items", self.codec.encode(data)),
+                    SD.counter("size", 1),
+                ],
+            )
+            return True, result.content_as[int](2)
+        except DocumentNotFoundException:
+            written, size = self._create_category(user_id, category, [data])
+            return bool(written), size
+        except PathExistsException:
+            return False, 0
+        except (PathNotFoundException, PathMismatchException):
+            # The head predates the digest index (or was edited by hand), so
+            # rebuild it with an optimistic read-modify-write guarded by CAS.
+            return self._add_with_cas(doc_id, data)
+
+    def _create_category(self, user_id: str, category: str, values: list) -> tuple:
+        """
+        Create a category head, seeding it from the user's legacy document.
+
+        Args:
+            user_id (str): User ID to associate the data with
+            category (str): Category to create
+            values (list): First values to store
+
+        Returns:
+            tuple: (written, size) where written lists the values stored and size
+                is the number of items in the head
+        """
+        legacy = self._legacy_values(user_id, category)
+        items, hashes = unique_items(legacy + list(values))
+        try:
+            self.collection.insert(
+                self._doc_id(user_id, category),
+                {
+                    "items": [self.codec.encode(item) for item in items],
+                    "hashes": hashes,
+                    "size": len(items),
+                    "chunks": 0,
+                },
+            )
+        except DocumentExistsException:
+            # Another writer created the head first; append to theirs.
+            written, size = [], 0
+            for value in values:
+                saved, size = self._append(user_id, category, value)
+                if saved:
+                    written.append(value)
+            return written, size
+        return items[len(unique_items(legacy)[0]) :], len(items)
+
+    def _add_with_cas(self, doc_id: str, data: Union[str, dict]) -> tuple:
+        """
+        Append data with a CAS-guarded read-modify-write, retrying on conflicts.
+
+        Heads without a digest index get one rebuilt from their items on the
+        way, and the digests of their sealed chunks are added to the shards.
+
+        Args:
+            doc_id (str): Category head document to update
+            data (str | dict): Data to store
+
+        Returns:
+            tuple: (saved, size) where size is the number of items in the head
+        """
+        digest = content_digest(data)
+        last_error = None
+        for _ in range(self.max_cas_retries):
+            result = self.collection.get(doc_id)
+            head = result.content_as[dict]
+            items = head.get("items", [])
+            hashes = head.get("hashes")
+            if not isinstance(hashes, dict):
+                first = head.get("trimmed", 0) // self.chunk_size
+                try:
+                    sealed = self._read_chunks(doc_id, head.get("chunks", 0), first)
+                except DocumentNotFoundException as e:
+                    last_error = e
+                    continue
+                sealed = [content_digest(item) for item in sealed]
+                if digest in sealed:
+                    return False, len(items)
+                self._store_sealed_digests(doc_id, sealed)
+                hashes = {content_digest(item): 1 for item in self._decode(items)}
+            if digest in hashes:
+                return False, len(items)
+            hashes[digest] = 1
+            head.update(items=items + [self.codec.encode(data)], hashes=hashes, size=len(items) + 1)
+            try:
+                self.collection.replace(doc_id, head, ReplaceOptions(cas=result.cas))
+                return True, head["size"]
+            except CasMismatchException as e:
+                get_instrumentation().count("memory_retries_total", operation="append_cas")
+                last_error = e
+        raise last_error
+
+    def _seal_chunks(self, doc_id: str) -> None:
+        """
+        Move full runs of ``chunk_size`` items from a head into chunk documents.
+
+        Heads are append-only, so the leading ``chunk_size`` items are stable
+        while other writers append: concurrent sealers write identical chunk
+        documents and only the CAS winner resets the head. A chunk is
+        compressed as a whole, so its items share one compression window.
+
+        Digests in the head's ``hashes`` map whose items left the head (sealed
+        now, or trimmed) are written to the digest shards and marked ``2``;
+        marked ones were written by the previous seal and are dropped. The
+        head is only cut once every chunk and digest has been written: if a
+        write fails the head keeps its items and the next append that finds
+        it full seals it again.
+
+        Args:
+            doc_id (str): Category head document to seal
+        """
+        for _ in range(self.max_cas_retries):
+            result = self.collection.lookup_in(doc_id, [SD.get("items"), SD.get("chunks"), SD.get("hashes")])
+            items = result.content_as[list](0)
+            if len(items) < self.chunk_size:
+                return
+
+            chunks = result.content_as[int](1) if result.exists(1) else 0
+            hashes = result.content_as[dict](2) if result.exists(2) else None
+            sealed = {}
+            while len(items) >= self.chunk_size:
+                chunk = self._decode(items[: self.chunk_size])
+                sealed[self._chunk_id(doc_id, chunks)] = {"items": self.codec.encode(chunk)}
+                items = items[self.chunk_size :]
+                chunks += 1
+            specs = [
+                SD.upsert("items", items),
+                SD.upsert("size", len(items)),
+                SD.upsert("chunks", chunks),
+                SD.counter("epoch", 1),
+            ]
+            moving = []
+            if hashes is not None:
+                live = {content_digest(item) for item in self._decode(items)}
+                moving = [digest for digest, state in hashes.items() if state == 1 and digest not in live]
+                kept = {digest: 1 for digest in live if digest in hashes}
+                kept.update(dict.fromkeys(moving, 2))
+                specs.append(SD.upsert("hashes", kept))
+            try:
+                self._check_multi(self.collection.upsert_multi(sealed))
+                self._store_sealed_digests(doc_id, moving)
+            except CouchbaseException as e:
+                metrics = get_instrumentation()
+                metrics.count("memory_seal_errors_total")
+                metrics.log("ERROR", "memory.seal_failed", doc_id=doc_id, error=f"{type(e).__name__}: {e}")
+                return
+
+            try:
+                self.collection.mutate_in(doc_id, specs, MutateInOptions(cas=result.cas))
+                return
+            except CasMismatchException:
+                get_instrumentation().count("memory_retries_total", operation="seal_chunks")
+                continue
+
+    def _legacy_values(self, user_id: str, category: str) -> list:
+        """
+        Read one category from a user's legacy single-document memory.
+
+        Args:
+            user_id (str): User ID to read
+            category (str): Category to read
+
+        Returns:
+            list: Items stored under the category, empty if there are none
+        """
+        try:
+            result = self.collection.lookup_in(
+                self._legacy_doc_id(user_id), [SD.get(self._path(category))]
+            )
+        except DocumentNotFoundException:
+            return []
+        if not result.exists(0):
+            return []
+        values = result.content_as[list](0)
+        return values if isinstance(values, list) else [values]
+
+    def _read_chunks(self, doc_id: str, chunks: int, first: int = 0) -> list:
+        """
+        Fetch the sealed chunk documents of a category in order.
+
+        Args:
+            doc_id (str): Category head document
+            chunks (int): Number of sealed chunks to read up to (exclusive)
+            first (int): Index of the first chunk to read
+
+        Returns:
+            list: Items of the chunks read, oldest first
+
+        Raises:
+            DocumentNotFoundException: A chunk in the range is gone, because a
+                trim removed it after the head was read; re-read the head and retry
+        """
+        if first >= chunks:
+            return []
+        chunk_ids = [self._chunk_id(doc_id, index) for index in range(first, chunks)]
+        fetched = self._check_multi(self.collection.get_multi(chunk_ids), missing_ok=True)
+        items = []
+        for chunk_id in chunk_ids:
+            if chunk_id not in fetched:
+                raise DocumentNotFoundException(f"{chunk_id} was trimmed while it was read")
+            items.extend(self._decode(fetched[chunk_id].content_as[dict].get("items", [])))
+        return items
+
+    def read(self, user_id: str, category: str) -> list:
+        """
+        Read a category, fetching only its head items and sealed chunks.
+
+        Users that have not been migrated yet are served from their legacy
+        document. A chunk deleted by a concurrent trim means the head's
+        ``trimmed`` offset is out of date, so the head is read again.
+
+        Args:
+            user_id (str): User ID to read
+            category (str): Category to read
+
+        Returns:
+            list: Items stored under the category, oldest first
+        """
+        doc_id = self._doc_id(user_id, category)
+        last_error = None
+        for _ in range(self.max_cas_retries):
+            try:
+                head = self._lookup_head(doc_id)
+            except DocumentNotFoundException:
+                return self._legacy_values(user_id, category)
+            items, chunks, trimmed = self._head_fields(head)
+            first, skip = divmod(trimmed, self.chunk_size)
+            try:
+                return self._read_chunks(doc_id, chunks, first)[skip:] + self._decode(items)
+            except DocumentNotFoundException as e:
+                get_instrumentation().count("memory_retries_total", operation="read")
+                last_error = e
+        raise last_error
+
+    def read_many(self, keys: list) -> dict:
+        """
+        Read several categories with one multi-get of their heads and one of their chunks.
+
+        Heads are fetched without their digest index. Categories without a
+        head are served from their users' legacy documents, one multi-get for
+        all of them. Only a document that does not exist counts as absent; any
+        other failure raises, so callers never cache a partial result.
+
+        Args:
+            keys (list): (user_id, category) pairs to read; repeats are read once
+
+        Returns:
+            dict: Items of each category oldest first, keyed by (user_id, category)
+        """
+        doc_ids = {key: self._doc_id(*key) for key in dict.fromkeys(keys)}
+        heads = self._check_multi(
+            self.collection.get_multi(
+                list(doc_ids.values()), GetMultiOptions(project=["items", "chunks", "trimmed"])
+            ),
+            missing_ok=True,
+        )
+
+        results, plans, chunk_ids = {}, {}, []
+        for key, doc_id in doc_ids.items():
+            if doc_id not in heads:
+                continue
+            head = heads[doc_id].content_as[dict]
+            first, skip = divmod(head.get("trimmed", 0), self.chunk_size)
+            ids = [self._chunk_id(doc_id, index) for index in range(first, head.get("chunks", 0))]
+            plans[key] = (ids, skip, head.get("items", []))
+            chunk_ids.extend(ids)
+        chunks = {}
+        if chunk_ids:
+            chunks = self._check_multi(self.collection.get_multi(chunk_ids), missing_ok=True)
+        for key, (ids, skip, items) in plans.items():
+            if not all(chunk_id in chunks for chunk_id in ids):
+                # Trimmed after its head was read: read it again on its own.
+                results[key] = self.read(*key)
+                continue
+            stored = []
+            for chunk_id in ids:
+                stored.extend(self._decode(chunks[chunk_id].content_as[dict].get("items", [])))
+            results[key] = stored[skip:] + self._decode(items)
+
+        missing = [key for key in doc_ids if key not in results]
+        if missing:
+            legacy_ids = list(dict.fromkeys(self._legacy_doc_id(user_id) for user_id, _ in missing))
+            legacy = self._check_multi(self.collection.get_multi(legacy_ids), missing_ok=True)
+            for user_id, category in missing:
+                found = legacy.get(self._legacy_doc_id(user_id))
+                values = found.content_as[dict].get(category, []) if found else []
+                results[(user_id, category)] = values if isinstance(values, list) else [values]
+        return results
+
+    def _lookup_head(self, doc_id: str, hashes: bool = False):
+        """Fetch the fields of a category head that reads need, and its digest map if asked."""
+        specs = [SD.get("items"), SD.get("chunks"), SD.get("trimmed")]
+        if hashes:
+            specs.append(SD.get("hashes"))
+        return self.collection.lookup_in(doc_id, specs)
+
+    def _head_fields(self, head) -> tuple:
+        """Unpack a head lookup into (stored head items, sealed chunks, trimmed items)."""
+        items = head.content_as[list](0) if head.exists(0) else []
+        chunks = head.content_as[int](1) if head.exists(1) else 0
+        trimmed = head.content_as[int](2) if head.exists(2) else 0
+        return items, chunks, trimmed
+
+    def _slice(self, doc_id: str, head, offset: int, limit: int) -> tuple:
+        """
+        Read a slice of the live items of a category from a head lookup that holds its items.
+
+        Every sealed chunk holds exactly ``chunk_size`` items, so the chunks
+        covering a slice follow from the head's chunk and trimmed counts alone.
+
+        Returns:
+            tuple: (items in the slice oldest first, live items in the category)
+
+        Raises:
+            DocumentNotFoundException: A chunk of the slice was trimmed after the head was read
+        """
+        items, chunks, trimmed = self._head_fields(head)
+        sealed = chunks * self.chunk_size
+        total = sealed + len(items)
+        start = offset + trimmed
+        end = total if limit is None else min(start + limit, total)
+        if start >= end:
+            return [], total - trimmed
+
+        page = []
+        if start < sealed:
+            first = start // self.chunk_size
+            last = min(chunks, (end - 1) // self.chunk_size + 1)
+            page = self._read_chunks(doc_id, last, first)[start - first * self.chunk_size :]
+        if end > sealed:
+            page.extend(self._decode(items[max(start - sealed, 0) : end - sealed]))
+        return page[: end - start], total - trimmed
+
+    def _page(self, doc_id: str, offset: int, limit: int) -> tuple:
+        """
+        Read a slice of the live items of a category without fetching the whole head.
+
+        The head's item count, chunk and trimmed counts come first; the items
+        of the slice still in the head are then fetched by index, or as the
+        whole array when there are more than ``MAX_PAGE_PATHS`` of them.
+
+        Returns:
+            tuple: (items in the slice oldest first, live items in the category),
+                or None if a seal or trim moved the head's items in between
+
+        Raises:
+            DocumentNotFoundException: The head is gone, or a chunk of the
+                slice was trimmed after the head was read
+        """
+        layout = self.collection.lookup_in(
+            doc_id, [SD.count("items"), SD.get("chunks"), SD.get("trimmed"), SD.get("epoch")]
+        )
+        size, chunks, trimmed, epoch = (
+            layout.content_as[int](index) if layout.exists(index) else 0 for index in range(4)
+        )
+        sealed = chunks * self.chunk_size
+        total = sealed + size
+        start = offset + trimmed
+        end = total if limit is None else min(start + limit, total)
+        if start >= end:
+            return [], total - trimmed
+
+        page = []
+        if start < sealed:
+            first = start // self.chunk_size
+            last = min(chunks, (end - 1) // self.chunk_size + 1)
+            page = self._read_chunks(doc_id, last, first)[start - first * self.chunk_size :]
+        if end > sealed:
+            indices = range(max(start - sealed, 0), end - sealed)
+            by_index = len(indices) <= self.MAX_PAGE_PATHS
+            paths = [f"items[{index}]" for index in indices] if by_index else ["items"]
+            head = self.collection.lookup_in(doc_id, [SD.get("epoch")] + [SD.get(path) for path in paths])
+            # Checked first: after a seal the indices may point past the head's items.
+            if (head.content_as[int](0) if head.exists(0) else 0) != epoch:
+                return None
+            if by_index:
+                items = [head.content_as[_as_stored](position) for position in range(1, len(indices) + 1)]
+            else:
+                items = head.content_as[list](1)[indices.start : indices.stop]
+            page.extend(self.codec.decode(item) for item in items)
+        return page[: end - start], total - trimmed
+
+    def read_page(self, user_id: str, category: str, offset: int = 0, limit: int = None) -> tuple:
+        """
+        Read a slice of a category, fetching only the chunks and head items in it.
+
+        Args:
+            user_id (str): User ID to read
+            category (str): Category to read
+            offset (int): Number of leading items to skip
+            limit (int): Maximum number of items to return, None for all
+
+        Returns:
+            tuple: (items in the slice oldest first, total items in the category)
+        """
+        doc_id = self._doc_id(user_id, category)
+        for _ in range(self.max_cas_retries):
+            try:
+                page = self._page(doc_id, offset, limit)
+            except DocumentNotFoundException:
+                if not self.collection.exists(doc_id).exists:
+                    items = self._legacy_values(user_id, category)
+                    end = None if limit is None else offset + limit
+                    return items[offset:end], len(items)
+                page = None
+            if page is not None:
+                return page
+            get_instrumentation().count("memory_retries_total", operation="read_page")
+        raise CasMismatchException(f"{doc_id} kept changing while a page was read")
+
+    def trim(self, user_id: str, category: str, values: list, forget: bool = False) -> int:
+        """
+        Remove values from the front of a category.
+
+        Removed items that sit in sealed chunks are only counted in the head's
+        ``trimmed`` field, and a chunk document is deleted once all of its
+        items are gone. Items still in the head are cut from it. The head is
+        updated under CAS after checking that ``values`` still lead the
+        category. Their digests stay in the index, so storing a trimmed value
+        again is still rejected as a duplicate, unless ``forget`` is set: then
+        they are dropped from the head's map in the same mutation and from the
+        digest shards after it. A seal racing the trim may write one back.
+
+        Args:
+            user_id (str): User ID to trim
+            category (str): Category to trim
+            values (list): The values expected at the front of the category, oldest first
+            forget (bool): Drop the removed values' digests as well
+
+        Returns:
+            int: Number of values removed
+        """
+        doc_id = self._doc_id(user_id, category)
+        expected = [content_digest(value) for value in values]
+        change = None
+        for _ in range(self.max_cas_retries):
+            try:
+                head = self._lookup_head(doc_id, hashes=forget)
+            except DocumentNotFoundException:
+                break
+            try:
+                leading, _ = self._slice(doc_id, head, 0, len(expected))
+            except DocumentNotFoundException:
+                get_instrumentation().count("memory_retries_total", operation="trim")
+                continue
+            count = 0
+            for value, digest in zip(leading, expected):
+                if content_digest(value) != digest:
+                    break
+                count += 1
+            if not count:
+                break
+            if change is None:
+                change = self._journal_change(user_id, category, "trim", values)
+
+            items, chunks, trimmed = self._head_fields(head)
+            from_chunks = min(count, chunks * self.chunk_size - trimmed)
+            from_head = count - from_chunks
+            specs = [SD.upsert("trimmed", trimmed + from_chunks), SD.counter("epoch", 1)]
+            if from_head:
+                specs += [SD.upsert("items", items[from_head:]), SD.upsert("size", len(items) - from_head)]
+            forgotten = set(expected[:count]) if forget else set()
+            if forgotten and head.exists(3):
+                hashes = head.content_as[dict](3)
+                kept = {digest: state for digest, state in hashes.items() if digest not in forgotten}
+                specs.append(SD.upsert("hashes", kept))
+            try:
+                self.collection.mutate_in(doc_id, specs, MutateInOptions(cas=head.cas))
+            except CasMismatchException:
+                get_instrumentation().count("memory_retries_total", operation="trim")
+                continue
+            emptied = range(trimmed // self.chunk_size, (trimmed + from_chunks) // self.chunk_size)
+            if emptied:
+                self.collection.remove_multi([self._chunk_id(doc_id, index) for index in emptied])
+            if forgotten:
+                self._forget_sealed_digests(doc_id, expected[:count])
+            self._confirm_change(change, values[:count])
+            return count
+        self._confirm_change(change, [])
+        return 0
+
+    def _change_partition(self, user_id: str) -> int:
+        """Partition of the change log a user's changes are recorded in."""
+        return zlib.crc32(user_id.encode("utf-8")) % self.change_partitions
+
+    def _journal_change(self, user_id: str, category: str, op: str, values: list):
+        """
+        Record a mutation in the change log before it is made, if enabled.
+
+        The change is stored unconfirmed with every value the mutation may
+        write or remove. Failures raise, so a mutation is never made without
+        its change.
+
+        Args:
+            user_id (str): User whose category changes
+            category (str): Category that changes
+            op (str): "append" or "trim"
+            values (list): Values that may be appended or removed
+
+        Returns:
+            str: ID of the change document to confirm, None without a change log
+        """
+        if not self.change_log:
+            return None
+        partition = self._change_partition(user_id)
+        seq = self.collection.binary().increment(
+            f"changes::seq::{partition}", IncrementOptions(initial=SignedInt64(1))
+        ).content
+        change_id = f"changes::{partition}::{seq}"
+        self.collection.insert(
+            change_id,
+            {
+                "partition": partition,
+                "seq": seq,
+                "user_id": user_id,
+                "category": category,
+                "op": op,
+                "values": [self.codec.encode(value) for value in values],
+                "at": time.time(),
+                "writer": self.writer_id,
+                "unconfirmed": True,
+            },
+            InsertOptions(expiry=self.change_retention),
+        )
+        return change_id
+
+    def _confirm_change(self, change_id: str, values: list) -> None:
+        """
+        Confirm a journalled change with the values its mutation actually wrote or removed.
+
+        Args:
+            change_id (str): ID returned by ``_journal_change``, None without a change log
+            values (list): Values written or removed, empty if the mutation changed nothing
+        """
+        if change_id is None:
+            return
+        self.collection.mutate_in(
+            change_id,
+            [SD.upsert("values", [self.codec.encode(value) for value in values]), SD.remove("unconfirmed")],
+            MutateInOptions(preserve_expiry=True),
+        )
+
+    def last_change(self, partition: int = 0) -> int:
+        """
+        Return the newest sequence number taken in a partition of the change log.
+
+        Args:
+            partition (int): Partition of the change log
+
+        Returns:
+            int: The partition counter, 0 if no change was ever recorded in it
+        """
+        try:
+            return self.collection.get(f"changes::seq::{partition}").content_as[int]
+        except DocumentNotFoundException:
+            return 0
+
+    def read_changes(self, after: int = 0, limit: int = 500, partition: int = 0) -> list:
+        """
+        Read one partition of the change log after a sequence number.
+
+        Changes are fetched with one multi-get. A missing or unconfirmed
+        change is a write still in flight, so reading stops there. An
+        unconfirmed change that stays so for ``CHANGE_GAP_TIMEOUT`` seconds
+        lost its writer after the journal: its mutation may have been made,
+        so it is returned with every value it journalled. A change still
+        missing after that long (its writer died before journalling it, or
+        it expired) is skipped once a later change is stored.
+
+        Args:
+            after (int): Sequence number of the last change already seen in the partition
+            limit (int): Maximum number of changes returned
+            partition (int): Partition to read, below ``change_partitions``
+
+        Returns:
+            list: Changes in sequence order
+        """
+        last = min(self.last_change(partition), after + limit)
+        if last <= after:
+            return []
+        ids = {seq: f"changes::{partition}::{seq}" for seq in range(after + 1, last + 1)}
+        found = self._check_multi(self.collection.get_multi(list(ids.values())), missing_ok=True)
+        now = time.monotonic()
+        newest = 0
+        for seq, change_id in ids.items():
+            if change_id in found:
+                newest = seq
+            if change_id not in found or found[change_id].content_as[dict].get("unconfirmed"):
+                self._change_gaps.setdefault((partition, seq), now)
+        changes = []
+        metrics = get_instrumentation()
+        for seq, change_id in ids.items():
+            result = found.get(change_id)
+            change = result.content_as[dict] if result is not None else None
+            if change is None or change.pop("unconfirmed", False):
+                waited = now - self._change_gaps[(partition, seq)] >= self.CHANGE_GAP_TIMEOUT
+                if not waited or (change is None and seq > newest):
+                    break
+                if change is None:
+                    metrics.count("memory_change_gaps_total")
+                else:
+                    metrics.count("memory_changes_unconfirmed_total")
+            self._change_gaps.pop((partition, seq), None)
+            if change is not None:
+                change["values"] = [self.codec.decode(value) for value in change["values"]]
+                changes.append(change)
+        return changes
+
+    def load_checkpoint(self, name: str) -> list:
+        """
+        Return how far a change consumer has applied the change log.
+
+        Args:
+            name (str): Consumer name
+
+        Returns:
+            list: Last applied sequence number in each partition, 0s if it never ran
+        """
+        try:
+            seqs = self.collection.get(f"changes::checkpoint::{name}").content_as[dict].get("seqs", [])
+        except DocumentNotFoundException:
+            seqs = []
+        return (list(seqs) + [0] * self.change_partitions)[: self.change_partitions]
+
+    def save_checkpoint(self, name: str, seqs: list) -> None:
+        """
+        Record how far a change consumer has applied the change log.
+
+        Args:
+            name (str): Consumer name
+            seqs (list): Last applied sequence number in each partition
+        """
+        self.collection.upsert(f"changes::checkpoint::{name}", {"seqs": list(seqs), "at": time.time()})
+
+    def migrate_user(self, user_id: str, delete_legacy: bool = False) -> int:
+        """
+        Convert a user's legacy ``user::{user_id}`` document to the per-category layout.
+
+        Categories that already have a head document are left untouched, so
+        the migration can be re-run safely.
+
+        Args:
+            user_id (str): User ID to migrate
+            delete_legacy (bool): Remove the legacy document once migrated
+
+        Returns:
+            int: Number of categories migrated
+        """
+        legacy_id = self._legacy_doc_id(user_id)
+        try:
+            legacy = self.collection.get(legacy_id).content_as[dict]
+        except DocumentNotFoundException:
+            return 0
+
+        migrated = 0
+        for category, values in legacy.items():
+            doc_id = self._doc_id(user_id, category)
+            if self.collection.exists(doc_id).exists:
+                continue
+            if not isinstance(values, list):
+                values = [values]
+            values, hashes = unique_items(values)
+            digests = list(hashes)
+
+            chunks = len(values) // self.chunk_size
+            if chunks:
+                # A failed chunk write raises before the head is created, so
+                # the legacy document is kept and the migration can be re-run.
+                sealed = {
+                    self._chunk_id(doc_id, index): {
+                        "items": self.codec.encode(
+                            values[index * self.chunk_size : (index + 1) * self.chunk_size]
+                        )
+                    }
+                    for index in range(chunks)
+                }
+                self._check_multi(self.collection.upsert_multi(sealed))
+                self._store_sealed_digests(doc_id, digests[: chunks * self.chunk_size])
+            items = [self.codec.encode(value) for value in values[chunks * self.chunk_size :]]
+            hashes = dict.fromkeys(digests[chunks * self.chunk_size :], 1)
+            try:
+                self.collection.insert(
+                    doc_id,
+                    {"items": items, "hashes": hashes, "size": len(items), "chunks": chunks},
+                )
+                migrated += 1
+            except DocumentExistsException:
+                continue
+
+        if delete_legacy:
+            self.collection.remove(legacy_id)
+        get_instrumentation().log("INFO", "memory.migrated", user_id=user_id, categories=migrated)
+        return migrated
+
+
+class SQLiteBackend(MemoryBackend):
+    """
+    Embedded local storage in a single SQLite file running in WAL mode.
+
+    Needs no network, so single-node deployments, development runs and
+    benchmarks get sub-millisecond memory operations. Values are stored
+    JSON-encoded (compressed by ``codec`` when it pays) and duplicates are
+    rejected by a unique index on the content digest of each value.
+
+    With ``change_log`` every append and trim is also recorded in the
+    ``changes`` table, in the same transaction as the write. Trimmed values
+    leave their digest in the ``trimmed`` table, which appends check, so a
+    trimmed value is not stored again. A write that fails, e.g. because
+    another connection holds the database lock, is rolled back whole.
+    """
+
+    SCHEMA_VERSION = 1
+    # One ``changes`` table numbers every change, so the log has a single partition.
+    change_partitions = 1
+
+    # Inserts a row unless its digest is stored or was trimmed from the category.
+    INSERT_SQL = (
+        "INSERT OR IGNORE INTO memory (namespace, user_id, category, digest, value) "
+        "SELECT ?1, ?2, ?3, ?4, ?5 WHERE NOT EXISTS (SELECT 1 FROM trimmed "
+        "WHERE namespace = ?1 AND user_id = ?2 AND category = ?3 AND digest = ?4)"
+    )
+
+    def __init__(
+        self,
+        path: str = "memory.db",
+        namespace: str = "real_estate.memory",
+        codec: Codec = None,
+        change_log: bool = False,
+        change_retention: timedelta = timedelta(days=7),
+    ):
+        """
+        Open (and create if needed) a local memory store.
+
+        Args:
+            path (str): SQLite database file, or ":memory:" for a throwaway store
+            namespace (str): Keeps scopes/collections sharing one file apart
+            codec (Codec): Compresses stored values; uncompressed rows are read as they are
+            change_log (bool): Record appends and trims in the change log
+            change_retention (timedelta): How long recorded changes are kept
+        """
+        self.path = path
+        self.namespace = namespace
+        self.codec = codec or Codec()
+        self.change_log = change_log
+        self.change_retention = change_retention
+        self.writer_id = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+        get_instrumentation().log("INFO", "memory.store_opened", path=path)
+
+    @contextmanager
+    def _transaction(self, mode: str = "DEFERRED"):
+        """
+        Run the body in one transaction, committed if it returns and rolled back if it raises.
+
+        Callers hold ``_lock``. A failed ``BEGIN`` leaves no transaction open,
+        and a failed ``COMMIT`` (e.g. ``database is locked``) is rolled back,
+        so the connection is always usable for the next write.
+
+        Args:
+            mode (str): "DEFERRED", or "IMMEDIATE" to take the write lock up front
+        """
+        self._conn.execute(f"BEGIN {mode}")
+        try:
+            yield
+            self._conn.execute("COMMIT")
+        except BaseException:
+            if self._conn.in_transaction:
+                self._conn.execute("ROLLBACK")
+            raise
+
+    def _create_schema(self) -> None:
+        """Create the tables of a new store."""
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] >= self.SCHEMA_VERSION:
+            return
+        with self._lock, self._transaction("IMMEDIATE"):
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS memory (
+                    id INTEGER PRIMARY KEY,
+                    namespace TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    UNIQUE (namespace, user_id, category, digest)
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS memory_category ON memory (namespace, user_id, category, id)"
+            )
+            # Digests trimmed from each category, so trimmed values are not stored again.
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS trimmed (
+                    namespace TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    PRIMARY KEY (namespace, user_id, category, digest)
+                ) WITHOUT ROWID
+                """
+            )
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS changes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    namespace TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    op TEXT NOT NULL,
+                    change_values TEXT NOT NULL,
+                    at REAL NOT NULL,
+                    writer TEXT
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS changes_namespace ON changes (namespace, seq)")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS change_checkpoints (
+                    namespace TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    PRIMARY KEY (namespace, name)
+                )
+                """
+            )
+            self._conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+    # The change log drops expired rows every this many recorded changes.
+    CHANGE_PRUNE_INTERVAL = 1000
+
+    def _record_change(self, user_id: str, category: str, op: str, encoded: list) -> None:
+        """Record a mutation inside the caller's transaction, if the change log is enabled."""
+        if not self.change_log:
+            return
+        now = time.time()
+        seq = self._conn.execute(
+            "INSERT INTO changes (namespace, user_id, category, op, change_values, at, writer) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (self.namespace, user_id, category, op, "[" + ",".join(encoded) + "]", now, self.writer_id),
+        ).lastrowid
+        if seq % self.CHANGE_PRUNE_INTERVAL == 0:
+            self._conn.execute(
+                "DELETE FROM changes WHERE at < ?", (now - self.change_retention.total_seconds(),)
+            )
+
+    def append(self, user_id: str, category: str, data: Union[str, dict]) -> bool:
+        encoded = json.dumps(self.codec.encode(data))
+        with self._lock, self._transaction():
+            cursor = self._conn.execute(
+                self.INSERT_SQL, (self.namespace, user_id, category, content_digest(data), encoded)
+            )
+            if cursor.rowcount == 1:
+                self._record_change(user_id, category, "append", [encoded])
+        return cursor.rowcount == 1
+
+    def append_many(self, user_id: str, category: str, values: list) -> int:
+        rows = [
+            (self.namespace, user_id, category, content_digest(value), json.dumps(self.codec.encode(value)))
+            for value in values
+        ]
+        # Taking the write lock up front keeps other writers out between MAX(id) and the insert.
+        with self._lock, self._transaction("IMMEDIATE" if self.change_log else "DEFERRED"):
+            before = self._conn.total_changes
+            if self.change_log:
+                last_id = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM memory").fetchone()[0]
+            self._conn.executemany(self.INSERT_SQL, rows)
+            saved = self._conn.total_changes - before
+            if saved and self.change_log:
+                # New rows take ids above the previous maximum; duplicates were ignored.
+                written = self._conn.execute(
+                    "SELECT value FROM memory "
+                    "WHERE namespace = ? AND user_id = ? AND category = ? AND id > ? ORDER BY id",
+                    (self.namespace, user_id, category, last_id),
+                ).fetchall()
+                self._record_change(user_id, category, "append", [row[0] for row in written])
+        return saved
+
+    def read(self, user_id: str, category: str) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT value FROM memory "
+                "WHERE namespace = ? AND user_id = ? AND category = ? ORDER BY id",
+                (self.namespace, user_id, category),
+            ).fetchall()
+        return [self.codec.decode(json.loads(row[0])) for row in rows]
+
+    # Row-value IN lists are sent in slices to stay under SQLite's variable limit.
+    READ_MANY_SLICE = 400
+
+    def read_many(self, keys: list) -> dict:
+        keys = list(dict.fromkeys(keys))
+        results = {key: [] for key in keys}
+        with self._lock:
+            for start in range(0, len(keys), self.READ_MANY_SLICE):
+                batch = keys[start : start + self.READ_MANY_SLICE]
+                rows = self._conn.execute(
+                    "SELECT user_id, category, value FROM memory "
+                    "WHERE namespace = ? AND (user_id, category) IN "
+                    f"(VALUES {', '.join('(?, ?)' for _ in batch)}) ORDER BY id",
+                    [self.namespace] + [part for key in batch for part in key],
+                ).fetchall()
+                for user_id, category, value in rows:
+                    results[(user_id, category)].append(self.codec.decode(json.loads(value)))
+        return results
+
+    def read_page(self, user_id: str, category: str, offset: int = 0, limit: int = None) -> tuple:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT value FROM memory "
+                "WHERE namespace = ? AND user_id = ? AND category = ? ORDER BY id LIMIT ? OFFSET ?",
+                (self.namespace, user_id, category, -1 if limit is None else limit, offset),
+            ).fetchall()
+            total = self._conn.execute(
+                "SELECT COUNT(*) FROM memory WHERE namespace = ? AND user_id = ? AND category = ?",
+                (self.namespace, user_id, category),
+            ).fetchone()[0]
+        return [self.codec.decode(json.loads(row[0])) for row in rows], total
+
+    def trim(self, user_id: str, category: str, values: list, forget: bool = False) -> int:
+        expected = [content_digest(value) for value in values]
+        with self._lock, self._transaction("IMMEDIATE"):
+            rows = self._conn.execute(
+                "SELECT id, digest FROM memory "
+                "WHERE namespace = ? AND user_id = ? AND category = ? ORDER BY id LIMIT ?",
+                (self.namespace, user_id, category, len(expected)),
+            ).fetchall()
+            last, count = None, 0
+            for (row_id, digest), wanted in zip(rows, expected):
+                if digest != wanted:
+                    break
+                last, count = row_id, count + 1
+            if count:
+                if not forget:
+                    self._conn.execute(
+                        "INSERT OR IGNORE INTO trimmed (namespace, user_id, category, digest) "
+                        "SELECT namespace, user_id, category, digest FROM memory "
+                        "WHERE namespace = ? AND user_id = ? AND category = ? AND id <= ?",
+                        (self.namespace, user_id, category, last),
+                    )
+                self._conn.execute(
+                    "DELETE FROM memory WHERE namespace = ? AND user_id = ? AND category = ? AND id <= ?",
+                    (self.namespace, user_id, category, last),
+                )
+                self._record_change(
+                    user_id, category, "trim", [json.dumps(self.codec.encode(value)) for value in values[:count]]
+                )
+        return count
+
+    def _check_partition(self, partition: int) -> None:
+        if partition != 0:
+            raise ValueError(f"{type(self).__name__} has a single change partition, not {partition}")
+
+    def read_changes(self, after: int = 0, limit: int = 500, partition: int = 0) -> list:
+        self._check_partition(partition)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, user_id, category, op, change_values, at, writer FROM changes "
+                "WHERE namespace = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (self.namespace, after, limit),
+            ).fetchall()
+        return [
+            {
+                "partition": 0,
+                "seq": seq,
+                "user_id": user_id,
+                "category": category,
+                "op": op,
+                "values": [self.codec.decode(value) for value in json.loads(values)],
+                "at": at,
+                "writer": writer,
+            }
+            for seq, user_id, category, op, values, at, writer in rows
+        ]
+
+    def last_change(self, partition: int = 0) -> int:
+        self._check_partition(partition)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MAX(seq) FROM changes WHERE namespace = ?", (self.namespace,)
+            ).fetchone()
+        return row[0] or 0
+
+    def load_checkpoint(self, name: str) -> list:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT seq FROM change_checkpoints WHERE namespace = ? AND name = ?", (self.namespace, name)
+            ).fetchone()
+        return [row[0] if row else 0]
+
+    def save_checkpoint(self, name: str, seqs: list) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO change_checkpoints (namespace, name, seq) VALUES (?, ?, ?) "
+                "ON CONFLICT (namespace, name) DO UPDATE SET seq = excluded.seq",
+                (self.namespace, name, seqs[0]),
+            )
+
+
+def create_backend(
+    backend_type: str,
+    conn_str: str = None,
+    username: str = None,
+    password: str = None,
+    bucket_name: str = None,
+    scope_name: str = "real_estate",
+    collection_name: str = "memory",
+    sqlite_path: str = "memory.db",
+    codec: Codec = None,
+    change_log: bool = False,
+    **options,
+) -> MemoryBackend:
+    """
+    Build a storage backend by name.
+
+    Args:
+        backend_type (str): "couchbase" or "sqlite"
+        conn_str (str): Connection string to Couchbase
+        username (str): Username for authentication
+        password (str): Password for authentication
+        bucket_name (str): Name of the bucket to use
+        scope_name (str): Scope name for the memory system
+        collection_name (str): Collection name for the memory system
+        sqlite_path (str): Database file used by the SQLite backend
+        codec (Codec): Compression applied to stored values, none by default
+        change_log (bool): Record appends and trims in the backend's change log
+        **options: Couchbase-only settings (chunk_size, max_cas_retries)
+
+    Returns:
+        MemoryBackend: The configured backend
+    """
+    if backend_type == "couchbase":
+        return CouchbaseBackend(
+            conn_str,
+            username,
+            password,
+            bucket_name,
+            scope_name=scope_name,
+            collection_name=collection_name,
+            codec=codec,
+            change_log=change_log,
+            **options,
+        )
+    if backend_type == "sqlite":
+        return SQLiteBackend(
+            sqlite_path, namespace=f"{scope_name}.{collection_name}", codec=codec, change_log=change_log
+        )
+    raise ValueError(f"Unknown memory backend '{backend_type}'")
@@ -0,0 +1,16 @@
+import io
+
+import pytest
+
+import instrumentation
+from instrumentation import Telemetry, set_instrumentation
+
+
+@pytest.fixture
+def telemetry():
+    """Record counters and log lines for the duration of a test."""
+    previous = instrumentation._instrumentation
+    recorder = Telemetry(log_level="DEBUG", stream=io.StringIO())
+    set_instrumentation(recorder)
+    yield recorder
+    instrumentation._instrumentation = previous
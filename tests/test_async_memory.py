@@ -0,0 +1,111 @@
+"""AsyncCouchbaseMemory running storage calls off the event loop."""
+import asyncio
+import contextvars
+import threading
+
+import pytest
+
+from memory import AsyncCouchbaseMemory, CouchbaseMemory
+from storage import SQLiteBackend
+
+REQUEST_USER = contextvars.ContextVar("request_user", default=None)
+
+
+@pytest.fixture
+def memory(tmp_path):
+    async_memory = AsyncCouchbaseMemory(CouchbaseMemory(backend=SQLiteBackend(str(tmp_path / "memory.db"))))
+    yield async_memory
+    async_memory.close()
+
+
+def test_calls_round_trip_through_the_pool(memory):
+    async def run():
+        assert await memory.add("alice", "notes", "one")
+        assert await memory.add_many("alice", "notes", ["one", "two", "three"]) == 2
+        assert await memory.search_page("alice", "notes", 1, 1) == (["two"], 3)
+        assert await memory.trim("alice", "notes", ["one"]) == 1
+        return await memory.search_by_category("alice", "notes")
+
+    assert asyncio.run(run()) == ["two", "three"]
+
+
+def test_blocking_calls_overlap_and_see_the_callers_context(memory):
+    both_running = threading.Barrier(2, timeout=5)
+
+    def handler():
+        both_running.wait()
+        return REQUEST_USER.get(), threading.current_thread().name
+
+    async def request(user_id: str):
+        REQUEST_USER.set(user_id)
+        return await memory.run(handler)
+
+    async def run():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0)
+
+        ticker = asyncio.ensure_future(tick())
+        results = await asyncio.gather(request("alice"), request("bob"))
+        ticker.cancel()
+        return results, ticks
+
+    results, ticks = asyncio.run(run())
+    assert [user_id for user_id, _ in results] == ["alice", "bob"]
+    assert all(thread.startswith("memory") for _, thread in results)
+    assert ticks > 0
+    assert REQUEST_USER.get() is None
+
+
+def test_iter_many_yields_cached_categories_first(memory):
+    memory.memory.add_many("alice", "notes", ["a1"])
+    memory.memory.add_many("bob", "notes", ["b1"])
+    memory.memory.add_many("carol", "notes", ["c1"])
+    memory.memory.search_by_category("carol", "notes")
+    keys = [("alice", "notes"), ("bob", "notes"), ("carol", "notes"), ("alice", "notes"), ("dan", "notes")]
+
+    async def run():
+        seen = [key async for key, _ in memory.iter_many(keys, batch_size=1, concurrency=2)]
+        return seen, await memory.search_many(keys, batch_size=2)
+
+    seen, found = asyncio.run(run())
+    assert seen[0] == ("carol", "notes")
+    assert sorted(seen) == sorted(set(keys))
+    assert found == {
+        ("alice", "notes"): ["a1"], ("bob", "notes"): ["b1"], ("carol", "notes"): ["c1"], ("dan", "notes"): []
+    }
+
+
+def test_stopping_early_leaves_the_remaining_batches_unread(memory, monkeypatch):
+    keys = [(f"user{index}", "notes") for index in range(6)]
+    backend = memory.memory.backend
+    reads = []
+
+    def read_many(batch):
+        reads.append(batch)
+        return SQLiteBackend.read_many(backend, batch)
+
+    monkeypatch.setattr(backend, "read_many", read_many)
+
+    async def run():
+        async for key, items in memory.iter_many(keys, batch_size=1, concurrency=2):
+            return key, items
+
+    key, items = asyncio.run(run())
+    memory.close()
+    assert key in keys and items == []
+    assert len(reads) <= 3
+
+
+def test_turn_flushes_buffered_writes_before_returning(memory):
+    async def run():
+        async with memory.turn():
+            await memory.add("alice", "notes", "buffered")
+            assert memory.memory.backend.read("alice", "notes") == []
+        return memory.memory.backend.read("alice", "notes")
+
+    assert asyncio.run(run()) == ["buffered"]
@@ -0,0 +1,101 @@
+"""MemoryCache eviction, expiry and the guard against caching reads that raced a write."""
+import pytest
+
+from memory import CouchbaseMemory, MemoryCache
+from storage import SQLiteBackend
+
+ALICE = ("alice", "notes")
+
+
+@pytest.fixture
+def memory(tmp_path):
+    return CouchbaseMemory(backend=SQLiteBackend(str(tmp_path / "memory.db")))
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = MemoryCache(max_entries=2)
+    cache.put(("alice", "a"), [1])
+    cache.put(("alice", "b"), [2])
+    assert cache.get(("alice", "a")) == [1]
+    cache.put(("alice", "c"), [3])
+    assert cache.get(("alice", "b")) is None
+    assert cache.get(("alice", "a")) == [1] and cache.get(("alice", "c")) == [3]
+    assert cache.stats() == {"hits": 3, "misses": 1, "entries": 2}
+
+
+def test_entries_expire_after_their_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("memory.time.monotonic", lambda: now[0])
+    cache = MemoryCache(ttl=5.0)
+    cache.put(ALICE, ["one"])
+    now[0] += 4.9
+    assert cache.get(ALICE) == ["one"]
+    now[0] += 0.2
+    assert cache.get(ALICE) is None
+
+
+def test_returned_items_are_copies():
+    cache = MemoryCache()
+    cache.put(ALICE, ["one"])
+    cache.get(ALICE).append("changed")
+    assert cache.get(ALICE) == ["one"]
+
+
+def test_a_read_that_raced_a_write_is_not_cached():
+    cache = MemoryCache()
+    generation = cache.generation()
+    # The read fetched ["one"]; an append lands before it is cached.
+    cache.append(ALICE, "two")
+    cache.put(ALICE, ["one"], generation)
+    assert cache.get(ALICE) is None
+    cache.put(("bob", "notes"), ["bob's"], generation)
+    assert cache.get(("bob", "notes")) == ["bob's"]
+
+
+def test_writes_forgotten_from_the_guard_still_block_older_reads():
+    cache = MemoryCache(max_entries=1)
+    generation = cache.generation()
+    for index in range(300):
+        cache.invalidate(("alice", f"category {index}"))
+    cache.put(("alice", "category 0"), ["stale"], generation)
+    assert cache.get(("alice", "category 0")) is None
+    cache.clear()
+    cache.put(("alice", "category 0"), ["fresh"], cache.generation())
+    assert cache.get(("alice", "category 0")) == ["fresh"]
+
+
+def test_memory_writes_go_through_the_cache(memory):
+    memory.add("alice", "notes", "one")
+    assert memory.search_by_category(*ALICE) == ["one"]
+    memory.add("alice", "notes", "two")
+    assert memory.search_by_category(*ALICE) == ["one", "two"]
+    assert memory.cache.stats()["hits"] == 1
+
+    memory.add_many("alice", "notes", ["three"])
+    assert memory.cache.get(ALICE) is None
+    assert memory.search_by_category(*ALICE) == ["one", "two", "three"]
+    memory.trim("alice", "notes", ["one"])
+    assert memory.search_by_category(*ALICE) == ["two", "three"]
+
+
+def test_a_read_racing_an_add_does_not_cache_the_old_contents(memory, monkeypatch):
+    memory.add("alice", "notes", "one")
+    read = memory.backend.read
+
+    def read_racing_an_add(user_id, category):
+        items = read(user_id, category)
+        memory.backend.append(user_id, category, "two")
+        memory.cache.append((user_id, category), "two")
+        return items
+
+    monkeypatch.setattr(memory.backend, "read", read_racing_an_add)
+    assert memory.search_by_category(*ALICE) == ["one"]
+    monkeypatch.undo()
+    assert memory.search_by_category(*ALICE) == ["one", "two"]
+
+
+def test_a_disabled_cache_stores_nothing(tmp_path):
+    memory = CouchbaseMemory(backend=SQLiteBackend(str(tmp_path / "memory.db")), cache_size=0)
+    memory.add("alice", "notes", "one")
+    memory.search_by_category(*ALICE)
+    assert memory.cache.stats()["entries"] == 0
@@ -0,0 +1,101 @@
+"""PropertyCatalogue profiles and search."""
+import pytest
+
+from catalogue import PropertyCatalogue, extract_profile, load_catalogue, parse_budget
+
+
+@pytest.fixture
+def catalogue():
+    return PropertyCatalogue(
+        {
+            "id": ["a", "b", "c", "d"],
+            "location": ["Lisbon, Alfama", "Lisbon", "Porto", "Faro"],
+            "price": ["300000", "450000", "250000", "not listed"],
+            "type": ["apartment", "house", "apartment", "house"],
+            "rooms": ["2", "3", "1", "4"],
+            "features": ["pool;garden", "garage", "pool", ""],
+        }
+    )
+
+
+def test_profiles_are_cached_until_invalidated(catalogue):
+    profile = catalogue.build_profile("alice", ["I want a pool"], catalogue.generation())
+    assert catalogue.cached_profile("alice") is profile
+    catalogue.invalidate("alice")
+    assert catalogue.cached_profile("alice") is None
+
+
+def test_a_profile_built_across_an_invalidation_is_not_cached(catalogue):
+    generation = catalogue.generation()
+    # The preferences are read here; a save invalidates the user before the profile is built.
+    catalogue.invalidate("alice")
+    catalogue.build_profile("alice", ["I want a pool"], generation)
+    assert catalogue.cached_profile("alice") is None
+
+    catalogue.invalidate("bob")
+    catalogue.build_profile("alice", ["I want a garden"], catalogue.generation())
+    assert catalogue.cached_profile("alice")["features"] == ["garden"]
+
+
+def ids(catalogue, rows: list) -> list:
+    return [catalogue.listing(row)["id"] for row in rows]
+
+
+def test_listings_without_a_price_are_skipped(catalogue):
+    assert len(catalogue) == 3 and catalogue.skipped == 1
+    assert catalogue.listing(0) == {
+        "id": "a", "type": "apartment", "location": "Lisbon, Alfama", "price": 300000, "rooms": 2,
+        "features": ["garden", "pool"],
+    }
+    with pytest.raises(ValueError, match="price"):
+        PropertyCatalogue({"location": ["Lisbon"]})
+
+
+def test_search_filters_by_budget_location_and_features(catalogue):
+    assert ids(catalogue, catalogue.search()) == ["c", "a", "b"]
+    assert ids(catalogue, catalogue.search(max_price=300000)) == ["c", "a"]
+    assert ids(catalogue, catalogue.search(min_price=260000, max_price=450000)) == ["a", "b"]
+    assert ids(catalogue, catalogue.search("lisbon")) == ["a", "b"]
+    assert ids(catalogue, catalogue.search("Alfama")) == ["a"]
+    assert catalogue.search("Lis") == []
+    assert catalogue.location_bitmap("Faro") is None
+    assert ids(catalogue, catalogue.search(required=["Pool"])) == ["c", "a"]
+    assert catalogue.search(required=["sauna"]) == []
+    assert ids(catalogue, catalogue.search(limit=2)) == ["c", "a"]
+
+
+def test_search_ranks_by_the_preference_profile(catalogue):
+    profile = catalogue.build_profile("alice", ["A house please", "three bedrooms with a garage"])
+    assert (profile["type"], profile["rooms"], profile["features"]) == ("house", 3, ["garage"])
+    assert ids(catalogue, catalogue.search(profile=profile)) == ["b", "a", "c"]
+    garden = catalogue.build_profile("bob", ["a flat with a garden"])
+    assert ids(catalogue, catalogue.search("Lisbon", profile=garden, limit=1)) == ["a"]
+
+
+def test_preferences_are_extracted_with_later_ones_winning():
+    profile = extract_profile(
+        ["A villa with a pool", "Actually a T2 flat", "for rental income", "two-bedroom, gardens"]
+    )
+    assert profile == {"type": "apartment", "rooms": 2, "investment_type": "rental", "features": ["pool", "garden"]}
+    assert extract_profile([]) == {"type": None, "rooms": None, "investment_type": "residential", "features": []}
+    assert extract_profile(["an investment property"])["investment_type"] == "investment"
+
+
+def test_budgets_are_read_in_common_forms():
+    assert parse_budget("400000") == 400000
+    assert parse_budget("400,000 EUR") == 400000
+    assert parse_budget("€400k") == 400000
+    assert parse_budget("1.2M") == 1200000
+    assert parse_budget(350000) == 350000
+    with pytest.raises(ValueError):
+        parse_budget("flexible")
+
+
+def test_catalogues_load_from_csv(tmp_path):
+    path = tmp_path / "listings.csv"
+    path.write_text("ID,Location,Price,Rental Yield,Features\nx,Porto,200000,5.5,Sea_View|pool\n", encoding="utf-8")
+    catalogue = load_catalogue(str(path))
+    assert catalogue.listing(0) == {
+        "id": "x", "type": None, "location": "Porto", "price": 200000, "rental_yield": 5.5,
+        "features": ["pool", "sea view"],
+    }
@@ -0,0 +1,131 @@
+"""ChangeFeed positions, checkpoints and consumers over the SQLite and Couchbase change logs."""
+import pytest
+
+from changes import CacheInvalidator, CallbackConsumer, ChangeFeed
+from fake_collection import FakeClusterRegistry
+from memory import CouchbaseMemory
+from storage import CouchbaseBackend, SQLiteBackend
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "memory.db")
+
+
+def sqlite_memory(path: str) -> CouchbaseMemory:
+    return CouchbaseMemory(backend=SQLiteBackend(path, change_log=True))
+
+
+def recorder(name: str, durable: bool = True, categories: tuple = None) -> CallbackConsumer:
+    seen = []
+    consumer = CallbackConsumer(
+        name, lambda change: seen.append((change["user_id"], change["op"], change["values"])), categories, durable
+    )
+    consumer.seen = seen
+    return consumer
+
+
+def test_durable_consumers_resume_from_their_checkpoint(path):
+    memory = sqlite_memory(path)
+    memory.add("alice", "notes", "one")
+    consumer = recorder("digest")
+    assert ChangeFeed(memory, [consumer]).catch_up() == 1
+    assert consumer.seen == [("alice", "append", ["one"])]
+
+    memory.add("alice", "notes", "one")
+    memory.add_many("bob", "notes", ["two", "three"])
+    memory.trim("alice", "notes", ["one"])
+    restarted = recorder("digest")
+    assert ChangeFeed(sqlite_memory(path), [restarted]).catch_up() == 2
+    assert restarted.seen == [("bob", "append", ["two", "three"]), ("alice", "trim", ["one"])]
+    assert memory.backend.load_checkpoint("digest") == [memory.backend.last_change()]
+
+
+def test_in_process_consumers_start_at_the_newest_change(path):
+    memory = sqlite_memory(path)
+    memory.add("alice", "notes", "before")
+    consumer = recorder("live", durable=False, categories=("notes",))
+    feed = ChangeFeed(memory, [consumer])
+    assert feed.poll() == 0
+
+    memory.add("alice", "tasks", "ignored")
+    memory.add("alice", "notes", "after")
+    feed.catch_up()
+    assert consumer.seen == [("alice", "append", ["after"])]
+    assert memory.backend.load_checkpoint("live") == [0]
+
+
+def test_a_failing_consumer_is_retried_without_holding_back_the_others(path):
+    memory = sqlite_memory(path)
+    failures = []
+
+    def flaky(change):
+        if not failures:
+            failures.append(change["seq"])
+            raise RuntimeError("index unavailable")
+
+    healthy = recorder("healthy")
+    feed = ChangeFeed(memory, [CallbackConsumer("flaky", flaky, durable=True), healthy], batch_size=10)
+    memory.add_many("alice", "notes", ["one"])
+    memory.add_many("alice", "notes", ["two"])
+    feed.poll()
+    assert len(healthy.seen) == 2
+    assert memory.backend.load_checkpoint("flaky") == [0]
+
+    feed.poll()
+    assert memory.backend.load_checkpoint("flaky") == [memory.backend.last_change()]
+
+
+def test_large_backlogs_are_read_in_batches(path):
+    memory = sqlite_memory(path)
+    for index in range(7):
+        memory.add("alice", "notes", f"value {index}")
+    consumer = recorder("batched")
+    feed = ChangeFeed(memory, [consumer], batch_size=3)
+    assert feed.catch_up() == 7
+    assert [values for _, _, values in consumer.seen] == [[f"value {index}"] for index in range(7)]
+
+
+def test_cache_invalidator_only_drops_other_processes_writes(path):
+    memory, other = sqlite_memory(path), sqlite_memory(path)
+    memory.add("alice", "notes", "one")
+    feed = ChangeFeed(memory, [CacheInvalidator(memory)])
+    feed.poll()
+    assert memory.search_by_category("alice", "notes") == ["one"]
+
+    memory.add("alice", "notes", "mine")
+    feed.catch_up()
+    hits = memory.cache.hits
+    assert memory.search_by_category("alice", "notes") == ["one", "mine"]
+    assert memory.cache.hits == hits + 1
+
+    other.add("alice", "notes", "theirs")
+    assert memory.search_by_category("alice", "notes") == ["one", "mine"]
+    feed.catch_up()
+    assert memory.search_by_category("alice", "notes") == ["one", "mine", "theirs"]
+
+
+def test_positions_are_kept_per_partition():
+    backend = CouchbaseBackend(None, None, None, "test", registry=FakeClusterRegistry(), change_log=True)
+    memory = CouchbaseMemory(backend=backend)
+    users = [f"user{index}" for index in range(12)]
+    partitions = {backend._change_partition(user_id) for user_id in users}
+    assert len(partitions) > 1
+
+    consumer = recorder("digest")
+    for user_id in users:
+        memory.add(user_id, "notes", f"{user_id} note")
+        memory.add(user_id, "notes", f"{user_id} second")
+    assert ChangeFeed(memory, [consumer]).catch_up() == 2 * len(users)
+    for user_id in users:
+        # A user's changes stay in order across partitions.
+        assert [values for seen_user, _, values in consumer.seen if seen_user == user_id] == [
+            [f"{user_id} note"], [f"{user_id} second"]
+        ]
+
+    checkpoint = backend.load_checkpoint("digest")
+    assert len(checkpoint) == backend.change_partitions
+    assert checkpoint == [backend.last_change(partition) for partition in range(backend.change_partitions)]
+    assert {change["partition"] for change in backend.read_changes(0, partition=min(partitions))} == {
+        min(partitions)
+    }
@@ -0,0 +1,120 @@
+"""Codec envelopes, shared dictionaries and compressed storage."""
+import base64
+import hashlib
+import json
+
+import pytest
+
+from compression import (
+    MARKER,
+    Codec,
+    codec_from_env,
+    dictionary_id,
+    load_dictionaries,
+    train_dictionary,
+)
+from fake_collection import FakeClusterRegistry
+from storage import CouchbaseBackend
+
+EMAIL = {
+    "from": "agent@example.com",
+    "to": "alice@example.com",
+    "subject": "Viewing confirmation",
+    "body": "Thanks for your interest in the flat on Main Street. " * 10,
+}
+
+
+def emails(count: int) -> list:
+    return [
+        {**EMAIL, "subject": f"Viewing {index}", "body": f"Slot {index}. " + EMAIL["body"]} for index in range(count)
+    ]
+
+
+def size(value) -> int:
+    return len(json.dumps(value, separators=(",", ":")))
+
+
+def test_large_values_are_stored_in_envelopes():
+    codec = Codec("zlib")
+    envelope = codec.encode(EMAIL)
+    assert envelope[MARKER] == 1 and envelope["codec"] == "zlib" and "dict" not in envelope
+    assert size(envelope) < size(EMAIL)
+    assert codec.decode(envelope) == EMAIL
+    assert Codec().decode(envelope) == EMAIL
+
+
+def test_values_that_do_not_pay_are_stored_as_is():
+    assert Codec().encode(EMAIL) is EMAIL
+    assert Codec("zlib").encode("short") == "short"
+    noise = base64.b64encode(b"".join(hashlib.sha512(bytes([index])).digest() for index in range(8))).decode()
+    assert Codec("zlib", min_size=0).encode(noise) == noise
+    assert Codec("zlib").decode({"from": "legacy"}) == {"from": "legacy"}
+    assert Codec("zlib").decode(["a", "b"]) == ["a", "b"]
+
+
+def test_newer_envelopes_and_unknown_settings_are_rejected():
+    envelope = {**Codec("zlib").encode(EMAIL), MARKER: 2}
+    with pytest.raises(ValueError, match="newer"):
+        Codec("zlib").decode(envelope)
+    with pytest.raises(ValueError, match="Unknown"):
+        Codec("lz4")
+    with pytest.raises(ValueError, match="not loaded"):
+        Codec("zlib", dictionary="missing")
+
+
+def test_dictionaries_shrink_small_values_and_are_needed_to_read_them():
+    dictionary = train_dictionary(emails(20))
+    assert len(dictionary) <= 32768
+    name = dictionary_id(dictionary)
+    shared = Codec("zlib", min_size=0, dictionaries={name: dictionary}, dictionary=name)
+    value = emails(21)[-1]
+    envelope = shared.encode(value)
+    assert envelope["dict"] == name
+    assert size(envelope) < size(Codec("zlib", min_size=0).encode(value))
+    assert Codec(dictionaries={name: dictionary}).decode(envelope) == value
+    with pytest.raises(ValueError, match="needed"):
+        Codec().decode(envelope)
+
+
+def test_dictionaries_are_loaded_from_the_environment(tmp_path, monkeypatch):
+    dictionary = train_dictionary(emails(5))
+    name = dictionary_id(dictionary)
+    (tmp_path / f"{name}.dict").write_bytes(dictionary)
+    (tmp_path / "old.dict").write_bytes(b"older dictionary")
+    assert load_dictionaries(str(tmp_path)) == {name: dictionary, "old": b"older dictionary"}
+
+    monkeypatch.setenv("MEMORY_COMPRESSION", "ZLIB")
+    monkeypatch.setenv("MEMORY_COMPRESSION_DICT", str(tmp_path / f"{name}.dict"))
+    codec = codec_from_env()
+    assert (codec.algorithm, codec.dictionary) == ("zlib", name)
+    assert set(codec.dictionaries) == {name, "old"}
+
+    monkeypatch.setenv("MEMORY_COMPRESSION", "off")
+    monkeypatch.delenv("MEMORY_COMPRESSION_DICT")
+    assert codec_from_env().algorithm is None
+
+
+def test_compressed_chunks_read_back_alongside_uncompressed_ones():
+    registry = FakeClusterRegistry()
+    plain = CouchbaseBackend(None, None, None, "test", chunk_size=4, registry=registry)
+    compressed = CouchbaseBackend(None, None, None, "test", chunk_size=4, registry=registry, codec=Codec("zlib"))
+    stored = emails(10)
+    plain.append_many("alice", "emails", stored[:3])
+    for value in stored[3:]:
+        compressed.append("alice", "emails", value)
+
+    assert compressed.read("alice", "emails") == stored
+    assert compressed.read_page("alice", "emails", 2, 5) == (stored[2:7], 10)
+    chunk = compressed.collection.get(compressed._chunk_id(compressed._doc_id("alice", "emails"), 0))
+    assert MARKER in chunk.content_as[dict]["items"]
+    assert not compressed.append("alice", "emails", stored[0])
+
+
+def test_zstd_round_trips_when_installed():
+    pytest.importorskip("zstandard")
+    dictionary = train_dictionary(emails(50), "zstd", size=4096)
+    name = dictionary_id(dictionary)
+    codec = Codec("zstd", min_size=0, dictionaries={name: dictionary}, dictionary=name)
+    envelope = codec.encode(EMAIL)
+    assert envelope["codec"] == "zstd"
+    assert codec.decode(envelope) == EMAIL
@@ -0,0 +1,311 @@
+"""CouchbaseBackend's chunked layout, run against the in-process FakeCollection."""
+import couchbase.subdocument as SD
+import pytest
+from couchbase.exceptions import CasMismatchException, TemporaryFailException
+
+from fake_collection import FakeClusterRegistry, MultiResult
+from storage import CouchbaseBackend, content_digest
+
+CHUNK_SIZE = 4
+
+
+@pytest.fixture
+def backend():
+    return CouchbaseBackend(None, None, None, "test", chunk_size=CHUNK_SIZE, registry=FakeClusterRegistry())
+
+
+def values(count: int, prefix: str = "value") -> list:
+    return [f"{prefix} {index}" for index in range(count)]
+
+
+def head(backend, category: str = "notes") -> dict:
+    return backend.collection.get(backend._doc_id("alice", category)).content_as[dict]
+
+
+def chunk_exists(backend, index: int, category: str = "notes") -> bool:
+    return backend.collection.exists(backend._chunk_id(backend._doc_id("alice", category), index)).exists
+
+
+def failing(call, error_ids: set):
+    """Wrap a ``*_multi`` call so some documents fail, reported in the result as the SDK does."""
+
+    def multi(keys, *args, **kwargs):
+        failed = {key: TemporaryFailException(message=key) for key in keys if key in error_ids}
+        if isinstance(keys, dict):
+            rest = {key: value for key, value in keys.items() if key not in failed}
+        else:
+            rest = [key for key in keys if key not in failed]
+        result = call(rest, *args, **kwargs)
+        return MultiResult(result.results, {**result.exceptions, **failed})
+
+    return multi
+
+
+def test_append_seals_full_runs_into_chunks(backend):
+    for value in values(10):
+        assert backend.append("alice", "notes", value)
+
+    assert chunk_exists(backend, 0) and chunk_exists(backend, 1) and not chunk_exists(backend, 2)
+    stored = head(backend)
+    assert (stored["chunks"], stored["size"], len(stored["items"]), stored["epoch"]) == (2, 2, 2, 2)
+    assert backend.read("alice", "notes") == values(10)
+
+
+def test_duplicates_of_sealed_values_are_rejected(backend):
+    assert backend.append_many("alice", "notes", values(9)) == 9
+    assert not backend.append("alice", "notes", "value 1")
+    assert backend.append_many("alice", "notes", ["value 2", "new", "value 8"]) == 1
+    assert backend.read("alice", "notes") == values(9) + ["new"]
+
+
+def test_sealed_digests_leave_the_head(backend):
+    for value in values(30):
+        backend.append("alice", "notes", value)
+    for value in values(30)[::3]:
+        assert backend.append("alice", "notes", value) is False
+
+    hashes = head(backend)["hashes"]
+    assert len(hashes) <= 2 * CHUNK_SIZE
+    assert {digest for digest, state in hashes.items() if state == 1} == {
+        content_digest(value) for value in values(30)[28:]
+    }
+    doc_id = backend._doc_id("alice", "notes")
+    shards = {backend._digest_shard_id(doc_id, content_digest(value)) for value in values(28)}
+    assert all(backend.collection.exists(shard_id).exists for shard_id in shards)
+    assert backend.read("alice", "notes") == values(30)
+
+
+def test_values_trimmed_from_the_head_stay_duplicates_after_a_seal(backend):
+    backend.append_many("alice", "notes", values(2))
+    assert backend.trim("alice", "notes", values(2)) == 2
+    for value in values(CHUNK_SIZE * 2, "later"):
+        backend.append("alice", "notes", value)
+    assert content_digest("value 0") not in head(backend)["hashes"]
+    assert backend.append_many("alice", "notes", ["value 0", "value 1", "new"]) == 1
+
+
+def test_failed_digest_write_keeps_the_head_until_the_next_append(backend, monkeypatch):
+    collection = backend.collection
+    mutate_in = collection.mutate_in
+
+    def mutate_in_failing_shards(key, *args, **kwargs):
+        if "::digests::" in key:
+            raise TemporaryFailException(message=key)
+        return mutate_in(key, *args, **kwargs)
+
+    monkeypatch.setattr(collection, "mutate_in", mutate_in_failing_shards)
+    assert backend.append_many("alice", "notes", values(5)) == 5
+    assert (head(backend)["chunks"], len(head(backend)["hashes"])) == (0, 5)
+
+    monkeypatch.undo()
+    assert backend.append("alice", "notes", "value 5")
+    assert head(backend)["chunks"] == 1
+    assert not backend.append("alice", "notes", "value 0")
+    assert backend.read("alice", "notes") == values(6)
+
+
+def test_read_of_missing_category_is_empty(backend):
+    assert backend.read("alice", "notes") == []
+    assert backend.read_page("alice", "notes", 0, 5) == ([], 0)
+    assert backend.read_many([("alice", "notes")]) == {("alice", "notes"): []}
+
+
+@pytest.mark.parametrize(
+    "offset, limit", [(0, 3), (2, 5), (4, 4), (7, 2), (8, 10), (0, None), (11, 3), (3, 0)]
+)
+def test_read_page_matches_read(backend, offset, limit):
+    backend.append_many("alice", "notes", values(10))
+    expected = values(10)[offset : None if limit is None else offset + limit]
+    assert backend.read_page("alice", "notes", offset, limit) == (expected, 10)
+
+
+def test_read_page_of_many_head_items_fetches_the_whole_array(backend, monkeypatch):
+    backend.chunk_size = 100
+    backend.append_many("alice", "notes", values(30))
+    monkeypatch.setattr(backend, "MAX_PAGE_PATHS", 2)
+    assert backend.read_page("alice", "notes", 5, 3) == (values(30)[5:8], 30)
+
+
+def test_read_page_fetches_only_the_page_items(backend):
+    backend.chunk_size = 100
+    backend.append_many("alice", "notes", values(60))
+    collection = backend.collection
+
+    before = collection.bytes_received
+    assert backend.read_page("alice", "notes", 50, 3) == (values(60)[50:53], 60)
+    page_bytes = collection.bytes_received - before
+    before = collection.bytes_received
+    backend.read("alice", "notes")
+    assert page_bytes * 5 < collection.bytes_received - before
+
+
+def test_read_page_retries_when_a_seal_moves_the_head(backend, monkeypatch):
+    backend.append_many("alice", "notes", values(6))
+    collection = backend.collection
+    lookup_in = collection.lookup_in
+    sealed = []
+
+    def lookup_sealing_once(key, specs, *args, **kwargs):
+        if not sealed and any("items[" in spec[1] for spec in specs):
+            # Another writer fills and seals the head between the two lookups.
+            sealed.append(True)
+            backend.append_many("alice", "notes", values(3, "late"))
+        return lookup_in(key, specs, *args, **kwargs)
+
+    monkeypatch.setattr(collection, "lookup_in", lookup_sealing_once)
+    assert backend.read_page("alice", "notes", 4, 2) == (values(6)[4:6], 9)
+    assert head(backend)["chunks"] == 2
+
+
+def test_read_page_gives_up_when_the_head_keeps_moving(backend, monkeypatch):
+    backend.append_many("alice", "notes", values(6))
+    collection = backend.collection
+    lookup_in = collection.lookup_in
+
+    def lookup_bumping_epoch(key, specs, *args, **kwargs):
+        if any("items[" in spec[1] for spec in specs):
+            collection.mutate_in(key, [SD.counter("epoch", 1)])
+        return lookup_in(key, specs, *args, **kwargs)
+
+    monkeypatch.setattr(collection, "lookup_in", lookup_bumping_epoch)
+    with pytest.raises(CasMismatchException):
+        backend.read_page("alice", "notes", 4, 2)
+
+
+def test_trim_removes_leading_values_and_emptied_chunks(backend):
+    backend.append_many("alice", "notes", values(10))
+
+    assert backend.trim("alice", "notes", values(5)) == 5
+    assert not chunk_exists(backend, 0) and chunk_exists(backend, 1)
+    assert head(backend)["trimmed"] == 5
+    assert backend.read("alice", "notes") == values(10)[5:]
+    assert backend.read_page("alice", "notes", 1, 4) == (values(10)[6:10], 5)
+    assert backend.read_many([("alice", "notes")])[("alice", "notes")] == values(10)[5:]
+
+    assert backend.trim("alice", "notes", values(10)[5:9]) == 4
+    assert backend.read("alice", "notes") == ["value 9"]
+    assert not backend.append("alice", "notes", "value 0")
+
+
+def test_trim_only_removes_values_still_leading(backend):
+    backend.append_many("alice", "notes", values(6))
+    assert backend.trim("alice", "notes", ["value 1", "value 2"]) == 0
+    assert backend.trim("alice", "notes", ["value 0", "value 1", "other"]) == 2
+    assert backend.read("alice", "notes") == values(6)[2:]
+
+
+def test_trim_can_forget_the_removed_values(backend):
+    for value in values(10):
+        backend.append("alice", "notes", value)
+    assert backend.trim("alice", "notes", values(7), forget=True) == 7
+    assert not set(map(content_digest, values(7))) & set(head(backend)["hashes"])
+    doc_id = backend._doc_id("alice", "notes")
+    assert not backend._sealed_digests(doc_id, [content_digest(value) for value in values(7)])
+    assert backend.append_many("alice", "notes", ["value 0", "value 6", "value 7"]) == 2
+    assert backend.read("alice", "notes") == values(10)[7:] + ["value 0", "value 6"]
+
+
+def test_append_without_digest_index_retries_on_cas_conflict(backend, monkeypatch):
+    backend.append_many("alice", "notes", values(2))
+    doc_id = backend._doc_id("alice", "notes")
+    backend.collection.mutate_in(doc_id, [SD.remove("hashes")])
+    collection = backend.collection
+    get = collection.get
+    raced = []
+
+    def get_then_race(key, *args, **kwargs):
+        result = get(key, *args, **kwargs)
+        if not raced:
+            raced.append(True)
+            collection.mutate_in(key, [SD.upsert("touched", True)])
+        return result
+
+    monkeypatch.setattr(collection, "get", get_then_race)
+    assert backend.append("alice", "notes", "value 2")
+    assert not backend.append("alice", "notes", "value 0")
+    assert backend.read("alice", "notes") == values(3)
+    assert content_digest("value 2") in head(backend)["hashes"]
+
+
+def test_failed_seal_keeps_the_head_until_the_next_append(backend, monkeypatch):
+    collection = backend.collection
+    chunk_id = backend._chunk_id(backend._doc_id("alice", "notes"), 0)
+    monkeypatch.setattr(collection, "upsert_multi", failing(collection.upsert_multi, {chunk_id}))
+
+    assert backend.append_many("alice", "notes", values(5)) == 5
+    assert not chunk_exists(backend, 0)
+    assert (head(backend)["chunks"], len(head(backend)["items"])) == (0, 5)
+    assert backend.read("alice", "notes") == values(5)
+
+    monkeypatch.undo()
+    assert backend.append("alice", "notes", "value 5")
+    assert (head(backend)["chunks"], len(head(backend)["items"])) == (1, 2)
+    assert backend.read("alice", "notes") == values(6)
+
+
+def test_migration_keeps_the_legacy_document_when_a_chunk_write_fails(backend, monkeypatch):
+    collection = backend.collection
+    collection.upsert(backend._legacy_doc_id("alice"), {"notes": values(6), "tags": ["a"]})
+    chunk_id = backend._chunk_id(backend._doc_id("alice", "notes"), 0)
+    monkeypatch.setattr(collection, "upsert_multi", failing(collection.upsert_multi, {chunk_id}))
+
+    with pytest.raises(TemporaryFailException):
+        backend.migrate_user("alice", delete_legacy=True)
+    assert collection.exists(backend._legacy_doc_id("alice")).exists
+    assert not collection.exists(backend._doc_id("alice", "notes")).exists
+    assert backend.read("alice", "notes") == values(6)
+
+    monkeypatch.undo()
+    assert backend.migrate_user("alice", delete_legacy=True) == 2
+    assert not collection.exists(backend._legacy_doc_id("alice")).exists
+    assert backend.read("alice", "notes") == values(6)
+    assert backend.read("alice", "tags") == ["a"]
+    assert set(head(backend)["hashes"]) == {content_digest("value 4"), content_digest("value 5")}
+    assert not backend.append("alice", "notes", "value 0")
+
+
+def test_reads_raise_chunk_errors_other_than_not_found(backend, monkeypatch):
+    backend.append_many("alice", "notes", values(6))
+    collection = backend.collection
+    chunk_id = backend._chunk_id(backend._doc_id("alice", "notes"), 0)
+    monkeypatch.setattr(collection, "get_multi", failing(collection.get_multi, {chunk_id}))
+
+    with pytest.raises(TemporaryFailException):
+        backend.read("alice", "notes")
+    with pytest.raises(TemporaryFailException):
+        backend.read_page("alice", "notes", 0, 2)
+    with pytest.raises(TemporaryFailException):
+        backend.read_many([("alice", "notes")])
+
+
+def test_read_many_raises_head_errors_other_than_not_found(backend, monkeypatch):
+    backend.append_many("alice", "notes", values(2))
+    collection = backend.collection
+    doc_id = backend._doc_id("alice", "notes")
+    monkeypatch.setattr(collection, "get_multi", failing(collection.get_multi, {doc_id}))
+
+    with pytest.raises(TemporaryFailException):
+        backend.read_many([("alice", "notes"), ("alice", "other")])
+
+
+@pytest.mark.parametrize("read", [
+    lambda backend: backend.read("alice", "notes"),
+    lambda backend: backend.read_many([("alice", "notes")])[("alice", "notes")],
+    lambda backend: backend.read_page("alice", "notes")[0],
+])
+def test_read_retries_when_a_chunk_is_trimmed_during_it(backend, monkeypatch, read):
+    backend.append_many("alice", "notes", values(10))
+    collection = backend.collection
+    get_multi = collection.get_multi
+    trimmed = []
+
+    def get_multi_trimming_once(keys, *args, **kwargs):
+        if not trimmed and backend._chunk_id(backend._doc_id("alice", "notes"), 0) in keys:
+            # Another process trims the first chunk after the head was read.
+            trimmed.append(True)
+            backend.trim("alice", "notes", values(4))
+        return get_multi(keys, *args, **kwargs)
+
+    monkeypatch.setattr(collection, "get_multi", get_multi_trimming_once)
+    assert read(backend) == values(10)[4:]
+    assert trimmed
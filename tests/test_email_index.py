@@ -0,0 +1,174 @@
+"""BM25 inverted index, header field indexes and EmailIndex kept in step with memory."""
+import pytest
+
+from email_index import (
+    EmailIndex,
+    FieldIndex,
+    InvertedIndex,
+    make_email,
+    normalize_date,
+    parse_email,
+    thread_key,
+    tokenize,
+)
+from memory import CouchbaseMemory
+from storage import SQLiteBackend
+
+
+@pytest.fixture
+def memory(tmp_path):
+    return CouchbaseMemory(backend=SQLiteBackend(str(tmp_path / "memory.db")))
+
+
+def email(subject: str, body: str, sender: str = "ana@example.com", date: str = "2026-01-05") -> dict:
+    return make_email(sender, "me@example.com", date, subject, body)
+
+
+def test_tokens_are_lowercase_words():
+    assert tokenize("Re: Quarterly REPORT, v2!") == ["re", "quarterly", "report", "v2"]
+
+
+def test_documents_are_indexed_once():
+    index = InvertedIndex()
+    assert index.add("a", "budget review")
+    assert not index.add("a", "something else entirely")
+    assert len(index) == 1
+    assert index.total_length == 2
+    assert index.search("something") == []
+
+
+def test_bm25_prefers_rarer_terms_and_shorter_documents():
+    index = InvertedIndex()
+    index.add("short", "invoice overdue")
+    index.add("long", "invoice overdue " + "filler " * 20)
+    index.add("common", "meeting agenda")
+    index.add("common2", "meeting notes")
+    assert [key for key, _ in index.search("invoice overdue")] == ["short", "long"]
+
+    ranked = dict(index.search("meeting invoice", match_all=False))
+    assert set(ranked) == {"short", "long", "common", "common2"}
+    assert ranked["common"] == ranked["common2"]
+    assert ranked["short"] > ranked["long"]
+    assert index.search("meeting invoice") == []
+    assert [key for key, _ in index.search("meeting", within={"common2", "short"})] == ["common2"]
+    assert len(index.search("meeting", limit=1)) == 1
+    assert index.search("") == []
+
+
+def test_find_ranks_stored_emails_and_pages(memory):
+    stored = [
+        email("Invoice", "the invoice for march is attached"),
+        email("Lunch", "lunch on friday?"),
+        email("Invoice reminder", "reminder: invoice overdue, invoice unpaid"),
+    ]
+    memory.add_many("alice", "emails", stored)
+    index = EmailIndex(memory)
+
+    assert index.find("alice", "invoice") == [stored[2], stored[0]]
+    assert index.find("alice", "invoice", limit=1, offset=1) == [stored[0]]
+    assert index.find("alice", "invoice friday") == []
+    assert len(index.find("alice", "invoice friday", match_all=False)) == 3
+    assert index.find("alice") == stored
+    assert index.find("bob", "invoice") == []
+
+
+def test_legacy_flat_emails_are_searchable(memory):
+    memory.add("alice", "emails", "From: Bo\nTo: me\nDate: 2026-01-01\nCC: \nSubject: Keys\nBody: spare keys")
+    assert EmailIndex(memory).find("alice", "spare keys")[0]["from"] == "Bo"
+
+
+def test_new_emails_reach_a_loaded_mailbox(memory):
+    index = EmailIndex(memory)
+    memory.add("alice", "emails", email("Old", "first message"))
+    assert len(index.find("alice")) == 1
+
+    added = email("New", "second message")
+    memory.add("alice", "emails", added)
+    index.add("alice", added)
+    index.add("alice", added)
+    assert index.find("alice", "second") == [added]
+    assert len(index.find("alice")) == 2
+
+
+def test_changes_from_other_processes_update_or_drop_the_mailbox(memory):
+    index = EmailIndex(memory)
+    first = email("One", "first")
+    memory.add("alice", "emails", first)
+    index.find("alice")
+
+    second = email("Two", "second")
+    memory.add("alice", "emails", second)
+    index.apply_change({"user_id": "alice", "op": "append", "values": [second, first]})
+    assert index.find("alice") == [first, second]
+
+    memory.trim("alice", "emails", [first])
+    assert index.find("alice") == [first, second]
+    index.apply_change({"user_id": "alice", "op": "trim", "values": [first]})
+    assert index.find("alice") == [second]
+
+
+def test_only_max_users_mailboxes_stay_loaded(memory):
+    index = EmailIndex(memory, max_users=2)
+    for user_id in ("alice", "bob", "carol"):
+        memory.add(user_id, "emails", email("Hi", f"hello {user_id}"))
+        index.find(user_id)
+    assert list(index._mailboxes) == ["bob", "carol"]
+    index.find("bob")
+    index.invalidate("carol")
+    assert list(index._mailboxes) == ["bob"]
+    assert index.find("carol", "hello")[0]["body"] == "hello carol"
+
+
+def test_dates_are_normalised_from_common_formats():
+    assert normalize_date("2026-03-04T10:00:00") == "2026-03-04"
+    assert normalize_date("04/03/2026") == "2026-03-04"
+    assert normalize_date("4 March 2026") == "2026-03-04"
+    assert normalize_date("March 4, 2026") == "2026-03-04"
+    assert normalize_date("Wed, 04 Mar 2026 10:00:00 +0000") == "2026-03-04"
+    assert normalize_date("soon") is None
+    assert normalize_date(None) is None
+
+
+def test_threads_ignore_reply_and_forward_prefixes():
+    assert thread_key("Re: FWD:  Viewing  Saturday") == "viewing saturday"
+    assert thread_key("RE[2]: viewing saturday") == "viewing saturday"
+    assert thread_key(None) == ""
+
+
+def test_flat_emails_parse_into_records():
+    parsed = parse_email("From: Bo <bo@example.com>\nTo: me\nCC: Cy\nSubject: Hi\nBody: line one\nline two")
+    assert parsed == make_email("Bo <bo@example.com>", "me", "", "Hi", "line one\nline two", cc="Cy")
+
+
+def test_field_filters_intersect():
+    fields = FieldIndex()
+    fields.add("a", make_email("Ana Lee <ana@example.com>", "me@example.com", "2026-01-05", "Offer", "", cc="Bo"))
+    fields.add("b", make_email("Bo <bo@example.com>", "Ana Lee", "06/01/2026", "Re: Offer", ""))
+    fields.add("c", make_email("Ana Lee <ana@example.com>", "Bo", "2026-02-01", "Keys", ""))
+    fields.add("d", make_email("Ana Lee <ana@example.com>", "Bo", "someday", "Keys", ""))
+
+    assert fields.filter() is None
+    assert fields.filter(sender="ana lee") == {"a", "c", "d"}
+    assert fields.filter(sender="ana@example.com", recipient="bo") == {"a", "c", "d"}
+    assert fields.filter(recipient="lee ana") == {"b"}
+    assert fields.filter(sender="nobody") == set()
+    assert fields.filter(thread="fwd: offer") == {"a", "b"}
+    assert fields.filter(date_from="2026-01-06") == {"b", "c"}
+    assert fields.filter(date_to="6 January 2026") == {"a", "b"}
+    assert fields.filter(date_from="2026-01-06", date_to="2026-01-06", thread="offer") == {"b"}
+
+
+def test_find_combines_filters_with_the_query(memory):
+    stored = [
+        make_email("Ana <ana@example.com>", "me", "2026-02-01", "Offer", "offer on the flat"),
+        make_email("Bo <bo@example.com>", "me", "2026-01-01", "Re: Offer", "counter offer"),
+        make_email("Ana <ana@example.com>", "me", "2026-01-15", "Keys", "keys to the flat"),
+    ]
+    memory.add_many("alice", "emails", stored)
+    index = EmailIndex(memory)
+
+    assert index.find("alice", sender="ana") == [stored[2], stored[0]]
+    assert index.find("alice", thread="offer") == [stored[1], stored[0]]
+    assert index.find("alice", "flat", sender="ana", date_from="2026-01-20") == [stored[0]]
+    assert index.find("alice", sender="ana", limit=1, offset=1) == [stored[0]]
+    assert index.find("alice", "keys", sender="bo") == []
@@ -0,0 +1,157 @@
+"""Mailbox readers, checkpoints and the bulk ingest pipeline."""
+import mailbox
+from email.message import EmailMessage
+
+import pytest
+
+from email_index import EmailIndex, make_email
+from ingest import (
+    RAW_READERS,
+    Checkpoint,
+    batched,
+    detect_format,
+    ingest,
+    read_eml,
+    read_markdown,
+    read_mbox,
+)
+from memory import CouchbaseMemory
+from storage import SQLiteBackend
+
+MARKDOWN = """\
+**From:** Ana <ana@example.com>
+**To:** me@example.com
+**Date:** 2026-01-05
+**Subject:** Viewing
+**Body:** Saturday works.
+
+**From:** this line is part of the body
+----
+**From:** Bo <bo@example.com>
+**To:** me@example.com
+**CC:** Cy
+**Date:** 2026-01-06
+**Subject:** Re: Viewing
+**Body:**
+See you there.
+----
+"""
+
+
+@pytest.fixture
+def memory(tmp_path):
+    return CouchbaseMemory(backend=SQLiteBackend(str(tmp_path / "memory.db")))
+
+
+def message(sender: str, subject: str, body: str) -> EmailMessage:
+    mail = EmailMessage()
+    mail["From"] = sender
+    mail["To"] = "me@example.com"
+    mail["Date"] = "Mon, 05 Jan 2026 10:00:00 +0000"
+    mail["Subject"] = subject
+    mail.set_content(body)
+    return mail
+
+
+def emails(count: int) -> list:
+    return [
+        make_email("ana@example.com", "me", "2026-01-05", f"Email {index}", f"body {index}") for index in range(count)
+    ]
+
+
+def test_markdown_dumps_stream_one_record_per_email(tmp_path):
+    path = tmp_path / "dump.md"
+    path.write_text(MARKDOWN, encoding="utf-8")
+    assert list(read_markdown(str(path))) == [
+        make_email(
+            "Ana <ana@example.com>",
+            "me@example.com",
+            "2026-01-05",
+            "Viewing",
+            "Saturday works.\n\n**From:** this line is part of the body",
+        ),
+        make_email("Bo <bo@example.com>", "me@example.com", "2026-01-06", "Re: Viewing", "See you there.", cc="Cy"),
+    ]
+
+
+def test_mbox_and_eml_sources_parse_to_records(tmp_path):
+    box = mailbox.mbox(str(tmp_path / "mail.mbox"))
+    box.add(message("Ana <ana@example.com>", "First", "one"))
+    box.add(message("Bo <bo@example.com>", "Second", "two"))
+    box.flush()
+    box.close()
+    records = list(read_mbox(str(tmp_path / "mail.mbox")))
+    assert [(record["from"], record["subject"], record["body"]) for record in records] == [
+        ("Ana <ana@example.com>", "First", "one"),
+        ("Bo <bo@example.com>", "Second", "two"),
+    ]
+    assert records[0]["cc"] == ""
+
+    exports = tmp_path / "exports"
+    (exports / "nested").mkdir(parents=True)
+    (exports / "b.eml").write_bytes(bytes(message("Bo", "B", "bee")))
+    (exports / "nested" / "a.eml").write_bytes(bytes(message("Ana", "A", "ay")))
+    (exports / "notes.txt").write_text("ignored")
+    assert [record["subject"] for record in read_eml(str(exports))] == ["B", "A"]
+    assert [record["subject"] for record in read_eml(str(exports / "b.eml"))] == ["B"]
+
+
+def test_formats_are_guessed_from_the_path(tmp_path):
+    assert detect_format(str(tmp_path)) == "eml"
+    assert detect_format("mail/One.EML") == "eml"
+    assert detect_format("sample-data.md") == "markdown"
+    assert detect_format("archive") == "mbox"
+    assert list(batched(iter(range(5)), 2)) == [[0, 1], [2, 3], [4]]
+
+
+def test_checkpoints_only_resume_the_same_source(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    Checkpoint(path, "dump.md").save(40)
+    assert Checkpoint(path, "dump.md").records == 40
+    assert Checkpoint(path, "other.md").records == 0
+    disabled = Checkpoint(None, "dump.md")
+    disabled.save(5)
+    assert disabled.records == 5
+
+
+def test_ingest_writes_in_source_order_and_indexes(memory, tmp_path):
+    records = emails(25)
+    index = EmailIndex(memory)
+    index.find("alice")
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.json"), "source")
+    stats = ingest(memory, index, "alice", iter(records), checkpoint, batch_size=4, workers=3)
+
+    assert (stats["records"], stats["saved"], stats["skipped"]) == (25, 25, 0)
+    assert memory.search_by_category("alice", "emails") == records
+    assert index.find("alice", "body 17") == [records[17]]
+    assert Checkpoint(str(tmp_path / "checkpoint.json"), "source").records == 25
+
+
+def test_an_interrupted_ingest_resumes_from_its_checkpoint(memory, tmp_path):
+    records = emails(10)
+    index = EmailIndex(memory)
+    path = str(tmp_path / "checkpoint.json")
+
+    def crash_at_seven(record):
+        if record["subject"] == "Email 7":
+            raise OSError("connection reset")
+        return record
+
+    with pytest.raises(OSError):
+        ingest(
+            memory, index, "alice", iter(records), Checkpoint(path, "source"), batch_size=3, workers=1,
+            parse=crash_at_seven,
+        )
+    assert Checkpoint(path, "source").records == 6
+
+    stats = ingest(memory, index, "alice", iter(records), Checkpoint(path, "source"), batch_size=3, workers=2)
+    assert (stats["records"], stats["skipped"]) == (4, 6)
+    assert memory.search_by_category("alice", "emails") == records
+
+
+def test_raw_messages_are_parsed_on_the_workers(memory, tmp_path):
+    (tmp_path / "one.eml").write_bytes(bytes(message("Ana", "Raw", "raw body")))
+    read, parse = RAW_READERS["eml"]
+    stats = ingest(memory, EmailIndex(memory), "alice", read(str(tmp_path)), Checkpoint(None, "raw"), parse=parse)
+    assert stats["saved"] == 1
+    assert memory.search_by_category("alice", "emails")[0]["body"] == "raw body"
@@ -0,0 +1,101 @@
+"""Telemetry recording, exporters and the process-wide instrumentation."""
+import atexit
+import io
+import json
+
+import instrumentation
+from instrumentation import (
+    Instrumentation,
+    PrometheusFileExporter,
+    SpanFileExporter,
+    Telemetry,
+    get_instrumentation,
+    set_instrumentation,
+)
+
+
+class FlushCounter(Instrumentation):
+    def __init__(self):
+        self.flushes = 0
+
+    def flush(self) -> None:
+        self.flushes += 1
+
+
+def test_swapping_instrumentation_registers_no_exit_handlers(monkeypatch, telemetry):
+    registered = []
+    monkeypatch.setattr(atexit, "register", registered.append)
+    first, second = FlushCounter(), FlushCounter()
+
+    set_instrumentation(first)
+    set_instrumentation(second)
+    set_instrumentation(second)
+
+    assert registered == []
+    assert (first.flushes, second.flushes) == (1, 0)
+    instrumentation._flush_current()
+    assert (first.flushes, second.flushes) == (1, 1)
+
+
+def test_counters_spans_and_logs_are_recorded(telemetry):
+    telemetry.count("memory_cache_hits_total", operation="read")
+    telemetry.count("memory_cache_hits_total", 2, operation="read")
+    with telemetry.span("memory.read") as span:
+        span.set(items=3)
+    try:
+        with telemetry.span("memory.read"):
+            raise KeyError("boom")
+    except KeyError:
+        pass
+    telemetry.log("INFO", "memory.saved", user_id="alice")
+
+    snapshot = telemetry.snapshot()
+    assert snapshot["counters"][("memory_cache_hits_total", (("operation", "read"),))] == 3
+    assert snapshot["histograms"][("memory.read", "ok")]["count"] == 1
+    assert snapshot["histograms"][("memory.read", "error")]["count"] == 1
+    records = [json.loads(line) for line in telemetry.stream.getvalue().splitlines()]
+    assert {"level": "INFO", "event": "memory.saved", "user_id": "alice"}.items() <= records[-1].items()
+
+
+def test_log_level_and_sampling_drop_chatty_events():
+    recorder = Telemetry(log_level="INFO", sample_rate=0.0, stream=io.StringIO())
+    recorder.log("DEBUG", "noise")
+    recorder.log("INFO", "sampled.out")
+    recorder.log("WARNING", "kept")
+    assert [json.loads(line)["event"] for line in recorder.stream.getvalue().splitlines()] == ["kept"]
+
+
+def test_prometheus_exporter_writes_counters_and_histograms(tmp_path):
+    path = tmp_path / "telemetry.prom"
+    recorder = Telemetry(stream=io.StringIO(), exporter=PrometheusFileExporter(str(path)))
+    recorder.count("memory_retries_total", operation='say "hi"')
+    with recorder.span("tool.store_email"):
+        pass
+    recorder.flush()
+
+    text = path.read_text()
+    assert '# TYPE memory_retries_total counter\nmemory_retries_total{operation="say \\"hi\\""} 1' in text
+    assert 'span_duration_seconds_count{span="tool.store_email",status="ok"} 1' in text
+
+
+def test_span_exporter_appends_nested_spans_with_their_parent(tmp_path):
+    path = tmp_path / "spans.jsonl"
+    recorder = Telemetry(stream=io.StringIO(), exporter=SpanFileExporter(str(path)))
+    with recorder.span("tool.retrieve_emails"):
+        with recorder.span("memory.read"):
+            pass
+    recorder.flush()
+
+    request = json.loads(path.read_text().splitlines()[-1])
+    inner, outer = request["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert (inner["name"], outer["name"]) == ("memory.read", "tool.retrieve_emails")
+    assert inner["traceId"] == outer["traceId"] and inner["parentSpanId"] == outer["spanId"]
+
+
+def test_default_instrumentation_is_a_no_op(monkeypatch):
+    monkeypatch.delenv("TELEMETRY", raising=False)
+    monkeypatch.setattr(instrumentation, "_instrumentation", None)
+    default = get_instrumentation()
+    assert not default.enabled
+    with default.span("anything") as span:
+        span.set(ignored=True)
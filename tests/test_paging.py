@@ -0,0 +1,69 @@
+"""Cursors, snippets and response budgets for paged tool results."""
+import asyncio
+import json
+
+import pytest
+
+import tools
+from memory import AsyncCouchbaseMemory, CouchbaseMemory
+from paging import decode_cursor, encode_cursor, fit_to_budget, snippet
+from storage import SQLiteBackend
+
+
+def test_cursors_round_trip_and_reject_tampering():
+    assert decode_cursor(encode_cursor(40)) == 40
+    assert decode_cursor(None) == 0
+    assert decode_cursor("") == 0
+    for cursor in ("not base64!", encode_cursor(-1), "eyJwYWdlIjogMX0=", encode_cursor("40")):
+        with pytest.raises(ValueError, match="Invalid cursor"):
+            decode_cursor(cursor)
+
+
+def test_snippets_cut_strings_and_email_bodies():
+    assert snippet("short", max_chars=10) == "short"
+    assert snippet("x" * 12, max_chars=10) == "x" * 10 + "..."
+    email = {"subject": "Long", "body": "y" * 12}
+    assert snippet(email, max_chars=10) == {"subject": "Long", "body": "y" * 10 + "...", "truncated": True}
+    assert snippet({"subject": "Short", "body": "y"}, max_chars=10) == {"subject": "Short", "body": "y"}
+    assert snippet(3) == 3
+
+
+def test_pages_stop_at_the_budget_and_are_never_empty():
+    items = ["a" * 40, "b" * 40, "c" * 40]
+    assert fit_to_budget(items, budget=100) == items[:2]
+    assert fit_to_budget(items, budget=110, max_chars=20) == items[:2] + ["c" * 20 + "..."]
+    page = fit_to_budget(["d" * 500, "e"], budget=50, max_chars=10)
+    assert page == ["d" * 10 + "...", "e"]
+    assert len(json.dumps(page)) <= 50
+    assert fit_to_budget([{"body": "f" * 500}], budget=10, max_chars=100) == [
+        {"body": "f" * 100 + "...", "truncated": True}
+    ]
+    assert fit_to_budget([]) == []
+
+
+@pytest.fixture
+def preferences(tmp_path, monkeypatch):
+    memory = AsyncCouchbaseMemory(CouchbaseMemory(backend=SQLiteBackend(str(tmp_path / "memory.db"))))
+    monkeypatch.setattr(tools, "async_memory", memory)
+    yield memory
+    memory.close()
+
+
+def test_preferences_are_retrieved_a_page_at_a_time(preferences):
+    preferences.memory.add_many(tools.USER_ID, "property_preferences", [f"preference {index}" for index in range(5)])
+
+    async def pages():
+        found, cursor = [], None
+        while True:
+            page = await tools.retrieve_user_preferences("property_preferences", limit=2, cursor=cursor)
+            assert page["status"] == "success" and page["total"] == 5
+            found.append(page["preferences"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return found
+
+    assert asyncio.run(pages()) == [
+        ["preference 0", "preference 1"], ["preference 2", "preference 3"], ["preference 4"]
+    ]
+    invalid = asyncio.run(tools.retrieve_user_preferences("property_preferences", cursor="bogus"))
+    assert invalid["status"] == "error"
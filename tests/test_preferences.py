@@ -0,0 +1,73 @@
+"""PreferenceContext digests: batched loading, caching and invalidation."""
+import asyncio
+
+import pytest
+
+from memory import AsyncCouchbaseMemory, CouchbaseMemory
+from preferences import CATEGORY_INDEX, PreferenceContext
+from storage import SQLiteBackend
+
+
+@pytest.fixture
+def async_memory(tmp_path):
+    return AsyncCouchbaseMemory(CouchbaseMemory(backend=SQLiteBackend(str(tmp_path / "memory.db"))))
+
+
+@pytest.fixture
+def context(async_memory):
+    return PreferenceContext(async_memory, max_items=2)
+
+
+def test_digest_covers_default_and_saved_categories(async_memory, context):
+    memory = async_memory.memory
+    memory.add_many("alice", "property_preferences", ["sea view", "two bedrooms", "pool"])
+    memory.add("alice", "travel", "window seat")
+    asyncio.run(context.saved("alice", "travel"))
+
+    digest = context.digest("alice")
+    assert "property_preferences (3 saved, most recent shown):" in digest
+    assert "- two bedrooms\n- pool" in digest and "sea view" not in digest
+    assert "travel (1 saved):\n- window seat" in digest
+    assert memory.search_by_category("alice", CATEGORY_INDEX) == ["travel"]
+    assert PreferenceContext(async_memory).digest("bob") == "No preferences saved yet."
+
+
+def test_digest_is_cached_until_invalidated(async_memory, context, monkeypatch):
+    async_memory.memory.add("alice", "property_preferences", "sea view")
+    loads = []
+    load = context.load
+    monkeypatch.setattr(context, "load", lambda user_id: loads.append(user_id) or load(user_id))
+
+    assert context.digest("alice") == context.digest("alice")
+    assert loads == ["alice"]
+    async_memory.memory.add("alice", "property_preferences", "pool")
+    context.invalidate("alice")
+    assert "- pool" in context.digest("alice")
+    assert loads == ["alice", "alice"]
+
+
+def test_a_digest_loaded_across_an_invalidation_is_not_cached(async_memory, context, monkeypatch):
+    memory = async_memory.memory
+    memory.add("alice", "property_preferences", "sea view")
+    load = context.load
+
+    def load_racing_a_save(user_id):
+        loaded = load(user_id)
+        # Another request saves a preference after this load read the old ones.
+        memory.add(user_id, "property_preferences", "pool")
+        context.invalidate(user_id)
+        return loaded
+
+    monkeypatch.setattr(context, "load", load_racing_a_save)
+    assert "pool" not in context.digest("alice")
+    monkeypatch.undo()
+    assert "- pool" in context.digest("alice")
+
+
+def test_digest_stays_within_its_size_budget(async_memory):
+    preferences = [f"preference {index} " * 5 for index in range(2)]
+    async_memory.memory.add_many("alice", "property_preferences", preferences)
+    context = PreferenceContext(async_memory, max_chars=80)
+    digest = context.digest("alice")
+    assert digest.endswith("- ... (use retrieve_user_preferences for the rest)")
+    assert len(digest) < 80 + 60
@@ -0,0 +1,103 @@
+"""Batched reads of many users' categories through read_many and iter_many."""
+import pytest
+
+from fake_collection import FakeClusterRegistry
+from memory import CouchbaseMemory
+from storage import CouchbaseBackend, SQLiteBackend
+
+
+@pytest.fixture
+def couchbase():
+    return CouchbaseBackend(None, None, None, "test", chunk_size=4, registry=FakeClusterRegistry())
+
+
+@pytest.fixture
+def memory(tmp_path):
+    return CouchbaseMemory(backend=SQLiteBackend(str(tmp_path / "memory.db")))
+
+
+def spy(monkeypatch, target, name: str) -> list:
+    """Record the first argument of every call to a method."""
+    calls = []
+    method = getattr(target, name)
+
+    def recorded(first, *args, **kwargs):
+        calls.append(list(first))
+        return method(first, *args, **kwargs)
+
+    monkeypatch.setattr(target, name, recorded)
+    return calls
+
+
+def test_couchbase_reads_every_category_in_a_few_multi_gets(couchbase, monkeypatch):
+    for index in range(6):
+        for value in range(index * 3):
+            couchbase.append(f"user{index}", "notes", f"note {value}")
+    couchbase.append_many("user1", "tasks", ["task"])
+    couchbase.trim("user5", "notes", ["note 0", "note 1", "note 2", "note 3", "note 4"])
+    keys = [(f"user{index}", "notes") for index in range(6)] + [("user1", "tasks"), ("nobody", "notes")]
+    expected = {key: couchbase.read(*key) for key in keys}
+
+    calls = spy(monkeypatch, couchbase.collection, "get_multi")
+    assert couchbase.read_many(keys + keys[:2]) == expected
+    # Heads, then their chunks, then the legacy documents of the categories without a head.
+    assert len(calls) == 3
+    assert sorted(calls[2]) == ["user::nobody", "user::user0"]
+    assert expected[("user5", "notes")] == [f"note {value}" for value in range(5, 15)]
+
+
+def test_sqlite_reads_large_key_lists_in_slices(tmp_path, monkeypatch):
+    backend = SQLiteBackend(str(tmp_path / "memory.db"))
+    monkeypatch.setattr(backend, "READ_MANY_SLICE", 3)
+    for index in range(7):
+        backend.append_many(f"user{index}", "notes", [f"{index} first", f"{index} second"])
+    keys = [(f"user{index}", "notes") for index in range(8)]
+    found = backend.read_many(keys)
+    assert list(found) == keys
+    assert found[("user6", "notes")] == ["6 first", "6 second"]
+    assert found[("user7", "notes")] == []
+
+
+def test_iter_many_batches_uncached_categories(memory, monkeypatch):
+    for index in range(10):
+        memory.add(f"user{index}", "notes", f"note {index}")
+    memory.search_by_category("user3", "notes")
+    batches = spy(monkeypatch, memory.backend, "read_many")
+    keys = [(f"user{index}", "notes") for index in range(10)] + [("user0", "notes")]
+
+    yielded = list(memory.iter_many(keys, batch_size=4, concurrency=1))
+    assert yielded[0] == (("user3", "notes"), ["note 3"])
+    assert dict(yielded) == {(f"user{index}", "notes"): [f"note {index}"] for index in range(10)}
+    assert len(yielded) == 10
+    assert [len(batch) for batch in batches] == [4, 4, 1]
+    assert ("user3", "notes") not in [key for batch in batches for key in batch]
+
+    hits = memory.cache.hits
+    assert memory.search_by_category("user7", "notes") == ["note 7"]
+    assert memory.cache.hits == hits + 1
+
+
+def test_concurrent_batches_return_the_same_categories(memory, monkeypatch):
+    for index in range(20):
+        memory.add_many(f"user{index}", "notes", [f"note {index}", "shared"])
+    batches = spy(monkeypatch, memory.backend, "read_many")
+    keys = [(f"user{index}", "notes") for index in range(20)]
+    found = memory.search_many(keys, batch_size=3, concurrency=4)
+    assert found == {key: [f"note {key[0][4:]}", "shared"] for key in keys}
+    assert sorted(len(batch) for batch in batches) == [2] + [3] * 6
+
+
+def test_exports_can_bypass_the_cache(memory):
+    memory.add("alice", "notes", "one")
+    assert dict(memory.iter_many([("alice", "notes")], cache=False)) == {("alice", "notes"): ["one"]}
+    assert memory.cache.stats()["entries"] == 0
+    memory.search_many([("alice", "notes")])
+    assert memory.cache.stats()["entries"] == 1
+
+
+def test_buffered_writes_are_flushed_before_a_batch_read(memory):
+    with memory.turn():
+        memory.add("alice", "notes", "pending")
+        assert memory.search_many([("alice", "notes"), ("bob", "notes")]) == {
+            ("alice", "notes"): ["pending"], ("bob", "notes"): []
+        }
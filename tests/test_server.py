@@ -0,0 +1,91 @@
+"""AgentServer concurrency limits, request context and HTTP endpoints."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from google.adk.sessions import InMemorySessionService
+
+from context import get_session_id, get_user_id
+from memory import AsyncCouchbaseMemory, CouchbaseMemory
+from server import AgentServer, create_app
+from storage import SQLiteBackend
+
+
+def final_event(text: str):
+    return SimpleNamespace(
+        is_final_response=lambda: True, content=SimpleNamespace(parts=[SimpleNamespace(text=text)])
+    )
+
+
+class StubRunner:
+    """Answers every turn with the bound user and session, holding each turn open briefly."""
+
+    def __init__(self, memory=None, hold: float = 0.02):
+        self.memory = memory
+        self.hold = hold
+        self.running = {}
+        self.peak = {}
+
+    async def run_async(self, user_id, session_id, new_message):
+        for key in ("all", user_id, (user_id, session_id)):
+            self.running[key] = self.running.get(key, 0) + 1
+            self.peak[key] = max(self.peak.get(key, 0), self.running[key])
+        await asyncio.sleep(self.hold)
+        if self.memory is not None:
+            await self.memory.add(get_user_id(), "turns", new_message.parts[0].text)
+        for key in ("all", user_id, (user_id, session_id)):
+            self.running[key] -= 1
+        yield final_event(f"{get_user_id()}/{get_session_id()}: {new_message.parts[0].text}")
+
+
+@pytest.fixture
+def memory(tmp_path):
+    async_memory = AsyncCouchbaseMemory(CouchbaseMemory(backend=SQLiteBackend(str(tmp_path / "memory.db"))))
+    yield async_memory
+    async_memory.close()
+
+
+def test_turns_are_limited_globally_per_user_and_per_session():
+    runner = StubRunner()
+    server = AgentServer(runner, InMemorySessionService(), "app", max_concurrent=3, per_user_limit=2)
+
+    async def run():
+        turns = [server.handle(f"user{index % 3}", f"s{index % 6}", f"m{index}") for index in range(18)]
+        return await asyncio.gather(*turns)
+
+    responses = asyncio.run(run())
+    assert responses[4] == "user1/s4: m4"
+    assert runner.peak["all"] == 3
+    assert max(runner.peak[f"user{index}"] for index in range(3)) <= 2
+    assert max(runner.peak[(f"user{index % 3}", f"s{index}")] for index in range(6)) == 1
+    assert server._user_slots == {} and server._session_locks == {} and not server._waiters
+
+
+def test_sessions_are_created_on_their_first_turn():
+    sessions = InMemorySessionService()
+    server = AgentServer(StubRunner(hold=0), sessions, "app")
+
+    async def run():
+        await server.handle("alice", "s1", "hi")
+        await server.handle("alice", "s1", "again")
+        return await sessions.list_sessions(app_name="app", user_id="alice")
+
+    assert [session.id for session in asyncio.run(run()).sessions] == ["s1"]
+
+
+def test_memory_writes_are_flushed_with_the_turn(memory):
+    server = AgentServer(StubRunner(memory, hold=0), InMemorySessionService(), "app", memory=memory)
+    assert asyncio.run(server.handle("alice", "s1", "remember this")) == "alice/s1: remember this"
+    assert memory.memory.backend.read("alice", "turns") == ["remember this"]
+
+
+def test_http_endpoints(memory):
+    from fastapi.testclient import TestClient
+
+    server = AgentServer(StubRunner(hold=0), InMemorySessionService(), "app", memory=memory)
+    with TestClient(create_app(server)) as client:
+        response = client.post("/chat", json={"user_id": "alice", "session_id": "s1", "message": "Hi"})
+        assert response.json() == {"user_id": "alice", "session_id": "s1", "response": "alice/s1: Hi"}
+        health = client.get("/health")
+        assert health.status_code == 200 and health.json()["status"] == "ok"
+        assert client.post("/chat", json={"user_id": "alice"}).status_code == 422
@@ -0,0 +1,117 @@
+"""DurableSessionService: events on disk, a bounded window in memory, and rollback of failed writes."""
+import asyncio
+import sqlite3
+
+import pytest
+from google.adk.errors.already_exists_error import AlreadyExistsError
+from google.adk.events import Event, EventActions
+from google.adk.sessions.base_session_service import GetSessionConfig
+from google.genai import types
+
+from sessions import DurableSessionService
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "sessions.db")
+
+
+def event(text: str, state: dict = None) -> Event:
+    return Event(
+        author="user",
+        invocation_id="turn",
+        content=types.Content(role="user", parts=[types.Part(text=text)]),
+        actions=EventActions(state_delta=state or {}),
+    )
+
+
+def texts(session) -> list:
+    return [item.content.parts[0].text for item in session.events]
+
+
+def test_sessions_and_their_state_survive_a_restart(path):
+    service = DurableSessionService(path, window=3)
+
+    async def run():
+        session = await service.create_session(
+            app_name="app", user_id="alice", session_id="s1", state={"topic": "flats", "app:region": "PT"}
+        )
+        for index in range(5):
+            await service.append_event(session, event(f"message {index}", {"user:budget": index, "temp:x": 1}))
+        reopened = DurableSessionService(path, window=3)
+        return session, await reopened.get_session(app_name="app", user_id="alice", session_id="s1"), reopened
+
+    session, loaded, reopened = asyncio.run(run())
+    assert texts(loaded) == ["message 2", "message 3", "message 4"]
+    assert loaded.state == {"topic": "flats", "app:region": "PT", "user:budget": 4}
+    assert asyncio.run(reopened.get_user_state(app_name="app", user_id="alice")) == {"budget": 4}
+
+    older = asyncio.run(
+        reopened.get_session(
+            app_name="app", user_id="alice", session_id="s1", config=GetSessionConfig(num_recent_events=10)
+        )
+    )
+    assert texts(older) == [f"message {index}" for index in range(5)]
+
+
+def test_creating_an_existing_session_fails_and_leaves_it_alone(path):
+    service = DurableSessionService(path)
+
+    async def run():
+        await service.create_session(app_name="app", user_id="alice", session_id="s1", state={"a": 1})
+        with pytest.raises(AlreadyExistsError):
+            await service.create_session(app_name="app", user_id="alice", session_id="s1", state={"user:b": 2})
+        return await DurableSessionService(path).get_session(app_name="app", user_id="alice", session_id="s1")
+
+    assert asyncio.run(run()).state == {"a": 1}
+    assert not service._conn.in_transaction
+
+
+def test_a_failed_append_leaves_neither_the_log_nor_the_window_changed(path, monkeypatch):
+    service = DurableSessionService(path)
+    session = asyncio.run(service.create_session(app_name="app", user_id="alice", session_id="s1"))
+    asyncio.run(service.append_event(session, event("kept", {"step": 1})))
+
+    def fail(*args):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(service, "_update_scoped_state", fail)
+    with pytest.raises(sqlite3.OperationalError):
+        asyncio.run(service.append_event(session, event("lost", {"step": 2, "user:b": 1})))
+    monkeypatch.undo()
+
+    assert not service._conn.in_transaction
+    cached = asyncio.run(service.get_session(app_name="app", user_id="alice", session_id="s1"))
+    assert (texts(cached), cached.state) == (["kept"], {"step": 1})
+    asyncio.run(service.append_event(session, event("after")))
+    reloaded = asyncio.run(DurableSessionService(path).get_session(app_name="app", user_id="alice", session_id="s1"))
+    assert texts(reloaded) == ["kept", "after"]
+
+
+def test_an_event_is_stored_once_even_when_its_window_is_loaded_from_disk(path):
+    service = DurableSessionService(path, max_sessions=1)
+
+    async def run():
+        first = await service.create_session(app_name="app", user_id="alice", session_id="s1")
+        await service.create_session(app_name="app", user_id="alice", session_id="s2")  # evicts s1
+        repeated = event("once")
+        await service.append_event(first, repeated)
+        await service.append_event(first, repeated)
+        return await service.get_session(app_name="app", user_id="alice", session_id="s1")
+
+    assert texts(asyncio.run(run())) == ["once"]
+
+
+def test_deleted_sessions_are_gone_from_disk_and_memory(path):
+    service = DurableSessionService(path)
+
+    async def run():
+        session = await service.create_session(app_name="app", user_id="alice", session_id="s1")
+        await service.append_event(session, event("hello"))
+        await service.delete_session(app_name="app", user_id="alice", session_id="s1")
+        listed = await service.list_sessions(app_name="app", user_id="alice")
+        return await service.get_session(app_name="app", user_id="alice", session_id="s1"), listed
+
+    found, listed = asyncio.run(run())
+    assert found is None and listed.sessions == []
+    assert service._conn.execute("SELECT COUNT(*) FROM events").fetchone()[0] == 0
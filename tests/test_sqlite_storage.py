@@ -0,0 +1,184 @@
+"""SQLiteBackend schema, storage, change log and transactions."""
+import sqlite3
+import threading
+
+import pytest
+
+from compression import Codec
+from memory import CouchbaseMemory
+from storage import SQLiteBackend, create_backend
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "memory.db")
+
+
+@pytest.fixture
+def backend(path):
+    return SQLiteBackend(path, change_log=True)
+
+
+def values(count: int, prefix: str = "value") -> list:
+    return [f"{prefix} {index}" for index in range(count)]
+
+
+def test_the_schema_is_created_once_by_concurrent_openers(path):
+    opened, errors = [], []
+
+    def open_store():
+        try:
+            opened.append(SQLiteBackend(path, change_log=True))
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=open_store) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors and len(opened) == 4
+    opened[0].append("alice", "notes", "one")
+    assert [store.read("alice", "notes") for store in opened] == [["one"]] * 4
+
+    conn = sqlite3.connect(path)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == SQLiteBackend.SCHEMA_VERSION
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert {"memory", "trimmed", "changes", "change_checkpoints"} <= tables
+    conn.close()
+
+
+def test_memory_can_be_configured_to_use_sqlite(path, monkeypatch):
+    backend = create_backend("sqlite", sqlite_path=path, scope_name="agent", change_log=True)
+    assert (backend.namespace, backend.change_log) == ("agent.memory", True)
+    with pytest.raises(ValueError, match="Unknown memory backend"):
+        create_backend("redis")
+
+    monkeypatch.setenv("MEMORY_BACKEND", "sqlite")
+    monkeypatch.setenv("MEMORY_SQLITE_PATH", path)
+    monkeypatch.setenv("MEMORY_CHANGE_LOG", "on")
+    memory = CouchbaseMemory(scope_name="agent")
+    assert isinstance(memory.backend, SQLiteBackend) and memory.backend.change_log
+    memory.add("alice", "notes", "shared")
+    assert backend.read("alice", "notes") == ["shared"]
+
+
+def test_appends_are_deduplicated_ignoring_whitespace(backend):
+    assert backend.append("alice", "notes", "hello  world")
+    assert not backend.append("alice", "notes", "hello world")
+    assert backend.append("alice", "notes", {"a": 1})
+    assert backend.append_many("alice", "notes", ["x", "hello world", "y", "x"]) == 2
+    assert backend.read("alice", "notes") == ["hello  world", {"a": 1}, "x", "y"]
+    assert backend.read("alice", "other") == []
+    assert backend.read("bob", "notes") == []
+
+
+def test_reads_return_pages_and_batches(backend):
+    backend.append_many("alice", "notes", values(10))
+    backend.append("bob", "notes", "bob's")
+    assert backend.read_page("alice", "notes", 3, 4) == (values(10)[3:7], 10)
+    assert backend.read_page("alice", "notes", 8) == (values(10)[8:], 10)
+    found = backend.read_many([("alice", "notes"), ("bob", "notes"), ("carol", "notes"), ("bob", "notes")])
+    assert found == {("alice", "notes"): values(10), ("bob", "notes"): ["bob's"], ("carol", "notes"): []}
+
+
+def test_namespaces_sharing_a_file_are_separate(path):
+    first = SQLiteBackend(path, namespace="agent.memory")
+    second = SQLiteBackend(path, namespace="real_estate.memory")
+    first.append("alice", "notes", "only here")
+    assert second.read("alice", "notes") == []
+    assert second.append("alice", "notes", "only here")
+
+
+def test_values_survive_reopening_with_compression(path):
+    backend = SQLiteBackend(path, codec=Codec("zlib", min_size=16))
+    long_value = {"body": "the same sentence again " * 20}
+    backend.append("alice", "notes", long_value)
+    assert SQLiteBackend(path).read("alice", "notes") == [long_value]
+
+
+def test_trim_removes_only_the_leading_run_and_remembers_it(backend):
+    backend.append_many("alice", "notes", values(5))
+    assert backend.trim("alice", "notes", ["value 1"]) == 0
+    assert backend.trim("alice", "notes", ["value 0", "value 1", "other"]) == 2
+    assert backend.read("alice", "notes") == values(5)[2:]
+    assert not backend.append("alice", "notes", "value 0")
+    assert backend.append_many("alice", "notes", ["value 1", "new"]) == 1
+    assert backend.read_page("alice", "notes", 0, 2) == (["value 2", "value 3"], 4)
+
+
+def test_trim_can_forget_the_removed_values(backend):
+    backend.append_many("alice", "notes", values(3))
+    assert backend.trim("alice", "notes", values(2), forget=True) == 2
+    assert backend.append_many("alice", "notes", ["value 0", "value 2"]) == 1
+    assert backend.read("alice", "notes") == ["value 2", "value 0"]
+
+
+def test_a_write_that_hits_a_locked_database_is_rolled_back(backend, path):
+    backend._conn.execute("PRAGMA busy_timeout = 0")
+    backend.append("alice", "notes", "before")
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    try:
+        with pytest.raises(sqlite3.OperationalError, match="locked"):
+            backend.append("alice", "notes", "during")
+        with pytest.raises(sqlite3.OperationalError, match="locked"):
+            backend.append_many("alice", "notes", ["during", "also during"])
+        with pytest.raises(sqlite3.OperationalError, match="locked"):
+            backend.trim("alice", "notes", ["before"])
+    finally:
+        other.execute("ROLLBACK")
+        other.close()
+
+    assert not backend._conn.in_transaction
+    assert backend.append("alice", "notes", "after")
+    assert backend.append_many("alice", "notes", ["during", "after"]) == 1
+    assert backend.read("alice", "notes") == ["before", "after", "during"]
+    assert [change["values"] for change in backend.read_changes()] == [["before"], ["after"], ["during"]]
+
+
+def test_a_failed_write_leaves_no_partial_change(backend, monkeypatch):
+    def fail(*args):
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(backend, "_record_change", fail)
+    with pytest.raises(RuntimeError):
+        backend.append("alice", "notes", "lost")
+    monkeypatch.undo()
+    assert backend.read("alice", "notes") == []
+    assert backend.append("alice", "notes", "lost")
+
+
+def test_change_log_records_writes_and_checkpoints(backend):
+    backend.append("alice", "notes", "one")
+    backend.append("alice", "notes", "one")
+    backend.append_many("bob", "tasks", ["two", "three"])
+    backend.trim("alice", "notes", ["one"])
+
+    changes = backend.read_changes()
+    assert [(change["user_id"], change["op"], change["values"]) for change in changes] == [
+        ("alice", "append", ["one"]),
+        ("bob", "append", ["two", "three"]),
+        ("alice", "trim", ["one"]),
+    ]
+    assert {change["partition"] for change in changes} == {0}
+    assert backend.last_change() == changes[-1]["seq"]
+    assert backend.read_changes(changes[0]["seq"], limit=1) == [changes[1]]
+
+    assert backend.load_checkpoint("digest") == [0]
+    backend.save_checkpoint("digest", [changes[1]["seq"]])
+    assert SQLiteBackend(backend.path, change_log=True).load_checkpoint("digest") == [changes[1]["seq"]]
+
+
+def test_the_change_log_has_one_partition(backend):
+    assert backend.change_partitions == 1
+    with pytest.raises(ValueError):
+        backend.read_changes(0, partition=1)
+    with pytest.raises(ValueError):
+        backend.last_change(1)
+
+
+def test_without_change_log_nothing_is_recorded(path):
+    backend = SQLiteBackend(path)
+    backend.append("alice", "notes", "one")
+    assert backend.read_changes() == []
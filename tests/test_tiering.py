@@ -0,0 +1,99 @@
+"""EmailTiering moving cold emails, their embeddings and thread digests out of the hot tier."""
+from datetime import date
+
+import numpy as np
+import pytest
+
+from email_index import make_email
+from memory import CouchbaseMemory
+from storage import SQLiteBackend, content_digest
+from tiering import EmailTiering
+from vectors import decode_vector, encode_vector
+
+TODAY = date(2026, 10, 18)
+
+
+@pytest.fixture
+def memory(tmp_path):
+    return CouchbaseMemory(backend=SQLiteBackend(str(tmp_path / "memory.db")))
+
+
+def emails(count: int, dated: str = "2023-03-01", first: int = 0) -> list:
+    return [
+        make_email(f"sender{index}@example.com", "me@example.com", dated, f"Thread {index % 3}", f"body {index}")
+        for index in range(first, first + count)
+    ]
+
+
+def vector(email: dict) -> str:
+    return encode_vector(content_digest(email), "test", np.ones(4))
+
+
+def test_the_newest_hot_items_stay_hot_however_old(memory):
+    stored = emails(10)
+    memory.add_many("alice", "emails", stored)
+    tiering = EmailTiering(memory, hot_items=4, max_age_days=30)
+
+    assert tiering.compact("alice", TODAY) == 6
+    assert memory.search_by_category("alice", "emails") == stored[6:]
+    assert memory.search_by_category("alice", "emails_archive") == stored[:6]
+    assert tiering.compact("alice", TODAY) == 0
+
+
+def test_the_age_limit_keeps_recent_emails_beyond_hot_items(memory):
+    stored = emails(6) + emails(4, "2026-10-01", first=6)
+    memory.add_many("alice", "emails", stored)
+    tiering = EmailTiering(memory, hot_items=2, max_age_days=30)
+
+    assert tiering.compact("alice", TODAY) == 6
+    assert memory.search_by_category("alice", "emails") == stored[6:]
+
+
+def test_without_an_age_limit_every_email_beyond_hot_items_is_archived(memory):
+    stored = emails(7, "2026-10-17")
+    memory.add_many("alice", "emails", stored)
+    tiering = EmailTiering(memory, hot_items=3, batch_size=2)
+
+    assert tiering.compact_step("alice", TODAY) == 2
+    assert tiering.compact("alice", TODAY) == 2
+    assert memory.search_by_category("alice", "emails") == stored[4:]
+
+
+def test_embeddings_move_with_their_emails(memory):
+    stored = emails(10)
+    memory.add_many("alice", "emails", stored)
+    # Embedding 8 was written early, so it holds back the ones behind it.
+    order = [0, 1, 8, 2, 3, 4, 5, 6, 7, 9]
+    memory.add_many("alice", "emails_vectors", [vector(stored[index]) for index in order])
+    tiering = EmailTiering(memory, hot_items=4)
+
+    assert tiering.compact("alice", TODAY) == 6
+    archived = memory.search_by_category("alice", "emails_archive_vectors")
+    assert archived == [vector(stored[index]) for index in [0, 1, 2, 3, 4, 5]]
+    assert memory.search_by_category("alice", "emails_vectors") == [vector(stored[index]) for index in order[2:]]
+
+    later = emails(4, first=10)
+    memory.add_many("alice", "emails", later)
+    memory.add_many("alice", "emails_vectors", [vector(email) for email in later])
+    assert tiering.compact("alice", TODAY) == 4
+    archived = memory.search_by_category("alice", "emails_archive_vectors")
+    assert sorted(decode_vector(record)[0] for record in archived) == sorted(content_digest(e) for e in stored)
+    assert memory.search_by_category("alice", "emails_vectors") == [vector(email) for email in later]
+
+
+def test_thread_digests_are_bounded_and_forgotten_when_rewritten(memory):
+    memory.add_many("alice", "emails", emails(12))
+    tiering = EmailTiering(memory, hot_items=2, batch_size=2, max_digests=2)
+
+    assert tiering.compact("alice", TODAY) == 10
+    digests = tiering.digests("alice")
+    assert len(digests) == 2
+    assert {digest["generation"] for digest in digests} == {5}
+    assert sum(digest["count"] for digest in digests) <= 10
+    trimmed = memory.backend._conn.execute(
+        "SELECT COUNT(*) FROM trimmed WHERE category = 'emails_digests'"
+    ).fetchone()[0]
+    assert trimmed == 0
+    assert memory.backend._conn.execute(
+        "SELECT COUNT(*) FROM trimmed WHERE category = 'emails'"
+    ).fetchone()[0] == 10
@@ -0,0 +1,87 @@
+"""Hashing embeddings, their storage encoding and VectorIndex search."""
+import numpy as np
+import pytest
+
+from email_index import EmailIndex, make_email
+from memory import CouchbaseMemory
+from storage import SQLiteBackend, content_digest
+from vectors import HashingEmbedder, VectorIndex, decode_vector, encode_vector
+
+
+@pytest.fixture
+def memory(tmp_path):
+    return CouchbaseMemory(backend=SQLiteBackend(str(tmp_path / "memory.db")))
+
+
+def unit_vectors(count: int, dim: int = 32, seed: int = 1) -> np.ndarray:
+    vectors = np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_embeddings_are_deterministic_unit_vectors():
+    embedder = HashingEmbedder(dim=64)
+    first = embedder.embed("Viewing on Saturday at the flat")
+    assert first.shape == (64,) and first.dtype == np.float32
+    assert np.linalg.norm(first) == pytest.approx(1.0)
+    assert np.array_equal(first, HashingEmbedder(dim=64).embed("Viewing on Saturday at the flat"))
+    similar = embedder.embed("viewing the flat on saturday")
+    unrelated = embedder.embed("quarterly tax invoice overdue")
+    assert first @ similar > first @ unrelated
+    assert not embedder.embed("").any()
+
+
+def test_vectors_round_trip_through_storage_as_float16():
+    vector = unit_vectors(1)[0]
+    key, model, decoded = decode_vector(encode_vector("k1", "hashing-32", vector))
+    assert (key, model) == ("k1", "hashing-32")
+    assert decoded.dtype == np.float32
+    assert np.allclose(decoded, vector, atol=1e-3)
+
+
+def test_exact_search_ranks_by_cosine_and_grows():
+    vectors = unit_vectors(40)
+    index = VectorIndex(32)
+    for position, vector in enumerate(vectors):
+        index.add(f"k{position}", vector)
+    index.add("k0", -vectors[0])
+    assert len(index) == 40 and "k39" in index
+
+    hits = index.search(vectors[7], limit=3)
+    assert hits[0][0] == "k7" and hits[0][1] == pytest.approx(1.0)
+    assert [score for _, score in hits] == sorted((score for _, score in hits), reverse=True)
+    assert [key for key, _ in index.search(vectors[7], within={"k3", "k7", "missing"})] == ["k7", "k3"]
+    assert index.search(vectors[7], within={"missing"}) == []
+    assert len(index.search(vectors[7], limit=100)) == 40
+    assert VectorIndex(32).search(vectors[0]) == []
+
+
+def test_lsh_candidates_find_near_duplicates():
+    vectors = unit_vectors(300)
+    index = VectorIndex(32, approximate_above=100, tables=4, bits=4)
+    for position, vector in enumerate(vectors):
+        index.add(f"k{position}", vector)
+    query = vectors[123] + 0.01 * unit_vectors(1, seed=2)[0]
+    assert index.search(query / np.linalg.norm(query), limit=1)[0][0] == "k123"
+    # Too few candidates in the query's buckets falls back to an exact scan.
+    assert len(index.search(vectors[5], limit=250)) == 250
+
+
+def test_semantic_find_embeds_each_email_once(memory):
+    embedder = HashingEmbedder(dim=128)
+    older = make_email("ana@example.com", "me", "2026-01-01", "Keys", "collect the keys from the agent")
+    memory.add("alice", "emails", older)
+    index = EmailIndex(memory, embedder=embedder)
+
+    newer = make_email("bo@example.com", "me", "2026-01-02", "Mortgage", "mortgage offer from the bank")
+    memory.add("alice", "emails", newer)
+    index.add("alice", newer)
+    assert index.find("alice", "bank mortgage offer", semantic=True, limit=1) == [newer]
+    assert index.find("alice", "agent keys", semantic=True, sender="bo") == [newer]
+
+    stored = memory.search_by_category("alice", "emails_vectors")
+    assert sorted(decode_vector(record)[0] for record in stored) == sorted(
+        [content_digest(older), content_digest(newer)]
+    )
+    reloaded = EmailIndex(memory, embedder=embedder)
+    assert reloaded.find("alice", "collect keys", semantic=True, limit=1) == [older]
+    assert len(memory.search_by_category("alice", "emails_vectors")) == 2
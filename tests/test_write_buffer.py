@@ -0,0 +1,108 @@
+"""Turn-scoped write buffering: batching, read-your-writes and flushes that fail."""
+import asyncio
+
+import pytest
+
+from memory import AsyncCouchbaseMemory, CouchbaseMemory
+from storage import SQLiteBackend
+
+
+@pytest.fixture
+def memory(tmp_path):
+    return CouchbaseMemory(backend=SQLiteBackend(str(tmp_path / "memory.db")))
+
+
+@pytest.fixture
+def appends(memory, monkeypatch):
+    """Record the backend's batched appends as (category, values)."""
+    calls = []
+    append_many = memory.backend.append_many
+
+    def recording(user_id, category, values):
+        calls.append((category, list(values)))
+        return append_many(user_id, category, values)
+
+    monkeypatch.setattr(memory.backend, "append_many", recording)
+    return calls
+
+
+def test_a_turn_writes_each_category_once_when_it_ends(memory, appends):
+    with memory.turn():
+        memory.add("alice", "notes", "one")
+        memory.add("alice", "tasks", "call")
+        memory.add("alice", "notes", "two")
+        assert memory.backend.read("alice", "notes") == []
+    assert sorted(appends) == [("notes", ["one", "two"]), ("tasks", ["call"])]
+    assert memory.search_by_category("alice", "notes") == ["one", "two"]
+
+
+def test_a_read_inside_the_turn_flushes_only_its_category(memory, appends):
+    with memory.turn():
+        memory.add("alice", "notes", "one")
+        memory.add("alice", "tasks", "call")
+        assert memory.search_by_category("alice", "notes") == ["one"]
+        assert appends == [("notes", ["one"])]
+    assert appends == [("notes", ["one"]), ("tasks", ["call"])]
+
+
+def test_a_full_buffer_is_flushed_early(memory, appends):
+    with memory.turn(max_items=2):
+        memory.add("alice", "notes", "one")
+        memory.add("alice", "notes", "two")
+        assert appends == [("notes", ["one", "two"])]
+        memory.add("alice", "notes", "three")
+    assert memory.search_by_category("alice", "notes") == ["one", "two", "three"]
+
+
+def test_writes_are_flushed_when_the_turn_raises(memory):
+    with pytest.raises(RuntimeError):
+        with memory.turn():
+            memory.add("alice", "notes", "kept")
+            raise RuntimeError("tool failed")
+    assert memory.backend.read("alice", "notes") == ["kept"]
+
+
+def test_a_failed_flush_keeps_the_values_it_did_not_write(memory, monkeypatch):
+    append_many = memory.backend.append_many
+    failures = []
+
+    def failing_once(user_id, category, values):
+        if category == "tasks" and not failures:
+            failures.append(category)
+            raise ConnectionError("store unavailable")
+        return append_many(user_id, category, values)
+
+    monkeypatch.setattr(memory.backend, "append_many", failing_once)
+    token = memory.begin_turn(max_items=3)
+    memory.add("alice", "notes", "one")
+    memory.add("alice", "tasks", "call")
+    with pytest.raises(ConnectionError):
+        memory.add("alice", "reminders", "tomorrow")
+    assert memory.backend.read("alice", "notes") == ["one"]
+    assert memory.backend.read("alice", "tasks") == []
+    buffer = memory.end_turn(token)
+
+    assert memory.flush(buffer) == 2
+    assert memory.backend.read("alice", "tasks") == ["call"]
+    assert memory.backend.read("alice", "reminders") == ["tomorrow"]
+    assert buffer.take() == {}
+
+
+def test_concurrent_async_turns_keep_separate_buffers(memory, appends):
+    async_memory = AsyncCouchbaseMemory(memory)
+
+    async def session(user_id: str, started: asyncio.Event, other: asyncio.Event):
+        async with async_memory.turn():
+            await async_memory.add(user_id, "notes", f"{user_id} one")
+            started.set()
+            await other.wait()
+            await async_memory.add(user_id, "notes", f"{user_id} two")
+            assert memory.backend.read(user_id, "notes") == []
+
+    async def run():
+        first, second = asyncio.Event(), asyncio.Event()
+        await asyncio.gather(session("alice", first, second), session("bob", second, first))
+
+    asyncio.run(run())
+    assert sorted(appends) == [("notes", ["alice one", "alice two"]), ("notes", ["bob one", "bob two"])]
+    assert memory.search_by_category("bob", "notes") == ["bob one", "bob two"]
@@ -0,0 +1,296 @@
+"""
+Compact cold emails into an archive tier and per-thread digests.
+
+Usage:
+    python tiering.py --user alice
+    python tiering.py --user alice --user bob --hot-items 200 --max-age-days 30
+
+The ``emails`` category is the hot tier: it keeps the newest emails, and
+it is what retrieval loads. The newest ``hot_items`` emails always stay
+hot. Older ones are cold, or with ``max_age_days`` only once they are dated
+longer ago than that. Compaction moves cold emails, oldest first and one
+batch at a time, into ``emails_archive``, which has its own documents,
+search index and vectors. Each thread that loses emails gets a short digest
+in ``emails_digests`` (subject, participants, date range, count, latest
+message). At most ``max_digests`` digests are kept, for the most recently
+active threads, so hot reads stay bounded however old the account is.
+
+A pass archives first and trims the hot tier last, so an interrupted pass
+loses nothing. Re-running it archives the same emails again, which the
+archive's duplicate check absorbs.
+"""
+import argparse
+import asyncio
+import os
+import threading
+from datetime import date, timedelta
+from itertools import takewhile
+
+from dotenv import load_dotenv
+
+from email_index import as_email, normalize_date, thread_key
+from instrumentation import get_instrumentation
+from paging import snippet
+from storage import content_digest
+from vectors import decode_vector
+
+MAX_PARTICIPANTS = 8
+DIGEST_SNIPPET_CHARS = 280
+
+
+class EmailTiering:
+    """Moves cold emails from the hot category to an archive, leaving thread digests."""
+
+    def __init__(
+        self,
+        memory,
+        category: str = "emails",
+        hot_items: int = 500,
+        max_age_days: int = None,
+        batch_size: int = 100,
+        max_digests: int = 200,
+        indexes: list = (),
+    ):
+        """
+        Args:
+            memory (CouchbaseMemory): Memory system holding the emails
+            category (str): Hot category; the archive and digests are stored next to it
+            hot_items (int): Newest emails always kept hot
+            max_age_days (int): Archive emails beyond ``hot_items`` only once they are
+                dated longer ago than this; None archives all of them
+            batch_size (int): Emails examined and moved per compaction step
+            max_digests (int): Thread digests kept hot, most recently active first
+            indexes (list): EmailIndex instances over the hot or archive category,
+                reloaded after emails move
+        """
+        self.memory = memory
+        self.category = category
+        self.archive_category = f"{category}_archive"
+        self.digest_category = f"{category}_digests"
+        self.hot_items = hot_items
+        self.max_age_days = max_age_days
+        self.batch_size = batch_size
+        self.max_digests = max_digests
+        self.indexes = list(indexes)
+        self._lock = threading.Lock()
+        self._pending = set()
+
+    def _cold_prefix(self, items: list, total: int, today: date) -> list:
+        """The leading items beyond the newest ``hot_items`` that are old enough (or undated) to archive."""
+        cutoff = None
+        if self.max_age_days is not None:
+            cutoff = (today - timedelta(days=self.max_age_days)).isoformat()
+        cold = []
+        for index, value in enumerate(items):
+            if total - index <= self.hot_items:
+                break
+            dated = normalize_date(as_email(value)["date"])
+            if cutoff and dated and dated >= cutoff:
+                break
+            cold.append(value)
+        return cold
+
+    def compact_step(self, user_id: str, today: date = None) -> int:
+        """
+        Archive the next batch of a user's cold emails.
+
+        Args:
+            user_id (str): Owner of the emails
+            today (date): Date the age limit is measured from, today by default
+
+        Returns:
+            int: Number of emails moved out of the hot tier, 0 when none are cold
+        """
+        metrics = get_instrumentation()
+        with self._lock, metrics.span("tiering.compact", category=self.category):
+            items, total = self.memory.search_page(user_id, self.category, 0, self.batch_size)
+            cold = self._cold_prefix(items, total, today or date.today())
+            if not cold:
+                return 0
+            self.memory.add_many(user_id, self.archive_category, cold)
+            self._move_vectors(user_id, {content_digest(value) for value in cold}, len(cold))
+            self._update_digests(user_id, [as_email(value) for value in cold])
+            moved = self.memory.trim(user_id, self.category, cold)
+        for index in self.indexes:
+            index.invalidate(user_id)
+        metrics.count("tiering_archived_total", moved)
+        metrics.log("INFO", "tiering.archived", user_id=user_id, archived=moved, hot=total - moved)
+        return moved
+
+    def compact(self, user_id: str, today: date = None) -> int:
+        """
+        Archive all of a user's cold emails, one batch at a time.
+
+        Args:
+            user_id (str): Owner of the emails
+            today (date): Date the age limit is measured from, today by default
+
+        Returns:
+            int: Number of emails moved out of the hot tier
+        """
+        moved = 0
+        while True:
+            step = self.compact_step(user_id, today)
+            if not step:
+                return moved
+            moved += step
+
+    def _move_vectors(self, user_id: str, keys: set, hot_offset: int) -> None:
+        """
+        Copy the stored embeddings of archived emails next to the archive.
+
+        Embeddings are not stored in email order: backfills, change-log
+        updates and parallel ingestion append them as they go. The ones to
+        copy are therefore picked by key, reading the embeddings a page at a
+        time from the front until all of them are found. The hot category can
+        only be trimmed from the front, so only the leading run of embeddings
+        whose emails have all left the hot tier is removed. The run usually
+        ends at the embedding of an email in the next page of the hot tier;
+        only when it does not is the whole hot tier read, to tell embeddings
+        of emails archived earlier from those of hot ones. The hot index
+        ignores the embeddings of emails it does not hold.
+
+        Args:
+            user_id (str): Owner of the emails
+            keys (set): Content digests of the emails being archived
+            hot_offset (int): Position of the first email staying hot
+        """
+        category = f"{self.category}_vectors"
+        # Embeddings are written after their emails, so reading them first
+        # means every hot email they belong to is in the reads that follow.
+        records, missing, total = [], set(keys), None
+        while missing and (total is None or len(records) < total):
+            page, total = self.memory.search_page(user_id, category, len(records), 2 * self.batch_size)
+            if not page:
+                break
+            records += page
+            missing -= {decode_vector(record)[0] for record in page}
+        moving = [record for record in records if decode_vector(record)[0] in keys]
+        if moving:
+            self.memory.add_many(user_id, f"{self.archive_category}_vectors", moving)
+
+        archived = list(takewhile(lambda record: decode_vector(record)[0] in keys, records))
+        if len(archived) < len(records):
+            blocking = decode_vector(records[len(archived)])[0]
+            window, _ = self.memory.search_page(user_id, self.category, hot_offset, self.batch_size)
+            if blocking not in {content_digest(value) for value in window}:
+                hot = self.memory.search_by_category(user_id, self.category)
+                hot = {content_digest(value) for value in hot} - keys
+                archived = list(takewhile(lambda record: decode_vector(record)[0] not in hot, records))
+        if archived:
+            self.memory.trim(user_id, category, archived)
+
+    def _update_digests(self, user_id: str, emails: list) -> None:
+        """Fold archived emails into their thread digests and rewrite the digest set."""
+        stored = self.memory.search_by_category(user_id, self.digest_category)
+        generation = max((digest["generation"] for digest in stored), default=0) + 1
+        digests = {digest["thread"]: dict(digest) for digest in stored}
+        for email in emails:
+            key = thread_key(email["subject"])
+            dated = normalize_date(email["date"]) or ""
+            digest = digests.setdefault(
+                key,
+                {"thread": key, "subject": email["subject"], "participants": [],
+                 "first_date": dated, "last_date": dated, "count": 0, "latest": ""},
+            )
+            digest["count"] += 1
+            for participant in (email["from"], email["to"]):
+                if participant and participant not in digest["participants"]:
+                    digest["participants"] = (digest["participants"] + [participant])[-MAX_PARTICIPANTS:]
+            if dated and (not digest["first_date"] or dated < digest["first_date"]):
+                digest["first_date"] = dated
+            if dated >= digest["last_date"]:
+                digest["last_date"] = dated
+                digest["subject"] = email["subject"]
+                digest["latest"] = snippet(email["body"], DIGEST_SNIPPET_CHARS)
+
+        kept = sorted(digests.values(), key=lambda digest: digest["last_date"], reverse=True)
+        kept = [{**digest, "generation": generation} for digest in kept[: self.max_digests]]
+        # The new set is appended after the old one, then the old one is
+        # trimmed away and forgotten, so the category's digests stay bounded too.
+        self.memory.add_many(user_id, self.digest_category, kept)
+        if stored:
+            self.memory.trim(user_id, self.digest_category, stored, forget=True)
+
+    def digests(self, user_id: str) -> list:
+        """
+        Return the digests of a user's archived threads, most recently active first.
+
+        Args:
+            user_id (str): Owner of the emails
+
+        Returns:
+            list: Digest records
+        """
+        stored = self.memory.search_by_category(user_id, self.digest_category)
+        return sorted(stored, key=lambda digest: digest["last_date"], reverse=True)
+
+    def schedule(self, user_id: str) -> None:
+        """Queue a user for the next background compaction round."""
+        self._pending.add(user_id)
+
+    async def run(self, async_memory, interval: float = 60.0) -> None:
+        """
+        Compact scheduled users in the background until cancelled.
+
+        Every ``interval`` seconds each scheduled user is compacted one batch
+        per pool call, so a large backlog never holds a storage thread for long.
+
+        Args:
+            async_memory (AsyncCouchbaseMemory): Facade whose thread pool runs the steps
+            interval (float): Seconds between compaction rounds
+        """
+        while True:
+            await asyncio.sleep(interval)
+            users, self._pending = self._pending, set()
+            for user_id in users:
+                try:
+                    while await async_memory.run(self.compact_step, user_id):
+                        pass
+                except Exception as e:
+                    self._pending.add(user_id)
+                    get_instrumentation().log(
+                        "ERROR", "tiering.failed", user_id=user_id, error=f"{type(e).__name__}: {e}"
+                    )
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--user", action="append", required=True, help="User whose emails are compacted")
+    parser.add_argument("--scope", default="agent", help="Scope holding the memory collection")
+    parser.add_argument("--collection", default="memory", help="Memory collection name")
+    parser.add_argument("--category", default="emails", help="Hot email category")
+    parser.add_argument("--hot-items", type=int, default=500, help="Newest emails always kept hot")
+    parser.add_argument(
+        "--max-age-days", type=int, help="Only archive emails older than this"
+    )
+    parser.add_argument("--batch-size", type=int, default=100, help="Emails moved per step")
+    parser.add_argument("--max-digests", type=int, default=200, help="Thread digests kept hot")
+    args = parser.parse_args()
+
+    from memory import CouchbaseMemory
+
+    memory = CouchbaseMemory(
+        conn_str=os.getenv("COUCHBASE_CONN_STR"),
+        username=os.getenv("COUCHBASE_USERNAME"),
+        password=os.getenv("COUCHBASE_PASSWORD"),
+        bucket_name=os.getenv("COUCHBASE_BUCKET"),
+        scope_name=args.scope,
+        collection_name=args.collection,
+    )
+    tiering = EmailTiering(
+        memory,
+        category=args.category,
+        hot_items=args.hot_items,
+        max_age_days=args.max_age_days,
+        batch_size=args.batch_size,
+        max_digests=args.max_digests,
+    )
+    for user_id in args.user:
+        moved = tiering.compact(user_id)
+        print(f"Archived {moved} emails for user '{user_id}'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,15 @@
 from datetime import datetime
 import random
-from typing import Dict, List
+from typing import Dict, List, Optional
 import os
 
-from memory import CouchbaseMemory
+from catalogue import catalogue_from_env, extract_profile, parse_budget
+from changes import CacheInvalidator, CallbackConsumer, ChangeFeed
+from context import get_user_id
+from instrumentation import get_instrumentation, instrument_tool
+from memory import AsyncCouchbaseMemory, CouchbaseMemory
+from paging import decode_cursor, encode_cursor, fit_to_budget
+from preferences import PreferenceContext
 
 # Initialize memory system
 persistent_data = CouchbaseMemory(
@@ -14,11 +20,37 @@ persistent_data = CouchbaseMemory(
     scope_name="real_estate",
     collection_name="memory",
 )
+async_memory = AsyncCouchbaseMemory(persistent_data)
+# Saved preferences are injected into the advisor's instruction, so it rarely needs to retrieve them
+preference_context = PreferenceContext(async_memory)
+# Listings searched by find_properties; made-up listings are suggested without one
+property_catalogue = catalogue_from_env()
+
+
+def _preferences_changed(change: Dict) -> None:
+    """Refresh what is derived from a user's preferences after any process writes them."""
+    preference_context.invalidate(change["user_id"])
+    if property_catalogue is not None:
+        property_catalogue.invalidate(change["user_id"])
+
+
+# With MEMORY_CHANGE_LOG=on, writes made by other processes reach the caches within seconds
+change_feed = ChangeFeed(
+    persistent_data,
+    [CacheInvalidator(persistent_data), CallbackConsumer("preferences", _preferences_changed)],
+) if persistent_data.backend.change_log else None
+
+
+async def follow_changes():
+    """Background job applying the change log to this process's caches."""
+    if change_feed is not None:
+        await change_feed.run(async_memory, interval=float(os.getenv("CHANGE_FEED_INTERVAL", "1")))
 
 USER_ID = "RealEstateClient"
 
 
-def save_user_preference(category: str, preference: str) -> Dict:
+@instrument_tool
+async def save_user_preference(category: str, preference: str) -> Dict:
     """
     Save user preferences to the memory system.
     
@@ -29,30 +61,52 @@ def save_user_preference(category: str, preference: str) -> Dict:
     Returns:
         Dict: Status message
     """
-    user_id = getattr(save_user_preference, "user_id", USER_ID)
-    persistent_data.add(user_id=user_id, category=category, data=preference)
+    user_id = get_user_id(USER_ID)
+    await async_memory.add(user_id=user_id, category=category, data=preference)
+    await preference_context.saved(user_id, category)
+    if property_catalogue is not None:
+        property_catalogue.invalidate(user_id)
     return {
         "status": "success",
         "message": f"Preference saved in category '{category}'.",
     }
 
 
-def retrieve_user_preferences(category: str) -> Dict:
+@instrument_tool
+async def retrieve_user_preferences(
+    category: str, limit: int = 20, cursor: Optional[str] = None
+) -> Dict:
     """
-    Retrieve user preferences from the memory system.
+    Retrieve user preferences from the memory system, oldest first, one page at a time.
     
     Args:
         category (str): Category to retrieve preferences from
+        limit (int): Maximum number of preferences to return in this page
+        cursor (str): The 'next_cursor' of a previous call, to get the following page
         
     Returns:
-        Dict: Preferences and count
+        Dict: A page of preferences, its count, the total stored and, if there
+            are more, a 'next_cursor'
     """
-    user_id = getattr(retrieve_user_preferences, "user_id", USER_ID)
-    results = persistent_data.search_by_category(user_id=user_id, category=category)
-    return {"status": "success", "preferences": results, "count": len(results)}
+    user_id = get_user_id(USER_ID)
+    try:
+        offset = decode_cursor(cursor)
+    except ValueError:
+        return {"status": "error", "message": "Invalid cursor. Retrieve again without one."}
+    results, total = await async_memory.search_page(user_id, category, offset, limit)
+    preferences = fit_to_budget(results)
+    end = offset + len(preferences)
+    return {
+        "status": "success",
+        "preferences": preferences,
+        "count": len(preferences),
+        "total": total,
+        "next_cursor": encode_cursor(end) if end < total else None,
+    }
 
 
-def find_properties(location: str, budget: str) -> Dict:
+@instrument_tool
+async def find_properties(location: str, budget: str) -> Dict:
     """
     Find suitable properties based on location and budget.
     
@@ -63,43 +117,85 @@ def find_properties(location: str, budget: str) -> Dict:
     Returns:
         Dict: Property recommendations and analysis
     """
-    user_id = getattr(save_user_preference, "user_id", USER_ID)
-    property_prefs = persistent_data.search_by_category(user_id, "property_preferences")
-
-    # Extract property preferences
-    property_type = None
-    preferred_features = []
-    investment_type = "residential"
-
-    for pref in property_prefs:
-        if "investment" in pref.lower():
-            investment_type = "investment"
-        elif "rental" in pref.lower():
-            investment_type = "rental"
-        elif "apartment" in pref.lower() or "flat" in pref.lower():
-            property_type = "apartment"
-        elif "house" in pref.lower() or "villa" in pref.lower():
-            property_type = "house"
-        elif "pool" in pref.lower():
-            preferred_features.append("pool")
-        elif "garden" in pref.lower():
-            preferred_features.append("garden")
-        elif "garage" in pref.lower():
-            preferred_features.append("garage")
-
-    # Generate property recommendations
+    user_id = get_user_id(USER_ID)
+    try:
+        max_price = parse_budget(budget)
+    except ValueError:
+        return {"status": "error", "message": "Invalid budget. Give an amount in EUR, e.g. '400000'."}
+
+    # Preferences are reduced to searchable features once per user, not on every search
+    profile = generation = None
+    if property_catalogue is not None:
+        generation = property_catalogue.generation()
+        profile = property_catalogue.cached_profile(user_id)
+    if profile is None:
+        property_prefs = await async_memory.search_by_category(user_id, "property_preferences")
+        if property_catalogue is not None:
+            profile = property_catalogue.build_profile(user_id, property_prefs, generation)
+        else:
+            profile = extract_profile(property_prefs)
+    investment_type = profile["investment_type"]
+
+    if property_catalogue is not None:
+        rows = property_catalogue.search(location, max_price=max_price, profile=profile, limit=3)
+        properties = [_describe(property_catalogue.listing(row), investment_type) for row in rows]
+    else:
+        properties = _random_properties(location, max_price, profile)
+
+    get_instrumentation().log(
+        "INFO", "tool.properties_found", location=location, properties=len(properties),
+        catalogue=property_catalogue is not None,
+    )
+    if not properties:
+        return {
+            "status": "success",
+            "properties": [],
+            "recommendation": f"No listings in {location} within a budget of {budget}. Try a nearby location or a higher budget.",
+        }
+
+    return {
+        "status": "success",
+        "properties": properties,
+        "recommendation": (
+            f"Based on your preferences and budget of {budget}, we recommend focusing on {investment_type} properties."
+            if investment_type
+            else "Please specify your investment preferences (residential, investment, or rental) for better recommendations."
+        )
+    }
+
+
+def _describe(listing: Dict, investment_type: str) -> Dict:
+    """Format a catalogue listing like the advisor's property suggestions."""
+    property_data = {
+        **listing,
+        "price": f"{listing['price']} EUR",
+        "investment_type": investment_type,
+        "notes": "",
+    }
+    if "area" in listing:
+        property_data["area"] = f"{listing['area']} m²"
+    if investment_type == "investment" and "rental_yield" in listing:
+        property_data["notes"] += f"Estimated rental yield: {listing['rental_yield']}%"
+    elif investment_type == "rental" and "monthly_rent" in listing:
+        property_data["notes"] += f"Current market rent: {listing['monthly_rent']} EUR/month"
+    return property_data
+
+
+def _random_properties(location: str, max_price: float, profile: Dict) -> List[Dict]:
+    """Make up three listings, for running without a PROPERTY_CATALOGUE file."""
+    investment_type = profile["investment_type"]
     properties = []
     for _ in range(3):  # Generate 3 property suggestions
-        property_type = property_type or random.choice(["apartment", "house"])
+        property_type = profile["type"] or random.choice(["apartment", "house"])
         
         property_data = {
             "type": property_type,
             "location": location,
-            "price": f"{random.randint(int(budget.replace('EUR', '').strip()), int(budget.replace('EUR', '').strip()) + 100000)} EUR",
+            "price": f"{random.randint(int(max_price), int(max_price) + 100000)} EUR",
             "area": f"{random.randint(80, 200)} m²",
             "rooms": random.randint(2, 5),
             "bathrooms": random.randint(1, 3),
-            "features": [f for f in preferred_features if random.random() > 0.3],
+            "features": [f for f in profile["features"] if random.random() > 0.3],
             "investment_type": investment_type,
             "notes": "",
         }
@@ -111,17 +207,4 @@ def find_properties(location: str, budget: str) -> Dict:
             property_data["notes"] += f"Current market rent: {random.randint(500, 1500)} EUR/month"
 
         properties.append(property_data)
-
-    print(
-        f"INFO: Generated {len(properties)} property suggestions for location: {location}"
-    )
-
-    return {
-        "status": "success",
-        "properties": properties,
-        "recommendation": (
-            f"Based on your preferences and budget of {budget}, we recommend focusing on {investment_type} properties."
-            if investment_type
-            else "Please specify your investment preferences (residential, investment, or rental) for better recommendations."
-        )
-    }
+    return properties
@@ -0,0 +1,186 @@
+import base64
+import json
+import re
+import zlib
+
+import numpy as np
+
+WORD = re.compile(r"\w+")
+NON_WORD = re.compile(r"\W+")
+
+
+class HashingEmbedder:
+    """
+    Local text embedder using signed feature hashing of word and character n-grams.
+
+    Needs no model download or network: unigrams, bigrams and character
+    trigrams are hashed into ``dim`` buckets, weighted sublinearly and the
+    result is L2-normalised so a dot product is the cosine similarity.
+    """
+
+    def __init__(self, dim: int = 512):
+        """
+        Args:
+            dim (int): Embedding dimensionality
+        """
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str) -> list:
+        """Extract the n-gram features of a text."""
+        words = WORD.findall(text.lower())
+        features = list(words)
+        features.extend(f"{a} {b}" for a, b in zip(words, words[1:]))
+        squashed = f" {NON_WORD.sub(' ', text.lower()).strip()} "
+        features.extend(f"#{squashed[i:i + 3]}" for i in range(len(squashed) - 2))
+        return features
+
+    def embed(self, text: str) -> np.ndarray:
+        """
+        Embed a text.
+
+        Args:
+            text (str): Text to embed
+
+        Returns:
+            np.ndarray: Unit-length float32 vector of size ``dim``
+        """
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature in self._features(text):
+            digest = zlib.crc32(feature.encode("utf-8"))
+            vector[digest % self.dim] += 1.0 if digest & 0x80000000 else -1.0
+        vector = np.sign(vector) * np.log1p(np.abs(vector))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+def encode_vector(key: str, model: str, vector: np.ndarray) -> str:
+    """
+    Serialise an embedding for storage in memory.
+
+    Args:
+        key (str): Key of the embedded document
+        model (str): Name of the embedder that produced the vector
+        vector (np.ndarray): The embedding
+
+    Returns:
+        str: JSON record with the vector as base64 float16
+    """
+    data = base64.b64encode(vector.astype(np.float16).tobytes()).decode("ascii")
+    return json.dumps({"key": key, "model": model, "vector": data})
+
+
+def decode_vector(record: str) -> tuple:
+    """
+    Deserialise an embedding written by ``encode_vector``.
+
+    Args:
+        record (str): Stored JSON record
+
+    Returns:
+        tuple: (key, model, float32 vector)
+    """
+    fields = json.loads(record)
+    vector = np.frombuffer(base64.b64decode(fields["vector"]), dtype=np.float16)
+    return fields["key"], fields["model"], vector.astype(np.float32)
+
+
+class VectorIndex:
+    """
+    Top-k cosine search over embeddings held in one contiguous matrix.
+
+    Rows are appended in place (capacity doubles when full) and queries are a
+    single matrix-vector product. Above ``approximate_above`` rows, random
+    hyperplane LSH tables narrow the candidates before exact re-ranking.
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        approximate_above: int = 20000,
+        tables: int = 8,
+        bits: int = 12,
+        seed: int = 0,
+    ):
+        """
+        Args:
+            dim (int): Embedding dimensionality
+            approximate_above (int): Row count from which LSH candidates are used
+            tables (int): Number of LSH hash tables
+            bits (int): Hyperplanes per table
+            seed (int): Seed for the hyperplanes
+        """
+        self.dim = dim
+        self.approximate_above = approximate_above
+        self.keys = []
+        self._positions = {}
+        self._matrix = np.zeros((16, dim), dtype=np.float32)
+        self._planes = np.random.default_rng(seed).standard_normal((tables, bits, dim)).astype(np.float32)
+        self._weights = (1 << np.arange(bits)).astype(np.int64)
+        self._codes = np.zeros((16, tables), dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._positions
+
+    def _hash(self, vectors: np.ndarray) -> np.ndarray:
+        """Compute the LSH bucket of each vector in every table."""
+        bits = np.einsum("tbd,nd->ntb", self._planes, vectors) > 0
+        return bits @ self._weights
+
+    def add(self, key: str, vector: np.ndarray) -> None:
+        """
+        Add an embedding, ignoring keys that are already indexed.
+
+        Args:
+            key (str): Key of the embedded document
+            vector (np.ndarray): Unit-length embedding
+        """
+        if key in self._positions:
+            return
+        row = len(self.keys)
+        if row == len(self._matrix):
+            self._matrix = np.concatenate([self._matrix, np.zeros_like(self._matrix)])
+            self._codes = np.concatenate([self._codes, np.zeros_like(self._codes)])
+        self._matrix[row] = vector
+        self._codes[row] = self._hash(vector[None, :])[0]
+        self._positions[key] = row
+        self.keys.append(key)
+
+    def search(self, vector: np.ndarray, limit: int = 10, within: set = None) -> list:
+        """
+        Find the embeddings most similar to a query vector.
+
+        Args:
+            vector (np.ndarray): Unit-length query embedding
+            limit (int): Maximum number of results
+            within (set): Only consider these keys
+
+        Returns:
+            list: (key, cosine similarity) pairs, best match first
+        """
+        count = len(self.keys)
+        if not count:
+            return []
+        rows = None
+        if within is not None:
+            rows = np.array(
+                sorted(self._positions[key] for key in within if key in self._positions),
+                dtype=np.int64,
+            )
+            if not len(rows):
+                return []
+        elif count > self.approximate_above:
+            query_codes = self._hash(vector[None, :])[0]
+            rows = np.flatnonzero((self._codes[:count] == query_codes).any(axis=1))
+            if len(rows) < limit:
+                rows = None
+        matrix = self._matrix[:count] if rows is None else self._matrix[rows]
+        scores = matrix @ vector
+        limit = min(limit, len(scores))
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+        positions = top if rows is None else rows[top]
+        return [(self.keys[p], float(s)) for p, s in zip(positions, scores[top])]